@@ -1,9 +1,33 @@
-from sqlalchemy import create_engine
+import os
+
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, declarative_base
 
-# SQLite DB stored in the repository folder (states.db)
-DATABASE_URL = "sqlite:///./states.db"
+# SQLite DB stored in the repository folder (states.db) unless DATABASE_URL is set
+DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///./states.db")
+
+# Sessions check connections out of a pool sized for the request/operator
+# threads instead of opening the database file per request. LIFO checkout
+# keeps reusing the warmest connections; recycling bounds their lifetime.
+engine = create_engine(
+    DATABASE_URL,
+    pool_size=16,
+    max_overflow=16,
+    pool_recycle=3600,
+    pool_use_lifo=True,
+    connect_args={"check_same_thread": False}
+)
+
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Tune each new SQLite connection: WAL journal, no fsync per commit."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
@@ -3,15 +3,32 @@
 This module provides centralized logging configuration that ensures consistent
 log formatting and output across INTEL, OPERATOR, and OBSERVER services.
 Includes log rotation to prevent large log files.
+
+Records are handed to a QueueHandler on the root logger and written out by a
+QueueListener thread, so request threads never block on formatting or file IO.
+File output is buffered and flushed every second, or immediately on ERROR.
 """
+import atexit
 import logging
 import logging.handlers
+import queue
 import sys
 import os
+import threading
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional
 
 
+_LOG_LEVEL_MAP = {
+    "DEBUG": logging.DEBUG,
+    "INFO": logging.INFO,
+    "WARNING": logging.WARNING,
+    "ERROR": logging.ERROR,
+    "CRITICAL": logging.CRITICAL,
+}
+
+
 class UnifiedLogger:
     """Unified logger configuration for VMAN services."""
     
@@ -20,7 +37,15 @@ class UnifiedLogger:
     SERVICE_OPERATOR = "OPERATOR"
     SERVICE_OBSERVER = "OBSERVER"
     
+    # File buffering: flush every FLUSH_INTERVAL seconds, when the buffer
+    # holds BUFFER_CAPACITY records, or immediately on ERROR and above
+    BUFFER_CAPACITY = 512
+    FLUSH_INTERVAL = 1.0
+    
     _configured = False
+    _listener: Optional[logging.handlers.QueueListener] = None
+    _mem_handler: Optional[logging.handlers.MemoryHandler] = None
+    _flush_stop: Optional[threading.Event] = None
     
     @classmethod
     def configure(
@@ -51,14 +76,7 @@ class UnifiedLogger:
         
         # Get configuration from environment or defaults
         level_str = log_level or os.environ.get("VMAN_LOG_LEVEL", "INFO").upper()
-        log_level_map = {
-            "DEBUG": logging.DEBUG,
-            "INFO": logging.INFO,
-            "WARNING": logging.WARNING,
-            "ERROR": logging.ERROR,
-            "CRITICAL": logging.CRITICAL,
-        }
-        level = log_level_map.get(level_str, logging.INFO)
+        level = _LOG_LEVEL_MAP.get(level_str, logging.INFO)
         
         # Get rotation settings from environment or use defaults
         max_bytes = int(os.environ.get("VMAN_LOG_MAX_BYTES", str(max_bytes)))
@@ -86,14 +104,16 @@ class UnifiedLogger:
         
         # Remove existing handlers to avoid duplicates
         root_logger.handlers.clear()
+        cls.shutdown()
         
         # Console handler (always enabled)
         console_handler = logging.StreamHandler(sys.stdout)
         console_handler.setLevel(level)
         console_handler.setFormatter(formatter)
-        root_logger.addHandler(console_handler)
+        handlers: list[logging.Handler] = [console_handler]
         
         # File handler with rotation (if log file specified)
+        file_error: Optional[Exception] = None
         if log_path:
             try:
                 # Ensure log directory exists
@@ -109,19 +129,69 @@ class UnifiedLogger:
                 )
                 file_handler.setLevel(level)
                 file_handler.setFormatter(formatter)
-                root_logger.addHandler(file_handler)
                 
-                max_mb = max_bytes / (1024 * 1024)
-                logging.info(
-                    f"Logging to file: {log_path} "
-                    f"(rotation: {max_mb:.1f}MB, backups: {backup_count})"
+                # Batch file writes instead of one write() per record
+                cls._mem_handler = logging.handlers.MemoryHandler(
+                    capacity=cls.BUFFER_CAPACITY,
+                    flushLevel=logging.ERROR,
+                    target=file_handler,
+                    flushOnClose=True
                 )
+                handlers.append(cls._mem_handler)
+                cls._flush_stop = threading.Event()
+                threading.Thread(
+                    target=cls._flush_periodically,
+                    args=(cls._mem_handler, cls._flush_stop, cls.FLUSH_INTERVAL),
+                    daemon=True,
+                    name="LogFlusher"
+                ).start()
             except Exception as e:
-                logging.warning(f"Failed to create file handler: {e}")
+                file_error = e
+        
+        # Handlers run on the listener thread; callers only enqueue records
+        log_queue: queue.SimpleQueue = queue.SimpleQueue()
+        root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        cls._listener = logging.handlers.QueueListener(
+            log_queue, *handlers, respect_handler_level=True
+        )
+        cls._listener.start()
+        
+        if file_error is not None:
+            logging.warning(f"Failed to create file handler: {file_error}")
+        elif log_path:
+            max_mb = max_bytes / (1024 * 1024)
+            logging.info(
+                f"Logging to file: {log_path} "
+                f"(rotation: {max_mb:.1f}MB, backups: {backup_count})"
+            )
         
         cls._configured = True
         logging.info(f"Unified logging configured (level={level_str}, service={service_name})")
     
+    @staticmethod
+    def _flush_periodically(handler: logging.Handler, stop_event: threading.Event,
+                            interval: float) -> None:
+        """Flush a buffering handler every `interval` seconds until stopped."""
+        while not stop_event.wait(interval):
+            handler.flush()
+    
+    @classmethod
+    def shutdown(cls) -> None:
+        """Stop the queue listener, flushing any records still queued or buffered."""
+        listener, cls._listener = cls._listener, None
+        if listener is not None:
+            listener.stop()
+        if cls._flush_stop is not None:
+            cls._flush_stop.set()
+            cls._flush_stop = None
+        cls._mem_handler = None
+        if listener is not None:
+            for handler in listener.handlers:
+                target = getattr(handler, "target", None)
+                handler.close()  # MemoryHandler flushes to its target on close
+                if target is not None:
+                    target.close()
+    
     @classmethod
     def get_logger(cls, module_name: str, service: Optional[str] = None) -> logging.Logger:
         """Get a logger for a module with service identification.
@@ -138,22 +208,7 @@ class UnifiedLogger:
         if not cls._configured:
             cls.configure()
         
-        # Infer service from module name if not provided
-        if not service:
-            if "main" in module_name or "intel" in module_name.lower():
-                service = cls.SERVICE_INTEL
-            elif "operator" in module_name.lower():
-                service = cls.SERVICE_OPERATOR
-            elif "observer" in module_name.lower():
-                service = cls.SERVICE_OBSERVER
-        
-        # Create logger name with service prefix
-        if service:
-            logger_name = f"{service}.{module_name.split('.')[-1]}"
-        else:
-            logger_name = module_name.split('.')[-1]
-        
-        return logging.getLogger(logger_name)
+        return logging.getLogger(_resolve_logger_name(module_name, service))
     
     @classmethod
     def log_request(cls, logger: logging.Logger, method: str, path: str, 
@@ -167,8 +222,12 @@ class UnifiedLogger:
             status_code: HTTP status code.
             duration_ms: Request duration in milliseconds (optional).
         """
-        duration_str = f" ({duration_ms:.2f}ms)" if duration_ms else ""
-        logger.info(f"HTTP {method} {path} -> {status_code}{duration_str}")
+        if not logger.isEnabledFor(logging.INFO):
+            return
+        if duration_ms:
+            logger.info("HTTP %s %s -> %d (%.2fms)", method, path, status_code, duration_ms)
+        else:
+            logger.info("HTTP %s %s -> %d", method, path, status_code)
     
     @classmethod
     def log_error(cls, logger: logging.Logger, operation: str, error: Exception, 
@@ -181,8 +240,13 @@ class UnifiedLogger:
             error: Exception that occurred.
             context: Additional context dictionary (optional).
         """
-        context_str = f" | Context: {context}" if context else ""
-        logger.error(f"{operation} failed: {error}{context_str}", exc_info=True)
+        if not logger.isEnabledFor(logging.ERROR):
+            return
+        if context:
+            logger.error("%s failed: %s | Context: %s", operation, error, context,
+                         exc_info=True, extra={"context": context})
+        else:
+            logger.error("%s failed: %s", operation, error, exc_info=True)
     
     @classmethod
     def log_coherence_issue(cls, logger: logging.Logger, issue_type: str, 
@@ -195,5 +259,27 @@ class UnifiedLogger:
             resource_id: Resource identifier.
             details: Issue details.
         """
-        logger.warning(f"Coherence issue [{issue_type}] {resource_id}: {details}")
+        if not logger.isEnabledFor(logging.WARNING):
+            return
+        logger.warning("Coherence issue [%s] %s: %s", issue_type, resource_id, details)
+
+
+@lru_cache(maxsize=512)
+def _resolve_logger_name(module_name: str, service: Optional[str]) -> str:
+    """Build the service-prefixed logger name for a module (memoized)."""
+    # Infer service from module name if not provided
+    if not service:
+        lowered = module_name.lower()
+        if "main" in module_name or "intel" in lowered:
+            service = UnifiedLogger.SERVICE_INTEL
+        elif "operator" in lowered:
+            service = UnifiedLogger.SERVICE_OPERATOR
+        elif "observer" in lowered:
+            service = UnifiedLogger.SERVICE_OBSERVER
+    
+    short_name = module_name.rsplit('.', 1)[-1]
+    # Create logger name with service prefix
+    return f"{service}.{short_name}" if service else short_name
+
 
+atexit.register(UnifiedLogger.shutdown)
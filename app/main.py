@@ -1,22 +1,51 @@
 from fastapi import FastAPI, HTTPException, Depends, Query, Request, Response
-from fastapi.responses import FileResponse
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from . import db, models, schemas, operator, observer, logging_config
-from sqlalchemy.orm import Session
+from . import db, models, schemas, operator, observer, logging_config, network_manager, metadata_service
+from sqlalchemy import bindparam, delete, exists, func, select, text, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session, joinedload
 from fastapi import status
+import asyncio
+import concurrent.futures
+import contextlib
+import functools
+import hashlib
 import pathlib
 import uuid
+import urllib.parse
 import time
-import json
 import os
+import threading
+import orjson
 from pathlib import Path
-from typing import Optional
+from typing import NamedTuple, Optional
 
 # Configure unified logging
 logging_config.UnifiedLogger.configure()
 logger = logging_config.UnifiedLogger.get_logger(__name__, logging_config.UnifiedLogger.SERVICE_INTEL)
 
-app = FastAPI(title="VMAN INTEL", version="0.1.0")
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Run service startup/shutdown off the event loop (both do blocking IO)."""
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, startup_event)
+    try:
+        yield
+    finally:
+        await loop.run_in_executor(None, shutdown_event)
+
+
+app = FastAPI(title="VMAN INTEL", version="0.1.0", lifespan=lifespan)
+
+
+class _ORJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson, for routes returning plain dicts/lists."""
+    
+    def render(self, content) -> bytes:
+        return orjson.dumps(content)
+
 
 app.add_middleware(
     CORSMiddleware,
@@ -27,24 +56,25 @@ app.add_middleware(
 )
 
 
+# Frequently polled, low-value paths that are not logged
+_UNLOGGED_PATHS = frozenset({"/health", "/openapi.yaml"})
+_log_request = logging_config.UnifiedLogger.log_request
+
+
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
-    """Middleware to log all HTTP requests."""
-    start_time = time.time()
-    method = request.method
-    path = request.url.path
+    """Middleware to log HTTP requests (except _UNLOGGED_PATHS)."""
+    path = request.scope["path"]
+    if path in _UNLOGGED_PATHS:
+        return await call_next(request)
     
+    start_time = time.perf_counter()
     response = await call_next(request)
-    
-    duration_ms = (time.time() - start_time) * 1000
-    logging_config.UnifiedLogger.log_request(
-        logger, method, path, response.status_code, duration_ms
-    )
+    duration_ms = (time.perf_counter() - start_time) * 1000
+    _log_request(logger, request.method, path, response.status_code, duration_ms)
     
     return response
 
-# Initialize network manager and operator
-from . import network_manager
 
 # Network configuration from environment
 _vlan_id = int(os.environ.get("VMAN_VLAN_ID", "100"))
@@ -66,14 +96,51 @@ _network_manager = network_manager.NetworkManager(
 _default_boot_disk = os.environ.get("VMAN_DEFAULT_BOOT_DISK")
 _default_boot_disk_path = Path(_default_boot_disk) if _default_boot_disk else None
 
-_operator = operator.LocalOperator(
-    network_manager=_network_manager,
-    default_boot_disk=_default_boot_disk_path
-)
+# Created on first use by get_operator(); LocalOperator probes for the QEMU
+# binaries, which importing this module should not pay for.
+_operator: Optional[operator.LocalOperator] = None
+_operator_lock = threading.Lock()
 _observer: Optional[observer.LocalObserver] = None
 _metadata_service: Optional[object] = None  # Will be metadata_service.MetadataService
 
 
+def get_operator() -> operator.LocalOperator:
+    """Return the shared LocalOperator, creating it on first use (FastAPI dependency)."""
+    global _operator
+    if _operator is None:
+        with _operator_lock:
+            if _operator is None:
+                _operator = operator.LocalOperator(
+                    network_manager=_network_manager,
+                    default_boot_disk=_default_boot_disk_path
+                )
+    return _operator
+
+
+class _StoragePaths(NamedTuple):
+    root: Path
+    vms: Path
+    disks: Path
+
+
+# (operator, its _StoragePaths) for the operator currently in use
+_storage_paths_cache: tuple = (None, None)
+
+
+def _get_storage_paths(op: operator.LocalOperator) -> _StoragePaths:
+    """Return the operator's storage root and vms/disks dirs, built once per operator."""
+    global _storage_paths_cache
+    if _storage_paths_cache[0] is not op:
+        root = Path(op.storage_path)
+        _storage_paths_cache = (op, _StoragePaths(root, root / "vms", root / "disks"))
+    return _storage_paths_cache[1]
+
+
+def _disk_path(op: operator.LocalOperator, disk_id: str) -> Path:
+    """Return the qcow2 image path for a disk."""
+    return _get_storage_paths(op).disks / f"{disk_id}.qcow2"
+
+
 def get_db():
     db_session = db.SessionLocal()
     try:
@@ -82,18 +149,109 @@ def get_db():
         db_session.close()
 
 
-@app.on_event("startup")
+# Operator calls spawn QEMU/qemu-img and can wait up to tens of seconds for a
+# graceful shutdown; they run on this bounded pool so at most this many run at
+# once, however many requests Starlette's threadpool is serving.
+_operator_pool = concurrent.futures.ThreadPoolExecutor(max_workers=8, thread_name_prefix="operator")
+
+
+def _run_operator(func, *args, **kwargs):
+    """Run a blocking operator call on the operator thread pool and wait for its result.
+
+    Called from sync endpoints, which Starlette already runs off the event loop
+    together with their DB work.
+    """
+    return _operator_pool.submit(func, *args, **kwargs).result()
+
+
+def _request_observer_check() -> None:
+    """Have the observer re-check coherence now that VM or disk state changed."""
+    if _observer:
+        _observer.request_check()
+
+
+def _insert_if_absent(db: Session, model, **values) -> bool:
+    """INSERT ... ON CONFLICT DO NOTHING; return True if a row was inserted.
+    
+    Replaces the SELECT-then-INSERT existence check with a single statement.
+    The caller is responsible for committing.
+    """
+    stmt = sqlite_insert(model).values(**values).on_conflict_do_nothing()
+    return db.execute(stmt).rowcount > 0
+
+
+# Templates are small and rarely change: cache their fields by name for a short
+# time so VM actions don't need a template query each time.
+_TEMPLATE_CACHE_TTL = 30.0
+_template_cache: dict[str, tuple[float, dict]] = {}
+
+
+def _get_template(db: Session, name: str) -> Optional[dict]:
+    """Return template fields (name, cpu_count, ram_amount) or None if not found."""
+    cached = _template_cache.get(name)
+    if cached and time.monotonic() - cached[0] < _TEMPLATE_CACHE_TTL:
+        return cached[1]
+    
+    tpl = db.get(models.VMTemplate, name)
+    if not tpl:
+        return None
+    fields = {"name": tpl.name, "cpu_count": tpl.cpu_count, "ram_amount": tpl.ram_amount}
+    _template_cache[name] = (time.monotonic(), fields)
+    return fields
+
+
+# Bump when models gain tables or indexes so existing databases are upgraded
+SCHEMA_VERSION = 2
+_schema_engine = None  # engine whose schema has been verified in this process
+
+
+def _migrate_vm_mac(conn) -> None:
+    """Add the vms.mac column to pre-version-2 databases and backfill it."""
+    columns = {row[1] for row in conn.exec_driver_sql("PRAGMA table_info(vms)")}
+    if "mac" not in columns:
+        conn.exec_driver_sql("ALTER TABLE vms ADD COLUMN mac VARCHAR(17)")
+    vm_ids = conn.scalars(select(models.VM.id).where(models.VM.mac.is_(None))).all()
+    if vm_ids:
+        conn.execute(
+            update(models.VM).where(models.VM.id == bindparam("b_id")).values(mac=bindparam("b_mac")),
+            [{"b_id": vm_id, "b_mac": operator.vm_mac_address(vm_id)} for vm_id in vm_ids]
+        )
+
+
+def _ensure_schema() -> None:
+    """Create tables and indexes unless the DB already carries SCHEMA_VERSION.
+    
+    The version is stored in SQLite's PRAGMA user_version, so a started-up
+    database costs one PRAGMA read instead of an existence check per table.
+    """
+    global _schema_engine
+    if _schema_engine is db.engine:
+        return
+    with db.engine.begin() as conn:
+        version = conn.exec_driver_sql("PRAGMA user_version").scalar()
+        if version != SCHEMA_VERSION:
+            models.Base.metadata.create_all(bind=conn)
+            _migrate_vm_mac(conn)
+            # create_all skips existing tables, so add indexes introduced since then
+            for table in models.Base.metadata.sorted_tables:
+                for index in table.indexes:
+                    index.create(bind=conn, checkfirst=True)
+            conn.exec_driver_sql(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            logger.info("Database schema initialized (version %d)", SCHEMA_VERSION)
+    _schema_engine = db.engine
+
+
 def startup_event():
     global _observer, _metadata_service
-    # create tables
-    models.Base.metadata.create_all(bind=db.engine)
+    # create tables (deployments that manage the schema externally can opt out)
+    if os.environ.get("VMAN_AUTO_CREATE_TABLES", "1") == "1":
+        _ensure_schema()
+    op = get_operator()
     
     # Initialize and start metadata service if enabled
     metadata_enabled = os.environ.get("VMAN_METADATA_ENABLED", "1") == "1"
     if metadata_enabled and _network_manager and not _network_manager.dry_run:
         try:
-            from . import metadata_service
-            
             # Ensure bridge is ready (this configures 169.254.169.254)
             _network_manager.ensure_bridge()
             
@@ -101,7 +259,7 @@ def startup_event():
             bind_ip = os.environ.get("VMAN_METADATA_BIND_IP", "169.254.169.254")
             port = int(os.environ.get("VMAN_METADATA_PORT", "80"))
             bridge_name = _network_manager.bridge_name
-            storage_path = Path(_operator.storage_path)
+            storage_path = _get_storage_paths(op).root
             
             # Start metadata service
             _metadata_service = metadata_service.MetadataService(
@@ -109,7 +267,8 @@ def startup_event():
                 storage_path=storage_path,
                 bind_ip=bind_ip,
                 port=port,
-                bridge_name=bridge_name
+                bridge_name=bridge_name,
+                network_manager=_network_manager
             )
             _metadata_service.start()
             logger.info("Metadata service started")
@@ -121,14 +280,16 @@ def startup_event():
     # Initialize and start OBSERVER service
     _observer = observer.LocalObserver(
         db_session_factory=db.SessionLocal,
-        operator=_operator,
+        operator=op,
         check_interval=5.0
     )
     _observer.start()
     logger.info("OBSERVER service started")
+    
+    # Build the OpenAPI schema now rather than on the first /openapi.json or /docs hit
+    app.openapi()
 
 
-@app.on_event("shutdown")
 def shutdown_event():
     global _observer, _metadata_service
     # Stop OBSERVER service
@@ -139,16 +300,57 @@ def shutdown_event():
     if _metadata_service:
         _metadata_service.stop()
         logger.info("Metadata service stopped")
+    # Drain queued log records last so the messages above are written
+    logging_config.UnifiedLogger.shutdown()
+
+
+# /health is polled frequently; its IO-bound probes are cached per check
+_HEALTH_PROBE_TTL = {"database": 2.0, "storage": 60.0}
+_health_cache: dict[str, tuple[float, str]] = {}
+
+
+def _cached_probe(name: str, probe) -> str:
+    """Return the cached result of a health probe, re-running it once its TTL expires."""
+    now = time.monotonic()
+    cached = _health_cache.get(name)
+    if cached and now - cached[0] < _HEALTH_PROBE_TTL[name]:
+        return cached[1]
+    result = probe()
+    _health_cache[name] = (now, result)
+    return result
+
+
+_HEALTH_SQL = text("SELECT 1")
+
+
+def _probe_database() -> str:
+    try:
+        # Closed even when the probe fails, so its connection goes back to the pool
+        with db.SessionLocal() as db_session:
+            db_session.execute(_HEALTH_SQL)
+        return "ok"
+    except Exception as e:
+        return f"error: {str(e)}"
+
+
+def _probe_storage(op: operator.LocalOperator) -> str:
+    try:
+        storage_path = _get_storage_paths(op).root
+        if storage_path.exists() and os.access(storage_path, os.W_OK):
+            return "ok"
+        return "error: not accessible"
+    except Exception as e:
+        return f"error: {str(e)}"
 
 
-@app.get("/health", tags=["health"])
-def health():
+@app.get("/health", tags=["health"], response_class=_ORJSONResponse)
+def health(op: operator.LocalOperator = Depends(get_operator)):
     """Enhanced health check endpoint.
     
     Checks:
     - Service status
-    - Database connectivity
-    - Storage directory accessibility
+    - Database connectivity (cached for 2s)
+    - Storage directory accessibility (cached for 60s)
     - QEMU binary availability
     - OBSERVER service status
     """
@@ -158,38 +360,21 @@ def health():
         "checks": {}
     }
     
-    # Check database connectivity
-    try:
-        from sqlalchemy import text
-        db_session = db.SessionLocal()
-        db_session.execute(text("SELECT 1"))
-        db_session.close()
-        health_status["checks"]["database"] = "ok"
-    except Exception as e:
-        health_status["checks"]["database"] = f"error: {str(e)}"
-        health_status["status"] = "degraded"
-    
-    # Check storage directory
-    try:
-        storage_path = Path(_operator.storage_path)
-        if storage_path.exists() and os.access(storage_path, os.W_OK):
-            health_status["checks"]["storage"] = "ok"
-        else:
-            health_status["checks"]["storage"] = "error: not accessible"
-            health_status["status"] = "degraded"
-    except Exception as e:
-        health_status["checks"]["storage"] = f"error: {str(e)}"
+    # Check database connectivity and storage directory
+    health_status["checks"]["database"] = _cached_probe("database", _probe_database)
+    health_status["checks"]["storage"] = _cached_probe("storage", functools.partial(_probe_storage, op))
+    if health_status["checks"]["database"] != "ok" or health_status["checks"]["storage"] != "ok":
         health_status["status"] = "degraded"
     
     # Check QEMU binary availability
-    if _operator.qemu_bin:
+    if op.qemu_bin:
         health_status["checks"]["qemu"] = "available"
     else:
         health_status["checks"]["qemu"] = "not found"
         health_status["status"] = "degraded"
     
     # Check qemu-img availability
-    if _operator.qemu_img:
+    if op.qemu_img:
         health_status["checks"]["qemu-img"] = "available"
     else:
         health_status["checks"]["qemu-img"] = "not found"
@@ -207,36 +392,38 @@ def health():
         return health_status
     else:
         # Return 503 Service Unavailable if degraded
-        return Response(
-            content=json.dumps(health_status),
-            status_code=503,
-            media_type="application/json"
-        )
+        return _ORJSONResponse(health_status, status_code=503)
+
+
+# Upper bound on issues returned by /observer/status
+_MAX_REPORTED_ISSUES = 256
 
 
-@app.get("/observer/status", tags=["observer"])
+@app.get("/observer/status", tags=["observer"], response_class=_ORJSONResponse)
 def observer_status():
     """Get OBSERVER service status and last detected issues."""
     global _observer
     if not _observer:
         return {"status": "not_initialized", "issues": []}
     
+    issues = _observer.get_last_issues(_MAX_REPORTED_ISSUES)
     return {
         "status": "running" if _observer.running else "stopped",
         "check_interval": _observer.check_interval,
-        "last_issues_count": len(_observer.last_issues),
+        # Total from the last check; last_issues holds at most _MAX_REPORTED_ISSUES
+        "last_issues_count": _observer.last_issues_count,
         "last_issues": [
             {
                 "issue_type": issue.issue_type,
                 "resource_id": issue.resource_id,
                 "details": issue.details
             }
-            for issue in _observer.last_issues
+            for issue in issues
         ]
     }
 
 
-@app.get("/network/config", tags=["network"])
+@app.get("/network/config", tags=["network"], response_class=_ORJSONResponse)
 def get_network_config():
     """Get current network configuration."""
     global _network_manager
@@ -244,210 +431,305 @@ def get_network_config():
         return {"status": "not_configured"}
     
     config = _network_manager.get_network_config()
+    allocated_ips = _network_manager.get_allocated_ips()
     return {
         "vlan_id": config.vlan_id,
         "bridge_name": config.bridge_name,
         "subnet": config.subnet,
         "gateway": config.gateway,
         "dns": config.dns,
-        "allocated_ips": list(_network_manager.get_allocated_ips()),
-        "available_ips": len(list(_network_manager.subnet.hosts())) - len(_network_manager.reserved_ips) - len(_network_manager.get_allocated_ips())
+        "allocated_ips": list(allocated_ips),
+        "available_ips": _network_manager.total_hosts - len(_network_manager.reserved_ips) - len(allocated_ips)
     }
 
 
+async def _dispatch_subrequest(item: schemas.BatchRequestItem) -> dict:
+    """Run one batch entry through the app in-process and capture its response."""
+    raw_path, _, query = item.url.partition("?")
+    # As an ASGI server would: "path" is percent-decoded, "raw_path" is not
+    path = urllib.parse.unquote(raw_path)
+    if path.rstrip("/") == "/batch":
+        return {"id": item.id, "status": 400, "body": {"detail": "Nested batch requests are not allowed"}}
+    
+    body = b"" if item.body is None else orjson.dumps(item.body)
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": item.method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": raw_path.encode(),
+        "query_string": query.encode(),
+        "root_path": "",
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        "client": None,
+        "server": None,
+    }
+    request_sent = False
+    response_done = asyncio.Event()
+    status_code = 500
+    chunks: list[bytes] = []
+    
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await response_done.wait()
+        return {"type": "http.disconnect"}
+    
+    async def send(message):
+        nonlocal status_code
+        if message["type"] == "http.response.start":
+            status_code = message["status"]
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                response_done.set()
+    
+    try:
+        await app(scope, receive, send)
+    except Exception:
+        # Only this entry fails; the others' responses (and commits) stand
+        logger.exception(f"Batch entry {item.id} ({item.method} {path}) failed")
+        return {"id": item.id, "status": 500, "body": {"detail": "Internal Server Error"}}
+    raw = b"".join(chunks)
+    try:
+        content = orjson.loads(raw) if raw else None
+    except orjson.JSONDecodeError:
+        content = raw.decode(errors="replace")
+    return {"id": item.id, "status": status_code, "body": content}
+
+
+@app.post("/batch", response_model=schemas.BatchResponse, tags=["batch"], response_class=_ORJSONResponse)
+async def batch(payload: schemas.BatchRequest):
+    """Execute several API requests in one round trip.
+    
+    Entries run concurrently, each as its own request with its own DB session,
+    so they must not depend on one another. Responses keep the request order.
+    """
+    responses = await asyncio.gather(*(_dispatch_subrequest(item) for item in payload.requests))
+    return {"responses": responses}
+
+
+# Static for the process lifetime: resolve once instead of per request
+_OPENAPI_SPEC_PATH = pathlib.Path(__file__).resolve().parent.parent / "openapi" / "intel.yaml"
+# The spec only changes between deploys: keep its bytes and ETag in memory
+_OPENAPI_SPEC = _OPENAPI_SPEC_PATH.read_bytes() if _OPENAPI_SPEC_PATH.is_file() else None
+_OPENAPI_SPEC_HEADERS = {
+    "ETag": f'"{hashlib.md5(_OPENAPI_SPEC, usedforsecurity=False).hexdigest()}"',
+    "Cache-Control": "public, max-age=3600",
+} if _OPENAPI_SPEC is not None else {}
+
+
 @app.get("/openapi.yaml", tags=["meta"])
-def openapi_yaml():
-    repo_root = pathlib.Path(__file__).resolve().parent.parent
-    spec_path = repo_root / "openapi" / "intel.yaml"
-    if not spec_path.exists():
+def openapi_yaml(request: Request):
+    if _OPENAPI_SPEC is None:
         raise HTTPException(status_code=404, detail="OpenAPI spec not found")
-    return FileResponse(str(spec_path))
+    if request.headers.get("if-none-match") == _OPENAPI_SPEC_HEADERS["ETag"]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=_OPENAPI_SPEC_HEADERS)
+    return Response(content=_OPENAPI_SPEC, media_type="application/x-yaml", headers=_OPENAPI_SPEC_HEADERS)
 
 
 # Minimal template endpoints
 @app.post("/templates", response_model=schemas.VMTemplate, status_code=status.HTTP_201_CREATED)
 def create_template(payload: schemas.VMTemplateCreate, db: Session = Depends(get_db)):
-    existing = db.query(models.VMTemplate).filter(models.VMTemplate.name == payload.name).first()
-    if existing:
+    fields = {"name": payload.name, "cpu_count": payload.cpu_count, "ram_amount": payload.ram_amount}
+    if not _insert_if_absent(db, models.VMTemplate, **fields):
         raise HTTPException(status_code=400, detail="Template already exists")
-    tpl = models.VMTemplate(name=payload.name, cpu_count=payload.cpu_count, ram_amount=payload.ram_amount)
-    db.add(tpl)
     db.commit()
-    db.refresh(tpl)
-    return tpl
+    _template_cache.pop(payload.name, None)
+    return fields
 
 
 @app.get("/templates", response_model=list[schemas.VMTemplate])
 def list_templates(db: Session = Depends(get_db)):
-    items = db.query(models.VMTemplate).all()
+    items = db.scalars(select(models.VMTemplate)).all()
     return items
 
 
 @app.delete("/templates/{name}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_template(name: str, db: Session = Depends(get_db)):
-    tpl = db.query(models.VMTemplate).filter(models.VMTemplate.name == name).first()
-    if not tpl:
+    # Existence and in-use checks only need booleans: one SELECT EXISTS(...), EXISTS(...)
+    found, in_use = db.execute(select(
+        exists().where(models.VMTemplate.name == name),
+        exists().where(models.VM.template_name == name)
+    )).one()
+    if not found:
         raise HTTPException(status_code=404, detail="Template not found")
-    # Check if template is in use
-    vms_using = db.query(models.VM).filter(models.VM.template_name == name).count()
-    if vms_using > 0:
+    if in_use:
+        # Only the error path pays for counting the VMs
+        vms_using = db.scalar(
+            select(func.count()).select_from(models.VM).where(models.VM.template_name == name)
+        )
         raise HTTPException(status_code=400, detail=f"Template is in use by {vms_using} VM(s)")
-    db.delete(tpl)
+    # Delete only if still unused: a VM created since the check above keeps it
+    deleted = db.execute(
+        delete(models.VMTemplate).where(
+            models.VMTemplate.name == name,
+            ~exists().where(models.VM.template_name == name)
+        ),
+        execution_options={"synchronize_session": False}
+    ).rowcount
     db.commit()
+    _template_cache.pop(name, None)
+    if not deleted:
+        raise HTTPException(status_code=400, detail="Template is in use")
     return None
 
 
 # VM endpoints
+def _vm_response(vm: models.VM) -> schemas.VM:
+    """Build the VM response from a VM row with its template loaded.
+    
+    Values come straight from the DB, so the models are built with
+    model_construct; FastAPI then accepts the instances without re-validating.
+    """
+    template = vm.template
+    return schemas.VM.model_construct(
+        id=vm.id,
+        vm_template=schemas.VMTemplate.model_construct(
+            name=template.name,
+            cpu_count=template.cpu_count,
+            ram_amount=template.ram_amount
+        ),
+        state=vm.state,
+        local_ip=vm.local_ip
+    )
+
+
 @app.post("/vms", response_model=schemas.VM, status_code=status.HTTP_201_CREATED)
 def create_vm(payload: schemas.VMCreate, db: Session = Depends(get_db)):
-    # Check template exists
-    template = db.query(models.VMTemplate).filter(models.VMTemplate.name == payload.template_name).first()
+    # Check template exists (the cache may still hold a template deleted since;
+    # that case is caught inside the insert's transaction below)
+    template = _get_template(db, payload.template_name)
     if not template:
         raise HTTPException(status_code=400, detail="Template not found")
     
     # Generate VM ID
     vm_id = payload.name if payload.name else str(uuid.uuid4())
     
-    # Check if VM ID already exists
-    existing = db.query(models.VM).filter(models.VM.id == vm_id).first()
-    if existing:
+    # Create VM in database (fails if the VM ID already exists)
+    if not _insert_if_absent(db, models.VM, id=vm_id, template_name=payload.template_name, state="stopped",
+                             mac=operator.vm_mac_address(vm_id)):
         raise HTTPException(status_code=400, detail="VM with this ID already exists")
-    
-    # Create VM in database
-    vm = models.VM(
-        id=vm_id,
-        template_name=payload.template_name,
-        state="stopped"
-    )
-    db.add(vm)
+    # The INSERT holds the write lock, so the template cannot be deleted between
+    # this check and the commit
+    if not db.scalar(select(exists().where(models.VMTemplate.name == payload.template_name))):
+        db.rollback()
+        _template_cache.pop(payload.template_name, None)
+        raise HTTPException(status_code=400, detail="Template not found")
     db.commit()
-    db.refresh(vm)
+    _request_observer_check()
     
     # Return with template relationship
-    return {
-        "id": vm.id,
-        "vm_template": {
-            "name": template.name,
-            "cpu_count": template.cpu_count,
-            "ram_amount": template.ram_amount
-        },
-        "state": vm.state,
-        "local_ip": vm.local_ip
-    }
+    return schemas.VM.model_construct(
+        id=vm_id,
+        vm_template=schemas.VMTemplate.model_construct(**template),
+        state="stopped",
+        local_ip=None
+    )
 
 
 @app.get("/vms", response_model=list[schemas.VM])
 def list_vms(state: Optional[str] = Query(None, enum=["running", "stopped", "paused", "error"]), 
              db: Session = Depends(get_db)):
-    query = db.query(models.VM)
+    # Many-to-one, so a JOIN fetches VMs and their templates in one statement
+    stmt = select(models.VM).options(joinedload(models.VM.template))
     if state:
-        query = query.filter(models.VM.state == state)
-    
-    vms = query.all()
-    result = []
-    for vm in vms:
-        template = db.query(models.VMTemplate).filter(models.VMTemplate.name == vm.template_name).first()
-        result.append({
-            "id": vm.id,
-            "vm_template": {
-                "name": template.name,
-                "cpu_count": template.cpu_count,
-                "ram_amount": template.ram_amount
-            },
-            "state": vm.state,
-            "local_ip": vm.local_ip
-        })
-    return result
+        stmt = stmt.where(models.VM.state == state)
+    
+    return [_vm_response(vm) for vm in db.scalars(stmt)]
 
 
 @app.get("/vms/{vm_id}", response_model=schemas.VM)
 def get_vm(vm_id: str, db: Session = Depends(get_db)):
-    vm = db.query(models.VM).filter(models.VM.id == vm_id).first()
+    vm = db.get(models.VM, vm_id, options=[joinedload(models.VM.template)])
     if not vm:
         raise HTTPException(status_code=404, detail="VM not found")
     
-    template = db.query(models.VMTemplate).filter(models.VMTemplate.name == vm.template_name).first()
-    return {
-        "id": vm.id,
-        "vm_template": {
-            "name": template.name,
-            "cpu_count": template.cpu_count,
-            "ram_amount": template.ram_amount
-        },
-        "state": vm.state,
-        "local_ip": vm.local_ip
-    }
+    return _vm_response(vm)
 
 
 @app.delete("/vms/{vm_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_vm(vm_id: str, db: Session = Depends(get_db)):
-    vm = db.query(models.VM).filter(models.VM.id == vm_id).first()
+def delete_vm(vm_id: str, db: Session = Depends(get_db), op: operator.LocalOperator = Depends(get_operator)):
+    vm = db.get(models.VM, vm_id)
     if not vm:
         raise HTTPException(status_code=404, detail="VM not found")
     
     # Stop VM if running
     if vm.state == "running":
         try:
-            _operator.stop_vm(vm_id, force=True)
+            _run_operator(op.stop_vm, vm_id, force=True)
         except operator.OperatorError as e:
             logger.warning(f"Error stopping VM {vm_id} during delete: {e}")
     
-    # Detach all disks
-    disks = db.query(models.Disk).filter(models.Disk.vm_id == vm_id).all()
-    for disk in disks:
-        disk.vm_id = None
-        disk.state = "available"
-        disk.mount_point = None
+    # Detach all disks in a single UPDATE
+    db.execute(
+        update(models.Disk).where(models.Disk.vm_id == vm_id).values(
+            vm_id=None, state="available", mount_point=None
+        ),
+        execution_options={"synchronize_session": False}
+    )
     
     db.delete(vm)
     db.commit()
+    metadata_service.invalidate_vm_cache(vm_id)
+    _request_observer_check()
     return None
 
 
-@app.post("/vms/{vm_id}/actions/start", status_code=status.HTTP_202_ACCEPTED)
-def start_vm(vm_id: str, db: Session = Depends(get_db)):
-    vm = db.query(models.VM).filter(models.VM.id == vm_id).first()
-    if not vm:
-        raise HTTPException(status_code=404, detail="VM not found")
+def _boot_vm(db: Session, vm: models.VM, op: operator.LocalOperator) -> None:
+    """Start `vm` through the operator and commit the outcome once.
     
-    if vm.state == "running":
-        raise HTTPException(status_code=400, detail="VM is already running")
-    
-    template = db.query(models.VMTemplate).filter(models.VMTemplate.name == vm.template_name).first()
+    On success the VM is marked running (with its IP if one was assigned);
+    on OperatorError it is marked as error and a 400 is raised.
+    """
+    template = _get_template(db, vm.template_name)
     
     # Get disk path if VM has a root disk
-    storage_path = Path(_operator.storage_path)
-    vm_dir = storage_path / "vms" / vm_id
-    qcow2_path = vm_dir / "root.qcow2" if (vm_dir / "root.qcow2").exists() else None
+    vm_dir = _get_storage_paths(op).vms / vm.id
+    root_disk = vm_dir / "root.qcow2"
+    qcow2_path = root_disk if root_disk.is_file() else None
     
     try:
-        _operator.start_vm(
-            vm_id=vm_id,
+        local_ip = _run_operator(
+            op.start_vm,
+            vm_id=vm.id,
             qcow2_path=qcow2_path,
-            cpu_count=template.cpu_count,
-            ram_gb=template.ram_amount
+            cpu_count=template["cpu_count"],
+            ram_gb=template["ram_amount"]
         )
         vm.state = "running"
-        
-        # Get assigned IP address if available
-        if _network_manager:
-            vm_dir = Path(_operator.storage_path) / "vms" / vm_id
-            ip_file = vm_dir / "ip.txt"
-            if ip_file.exists():
-                vm.local_ip = ip_file.read_text().strip()
+        if local_ip:
+            vm.local_ip = local_ip
         
         db.commit()
+        metadata_service.invalidate_vm_cache(vm.id)
+        _request_observer_check()
     except operator.OperatorError as e:
         vm.state = "error"
         db.commit()
         raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.post("/vms/{vm_id}/actions/start", status_code=status.HTTP_202_ACCEPTED)
+def start_vm(vm_id: str, db: Session = Depends(get_db), op: operator.LocalOperator = Depends(get_operator)):
+    vm = db.get(models.VM, vm_id)
+    if not vm:
+        raise HTTPException(status_code=404, detail="VM not found")
+    
+    if vm.state == "running":
+        raise HTTPException(status_code=400, detail="VM is already running")
     
+    _boot_vm(db, vm, op)
     return {"status": "started"}
 
 
 @app.post("/vms/{vm_id}/actions/stop", status_code=status.HTTP_202_ACCEPTED)
-def stop_vm(vm_id: str, db: Session = Depends(get_db)):
-    vm = db.query(models.VM).filter(models.VM.id == vm_id).first()
+def stop_vm(vm_id: str, db: Session = Depends(get_db), op: operator.LocalOperator = Depends(get_operator)):
+    vm = db.get(models.VM, vm_id)
     if not vm:
         raise HTTPException(status_code=404, detail="VM not found")
     
@@ -455,9 +737,12 @@ def stop_vm(vm_id: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail=f"VM is not running (current state: {vm.state})")
     
     try:
-        _operator.stop_vm(vm_id, force=False)
+        _run_operator(op.stop_vm, vm_id, force=False)
         vm.state = "stopped"
         db.commit()
+        # Its IP was released and may go to another VM
+        metadata_service.invalidate_vm_cache(vm_id)
+        _request_observer_check()
     except operator.OperatorError as e:
         vm.state = "error"
         db.commit()
@@ -467,62 +752,36 @@ def stop_vm(vm_id: str, db: Session = Depends(get_db)):
 
 
 @app.post("/vms/{vm_id}/actions/restart", status_code=status.HTTP_202_ACCEPTED)
-def restart_vm(vm_id: str, db: Session = Depends(get_db)):
-    vm = db.query(models.VM).filter(models.VM.id == vm_id).first()
+def restart_vm(vm_id: str, db: Session = Depends(get_db), op: operator.LocalOperator = Depends(get_operator)):
+    vm = db.get(models.VM, vm_id)
     if not vm:
         raise HTTPException(status_code=404, detail="VM not found")
     
     # Stop if running
     if vm.state == "running":
         try:
-            _operator.stop_vm(vm_id, force=False)
+            _run_operator(op.stop_vm, vm_id, force=False)
         except operator.OperatorError as e:
             raise HTTPException(status_code=400, detail=f"Failed to stop VM: {e}")
     
-    # Start
-    template = db.query(models.VMTemplate).filter(models.VMTemplate.name == vm.template_name).first()
-    storage_path = Path(_operator.storage_path)
-    vm_dir = storage_path / "vms" / vm_id
-    qcow2_path = vm_dir / "root.qcow2" if (vm_dir / "root.qcow2").exists() else None
-    
-    try:
-        _operator.start_vm(
-            vm_id=vm_id,
-            qcow2_path=qcow2_path,
-            cpu_count=template.cpu_count,
-            ram_gb=template.ram_amount
-        )
-        vm.state = "running"
-        
-        # Get assigned IP address if available
-        if _network_manager:
-            vm_dir = Path(_operator.storage_path) / "vms" / vm_id
-            ip_file = vm_dir / "ip.txt"
-            if ip_file.exists():
-                vm.local_ip = ip_file.read_text().strip()
-        
-        db.commit()
-    except operator.OperatorError as e:
-        vm.state = "error"
-        db.commit()
-        raise HTTPException(status_code=400, detail=str(e))
-    
+    # Start; the stop above is only persisted together with the start outcome
+    _boot_vm(db, vm, op)
     return {"status": "restarted"}
 
 
 @app.get("/vms/{vm_id}/console", response_model=schemas.VMConsole)
-def get_vm_console(vm_id: str, db: Session = Depends(get_db)):
+def get_vm_console(vm_id: str, db: Session = Depends(get_db), op: operator.LocalOperator = Depends(get_operator)):
     """Get VM console output.
     
     Returns the last 50kB of console output from the VM.
     The console file is automatically truncated to keep only the most recent output.
     """
-    vm = db.query(models.VM).filter(models.VM.id == vm_id).first()
+    vm = db.get(models.VM, vm_id)
     if not vm:
         raise HTTPException(status_code=404, detail="VM not found")
     
     # Truncate console file if needed before reading
-    vm_dir = Path(_operator.storage_path) / "vms" / vm_id
+    vm_dir = _get_storage_paths(op).vms / vm_id
     console_file = vm_dir / "console.txt"
     
     if not console_file.exists():
@@ -536,7 +795,7 @@ def get_vm_console(vm_id: str, db: Session = Depends(get_db)):
     
     # Truncate if needed
     try:
-        _operator._truncate_console_if_needed(vm_id)
+        op._truncate_console_if_needed(vm_id)
     except Exception as e:
         logger.warning(f"Failed to truncate console for VM {vm_id}: {e}")
     
@@ -561,12 +820,12 @@ def get_vm_console(vm_id: str, db: Session = Depends(get_db)):
 @app.put("/vms/{vm_id}/metadata", response_model=schemas.VMMetadata, status_code=status.HTTP_200_OK)
 def update_vm_metadata(vm_id: str, payload: schemas.VMMetadataCreate, db: Session = Depends(get_db)):
     """Set VM metadata (hostname, user-data, SSH keys) for cloud-init."""
-    vm = db.query(models.VM).filter(models.VM.id == vm_id).first()
+    vm = db.get(models.VM, vm_id)
     if not vm:
         raise HTTPException(status_code=404, detail="VM not found")
     
     # Get or create metadata
-    metadata = db.query(models.VMMetadata).filter(models.VMMetadata.vm_id == vm_id).first()
+    metadata = db.get(models.VMMetadata, vm_id)
     if not metadata:
         metadata = models.VMMetadata(vm_id=vm_id)
         db.add(metadata)
@@ -581,6 +840,7 @@ def update_vm_metadata(vm_id: str, payload: schemas.VMMetadataCreate, db: Sessio
     
     db.commit()
     db.refresh(metadata)
+    metadata_service.invalidate_vm_cache(vm_id)
     
     return {
         "vm_id": metadata.vm_id,
@@ -595,11 +855,11 @@ def update_vm_metadata(vm_id: str, payload: schemas.VMMetadataCreate, db: Sessio
 @app.get("/vms/{vm_id}/metadata", response_model=schemas.VMMetadata)
 def get_vm_metadata(vm_id: str, db: Session = Depends(get_db)):
     """Get VM metadata."""
-    vm = db.query(models.VM).filter(models.VM.id == vm_id).first()
+    vm = db.get(models.VM, vm_id)
     if not vm:
         raise HTTPException(status_code=404, detail="VM not found")
     
-    metadata = db.query(models.VMMetadata).filter(models.VMMetadata.vm_id == vm_id).first()
+    metadata = db.get(models.VMMetadata, vm_id)
     if not metadata:
         # Return empty metadata
         return {
@@ -624,80 +884,88 @@ def get_vm_metadata(vm_id: str, db: Session = Depends(get_db)):
 @app.delete("/vms/{vm_id}/metadata", status_code=status.HTTP_204_NO_CONTENT)
 def delete_vm_metadata(vm_id: str, db: Session = Depends(get_db)):
     """Clear VM metadata."""
-    vm = db.query(models.VM).filter(models.VM.id == vm_id).first()
+    vm = db.get(models.VM, vm_id)
     if not vm:
         raise HTTPException(status_code=404, detail="VM not found")
     
-    metadata = db.query(models.VMMetadata).filter(models.VMMetadata.vm_id == vm_id).first()
+    metadata = db.get(models.VMMetadata, vm_id)
     if metadata:
         db.delete(metadata)
         db.commit()
+        metadata_service.invalidate_vm_cache(vm_id)
     
     return None
 
 
 # Disk endpoints
 @app.post("/disks", response_model=schemas.Disk, status_code=status.HTTP_201_CREATED)
-def create_disk(payload: schemas.DiskCreate, db: Session = Depends(get_db)):
-    disk_id = str(uuid.uuid4())
-    
-    # Check if disk ID already exists (unlikely but possible)
-    existing = db.query(models.Disk).filter(models.Disk.id == disk_id).first()
-    if existing:
-        disk_id = str(uuid.uuid4())  # Retry with new UUID
+def create_disk(payload: schemas.DiskCreate, db: Session = Depends(get_db), op: operator.LocalOperator = Depends(get_operator)):
+    # Reserve the disk ID in the database (the primary key rejects a colliding
+    # ID, so retry once). The reservation is committed before qemu-img runs so
+    # the SQLite write lock is not held for the duration of image creation; its
+    # "creating" state keeps the observer and disk actions away from it meanwhile
+    disk = {
+        "id": str(uuid.uuid4()),
+        "size": payload.size,
+        "mount_point": payload.mount_point,
+        "state": "creating"
+    }
+    if not _insert_if_absent(db, models.Disk, **disk):
+        disk["id"] = str(uuid.uuid4())  # Retry with new UUID
+        if not _insert_if_absent(db, models.Disk, **disk):
+            raise HTTPException(status_code=500, detail="Could not allocate a disk ID")
+    db.commit()
     
     # Create disk image
-    storage_path = Path(_operator.storage_path)
-    disk_path = storage_path / "disks" / f"{disk_id}.qcow2"
+    disk_path = _disk_path(op, disk["id"])
     
     try:
-        _operator.create_disk_image(disk_path, payload.size)
-    except operator.OperatorError as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        op.create_disk_image(disk_path, payload.size)
+    except Exception as e:
+        # Release the reservation, whatever went wrong
+        db.rollback()
+        db.execute(delete(models.Disk).where(models.Disk.id == disk["id"]))
+        db.commit()
+        if isinstance(e, operator.OperatorError):
+            raise HTTPException(status_code=400, detail=str(e))
+        raise
     
-    # Create disk in database
-    disk = models.Disk(
-        id=disk_id,
-        size=payload.size,
-        mount_point=payload.mount_point,
-        state="available"
-    )
-    db.add(disk)
+    disk["state"] = "available"
+    db.execute(update(models.Disk).where(models.Disk.id == disk["id"]).values(state="available"))
     db.commit()
-    db.refresh(disk)
-    
     return disk
 
 
 @app.get("/disks", response_model=list[schemas.Disk])
 def list_disks(db: Session = Depends(get_db)):
-    disks = db.query(models.Disk).all()
+    disks = db.scalars(select(models.Disk)).all()
     return disks
 
 
 @app.get("/disks/{disk_id}", response_model=schemas.Disk)
 def get_disk(disk_id: str, db: Session = Depends(get_db)):
-    disk = db.query(models.Disk).filter(models.Disk.id == disk_id).first()
+    disk = db.get(models.Disk, disk_id)
     if not disk:
         raise HTTPException(status_code=404, detail="Disk not found")
     return disk
 
 
 @app.delete("/disks/{disk_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_disk(disk_id: str, db: Session = Depends(get_db)):
-    disk = db.query(models.Disk).filter(models.Disk.id == disk_id).first()
+def delete_disk(disk_id: str, db: Session = Depends(get_db), op: operator.LocalOperator = Depends(get_operator)):
+    disk = db.get(models.Disk, disk_id)
     if not disk:
         raise HTTPException(status_code=404, detail="Disk not found")
     
     if disk.state == "attached":
         raise HTTPException(status_code=400, detail="Cannot delete attached disk. Detach it first.")
+    if disk.state == "creating":
+        raise HTTPException(status_code=400, detail="Disk is still being created")
     
     # Delete disk image
-    storage_path = Path(_operator.storage_path)
-    disk_path = storage_path / "disks" / f"{disk_id}.qcow2"
+    disk_path = _disk_path(op, disk_id)
     
     try:
-        _operator.delete_disk_image(disk_path)
+        op.delete_disk_image(disk_path)
     except operator.OperatorError as e:
         raise HTTPException(status_code=400, detail=str(e))
     
@@ -707,19 +975,21 @@ def delete_disk(disk_id: str, db: Session = Depends(get_db)):
 
 
 @app.post("/disks/{disk_id}/attach", status_code=status.HTTP_200_OK)
-def attach_disk(disk_id: str, payload: dict, db: Session = Depends(get_db)):
+def attach_disk(disk_id: str, payload: dict, db: Session = Depends(get_db), op: operator.LocalOperator = Depends(get_operator)):
     vm_id = payload.get("vm_id")
     if not vm_id:
         raise HTTPException(status_code=400, detail="vm_id is required")
     
-    disk = db.query(models.Disk).filter(models.Disk.id == disk_id).first()
+    disk = db.get(models.Disk, disk_id)
     if not disk:
         raise HTTPException(status_code=404, detail="Disk not found")
     
     if disk.state == "attached":
         raise HTTPException(status_code=400, detail="Disk is already attached")
+    if disk.state == "creating":
+        raise HTTPException(status_code=400, detail="Disk is still being created")
     
-    vm = db.query(models.VM).filter(models.VM.id == vm_id).first()
+    vm = db.get(models.VM, vm_id)
     if not vm:
         raise HTTPException(status_code=404, detail="VM not found")
     
@@ -727,18 +997,18 @@ def attach_disk(disk_id: str, payload: dict, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail="VM must be running to attach disk")
     
     # Get disk path
-    storage_path = Path(_operator.storage_path)
-    disk_path = storage_path / "disks" / f"{disk_id}.qcow2"
+    disk_path = _disk_path(op, disk_id)
     
     # Determine mount point (use provided or auto-assign)
     mount_point = disk.mount_point or "/dev/xvdb"  # Default to xvdb if not specified
     
     try:
-        _operator.attach_disk(vm_id, disk_path, device=mount_point)
+        _run_operator(op.attach_disk, vm_id, disk_path, device=mount_point)
         disk.vm_id = vm_id
         disk.state = "attached"
         disk.mount_point = mount_point
         db.commit()
+        _request_observer_check()
     except operator.OperatorError as e:
         raise HTTPException(status_code=400, detail=str(e))
     
@@ -746,8 +1016,8 @@ def attach_disk(disk_id: str, payload: dict, db: Session = Depends(get_db)):
 
 
 @app.post("/disks/{disk_id}/detach", status_code=status.HTTP_200_OK)
-def detach_disk(disk_id: str, db: Session = Depends(get_db)):
-    disk = db.query(models.Disk).filter(models.Disk.id == disk_id).first()
+def detach_disk(disk_id: str, db: Session = Depends(get_db), op: operator.LocalOperator = Depends(get_operator)):
+    disk = db.get(models.Disk, disk_id)
     if not disk:
         raise HTTPException(status_code=404, detail="Disk not found")
     
@@ -757,7 +1027,7 @@ def detach_disk(disk_id: str, db: Session = Depends(get_db)):
     if not disk.vm_id:
         raise HTTPException(status_code=400, detail="Disk has no associated VM")
     
-    vm = db.query(models.VM).filter(models.VM.id == disk.vm_id).first()
+    vm = db.get(models.VM, disk.vm_id)
     if not vm or vm.state != "running":
         # VM not running or not found - just update database
         disk.vm_id = None
@@ -767,15 +1037,15 @@ def detach_disk(disk_id: str, db: Session = Depends(get_db)):
         return {"status": "detached"}
     
     # Get disk path
-    storage_path = Path(_operator.storage_path)
-    disk_path = storage_path / "disks" / f"{disk_id}.qcow2"
+    disk_path = _disk_path(op, disk_id)
     
     try:
-        _operator.detach_disk(disk.vm_id, disk_path)
+        _run_operator(op.detach_disk, disk.vm_id, disk_path)
         disk.vm_id = None
         disk.state = "available"
         disk.mount_point = None
         db.commit()
+        _request_observer_check()
     except operator.OperatorError as e:
         raise HTTPException(status_code=400, detail=str(e))
     
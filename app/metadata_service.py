@@ -9,23 +9,207 @@ import http.server
 import socketserver
 import threading
 import base64
+import concurrent.futures
+import functools
 import os
 import re
+import time
 from pathlib import Path
-from typing import Optional, Dict
+from typing import Optional, Dict, NamedTuple
 from urllib.parse import urlparse, unquote
 
+from sqlalchemy.orm import Session, joinedload
+
 from . import logging_config, db, models
 
 logger = logging_config.UnifiedLogger.get_logger(__name__, logging_config.UnifiedLogger.SERVICE_OPERATOR)
 
 
+class _MetadataSnapshot(NamedTuple):
+    """The VMMetadata fields the metadata API serves, detached from any session."""
+    vm_id: str
+    hostname: Optional[str]
+    user_data: Optional[str]
+    ssh_keys: Optional[str]
+    updated_at: object
+
+
+class _VMSnapshot(NamedTuple):
+    """An immutable copy of the VM fields the metadata API serves.
+    
+    Lookups return these rather than ORM instances so cached entries can be
+    shared across request threads and outlive the session that loaded them.
+    """
+    id: str
+    mac: Optional[str]
+    local_ip: Optional[str]
+    vm_metadata: Optional[_MetadataSnapshot]
+
+
+def _snapshot(vm: models.VM) -> _VMSnapshot:
+    metadata = vm.vm_metadata
+    if metadata is not None:
+        metadata = _MetadataSnapshot(
+            metadata.vm_id, metadata.hostname, metadata.user_data, metadata.ssh_keys, metadata.updated_at
+        )
+    return _VMSnapshot(vm.id, vm.mac, vm.local_ip, metadata)
+
+
+class _VMLookupCache:
+    """Thread-safe TTL cache of VM lookups, keyed by ("ip", addr) or ("mac", addr).
+    
+    cloud-init issues dozens of metadata requests per boot; caching the
+    resolved VM avoids a DB query (and for MACs, a scan) on each of them.
+    Only hits are cached, so a VM that just got its IP is found immediately.
+    
+    Every invalidation bumps `generation`; a lookup passes the generation it
+    read before querying to put(), which drops the result if an invalidation
+    happened in between, so a stale row cannot be cached after the change.
+    """
+    
+    def __init__(self, ttl: float = 30.0, maxsize: int = 4096):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.generation = 0
+        self._entries: Dict[tuple, tuple] = {}  # key -> (expires_at, vm)
+        self._lock = threading.Lock()
+    
+    def get(self, key: tuple) -> Optional[_VMSnapshot]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            return entry[1]
+    
+    def put(self, key: tuple, vm: _VMSnapshot, generation: int) -> None:
+        with self._lock:
+            if generation != self.generation:
+                return  # Invalidated while the lookup ran
+            if len(self._entries) >= self.maxsize:
+                self._entries.pop(next(iter(self._entries)))  # drop the oldest entry
+            self._entries[key] = (time.monotonic() + self.ttl, vm)
+    
+    def invalidate(self, vm_id: Optional[str] = None) -> None:
+        """Drop cached lookups for `vm_id`, or everything if vm_id is None."""
+        with self._lock:
+            self.generation += 1
+            if vm_id is None:
+                self._entries.clear()
+            else:
+                for key in [k for k, (_, vm) in self._entries.items() if vm.id == vm_id]:
+                    del self._entries[key]
+
+
+_vm_cache = _VMLookupCache()
+
+
+# Values derived from a VM's metadata (encoded user-data, first SSH key),
+# tagged with the metadata's updated_at so an edit is picked up even before
+# the VM's cache entries are invalidated. Bounded like _vm_cache, oldest VM first.
+_DERIVED_MAXSIZE = 4096
+_derived_cache: Dict[str, Dict[str, tuple]] = {}  # vm_id -> {name: (updated_at, value)}
+_derived_lock = threading.Lock()
+
+
+def _derived(metadata: _MetadataSnapshot, name: str, compute):
+    """Return compute(metadata), recomputing only when the metadata changed."""
+    with _derived_lock:
+        entry = _derived_cache.get(metadata.vm_id, {}).get(name)
+    if entry is not None and entry[0] == metadata.updated_at:
+        return entry[1]
+    value = compute(metadata)
+    with _derived_lock:
+        entries = _derived_cache.get(metadata.vm_id)
+        if entries is None:
+            if len(_derived_cache) >= _DERIVED_MAXSIZE:
+                _derived_cache.pop(next(iter(_derived_cache)))
+            entries = _derived_cache[metadata.vm_id] = {}
+        entries[name] = (metadata.updated_at, value)
+    return value
+
+
+def _encoded_user_data(metadata: _MetadataSnapshot) -> bytes:
+    """Return base64(user_data), encoding it only when the metadata changed."""
+    return _derived(metadata, 'user-data', lambda md: base64.b64encode(md.user_data.encode('utf-8')))
+
+
+def _first_ssh_key(metadata: _MetadataSnapshot) -> str:
+    """Return the first of the newline-separated SSH keys."""
+    return _derived(metadata, 'openssh-key', lambda md: md.ssh_keys.strip().split('\n', 1)[0])
+
+
+def invalidate_vm_cache(vm_id: Optional[str] = None) -> None:
+    """Forget cached metadata lookups for a VM whose IP, MAC or existence changed."""
+    _vm_cache.invalidate(vm_id)
+    with _derived_lock:
+        if vm_id is None:
+            _derived_cache.clear()
+        else:
+            _derived_cache.pop(vm_id, None)
+
+
+# Metadata paths are resolved through a table built once at import instead of
+# an if/elif chain; constant listings are kept as ready-to-send bytes.
+_MAC_PATH_RE = re.compile(r'/macs/([0-9a-f:]{17})/')
+_MACS_PREFIX = 'meta-data/network/interfaces/macs/'
+_ROOT_LISTING = b'instance-id\nlocal-ipv4\npublic-ipv4\nhostname\nnetwork/\npublic-keys/'
+_MAC_LISTING = b'local-ipv4\nmac'
+_PUBLIC_KEYS_LISTING = b'0=default'  # index for the first key
+
+
+def _user_data(vm: _VMSnapshot):
+    metadata = vm.vm_metadata
+    if metadata and metadata.user_data:
+        # AWS EC2 returns user-data as base64 encoded
+        return _encoded_user_data(metadata)
+    return ''
+
+
+def _hostname(vm: _VMSnapshot) -> str:
+    metadata = vm.vm_metadata
+    if metadata and metadata.hostname:
+        return metadata.hostname
+    # Default to VM ID
+    return vm.id
+
+
+def _public_keys(vm: _VMSnapshot) -> bytes:
+    metadata = vm.vm_metadata
+    return _PUBLIC_KEYS_LISTING if metadata and metadata.ssh_keys else b''
+
+
+def _openssh_key(vm: _VMSnapshot) -> str:
+    metadata = vm.vm_metadata
+    if metadata and metadata.ssh_keys:
+        return _first_ssh_key(metadata)
+    return ''
+
+
+_STATIC_PATHS = {
+    'meta-data': lambda vm: _ROOT_LISTING,
+    'meta-data/': lambda vm: _ROOT_LISTING,
+    'user-data': _user_data,
+    'meta-data/instance-id': lambda vm: vm.id,
+    'meta-data/local-ipv4': lambda vm: vm.local_ip or '',
+    'meta-data/public-ipv4': lambda vm: vm.local_ip or '',  # For now, same as local IP
+    'meta-data/hostname': _hostname,
+    'meta-data/public-keys/': _public_keys,
+    'meta-data/public-keys/0/openssh-key': _openssh_key,
+}
+
+
 class MetadataRequestHandler(http.server.BaseHTTPRequestHandler):
     """HTTP request handler for AWS EC2 metadata API."""
     
-    def __init__(self, *args, db_session_factory, storage_path: Path, **kwargs):
+    network_manager = None
+    
+    def __init__(self, *args, db_session_factory, storage_path: Path, network_manager=None, **kwargs):
         self.db_session_factory = db_session_factory
         self.storage_path = storage_path
+        self.network_manager = network_manager
         super().__init__(*args, **kwargs)
     
     def log_message(self, format, *args):
@@ -38,34 +222,39 @@ class MetadataRequestHandler(http.server.BaseHTTPRequestHandler):
             parsed = urlparse(self.path)
             path = parsed.path.strip('/')
             
-            # Identify VM by source IP (most reliable method)
-            client_ip = self.client_address[0]
-            vm = self._get_vm_by_ip(client_ip)
-            
-            # If not found by IP, try MAC from path (for network interface queries)
-            if not vm:
-                mac = self._extract_mac_from_path(path)
-                if mac:
-                    vm = self._get_vm_by_mac(mac)
+            # One session for the whole request; it only checks out a pooled
+            # connection once a query actually runs (cache hits need none)
+            with self.db_session_factory() as session:
+                # Identify VM by source IP (most reliable method)
+                client_ip = self.client_address[0]
+                vm = self._get_vm_by_ip(session, client_ip)
+                
+                # If not found by IP, try MAC from path (for network interface queries)
+                if not vm:
+                    mac = self._extract_mac_from_path(path)
+                    if mac:
+                        vm = self._get_vm_by_mac(session, mac)
+                
+                if not vm:
+                    self.send_error(404, f"VM not found for IP {client_ip}")
+                    return
+                
+                if not path.startswith('latest/'):
+                    self.send_error(404, "Invalid metadata path")
+                    return
+                
+                response = self._handle_metadata_request(path[7:], vm)  # Remove 'latest/'
             
-            if not vm:
-                self.send_error(404, f"VM not found for IP {client_ip}")
+            if response is None:
+                self.send_error(404, "Metadata path not found")
                 return
             
-            # Handle metadata requests
-            if path.startswith('latest/'):
-                response = self._handle_metadata_request(path[7:], vm)  # Remove 'latest/'
-                if response is None:
-                    self.send_error(404, "Metadata path not found")
-                    return
-                
-                self.send_response(200)
-                self.send_header('Content-Type', 'text/plain')
-                self.send_header('Content-Length', str(len(response.encode('utf-8'))))
-                self.end_headers()
-                self.wfile.write(response.encode('utf-8'))
-            else:
-                self.send_error(404, "Invalid metadata path")
+            body = response if isinstance(response, bytes) else response.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
                 
         except Exception as e:
             logger.error(f"Error handling metadata request: {e}", exc_info=True)
@@ -77,53 +266,47 @@ class MetadataRequestHandler(http.server.BaseHTTPRequestHandler):
         For network interface queries, MAC is in the path:
         /latest/meta-data/network/interfaces/macs/{mac}/...
         """
-        mac_match = re.search(r'/macs/([0-9a-f:]{17})/', path)
+        mac_match = _MAC_PATH_RE.search(path)
         if mac_match:
             return mac_match.group(1).lower()
         return None
     
-    def _get_vm_by_mac(self, mac: str) -> Optional[models.VM]:
-        """Find VM by MAC address.
+    def _get_vm_by_mac(self, session: Session, mac: str) -> Optional[_VMSnapshot]:
+        """Find VM by MAC address (an indexed lookup on vms.mac)."""
+        mac = mac.lower()
+        cached = _vm_cache.get(("mac", mac))
+        if cached is not None:
+            return cached
         
-        We store MAC addresses in VM directories (mac.txt) and can also
-        query the database for VMs and match by reading their mac.txt files.
-        """
-        session = self.db_session_factory()
-        try:
-            # Get all VMs and check their MAC files
-            vms = session.query(models.VM).all()
-            for vm in vms:
-                vm_dir = self.storage_path / "vms" / vm.id
-                mac_file = vm_dir / "mac.txt"
-                if mac_file.exists():
-                    stored_mac = mac_file.read_text().strip().lower()
-                    if stored_mac == mac.lower():
-                        return vm
+        generation = _vm_cache.generation
+        vm = session.query(models.VM).options(joinedload(models.VM.vm_metadata)).filter(models.VM.mac == mac).first()
+        if vm is None:
             return None
-        finally:
-            session.close()
+        vm = _snapshot(vm)
+        _vm_cache.put(("mac", mac), vm, generation)
+        return vm
     
-    def _get_vm_by_ip(self, ip: str) -> Optional[models.VM]:
+    def _get_vm_by_ip(self, session: Session, ip: str) -> Optional[_VMSnapshot]:
         """Find VM by IP address (fallback method)."""
-        session = self.db_session_factory()
-        try:
-            vm = session.query(models.VM).filter(models.VM.local_ip == ip).first()
-            return vm
-        finally:
-            session.close()
-    
-    def _get_metadata(self, vm_id: str) -> Optional[models.VMMetadata]:
-        """Get metadata from database."""
-        session = self.db_session_factory()
-        try:
-            metadata = session.query(models.VMMetadata).filter(
-                models.VMMetadata.vm_id == vm_id
-            ).first()
-            return metadata
-        finally:
-            session.close()
+        cached = _vm_cache.get(("ip", ip))
+        if cached is not None:
+            return cached
+        
+        generation = _vm_cache.generation
+        # The network manager knows which VM each IP it allocated belongs to,
+        # which turns the lookup into a primary-key get
+        vm_id = self.network_manager.get_vm_id(ip) if self.network_manager else None
+        if vm_id is not None:
+            vm = session.get(models.VM, vm_id, options=[joinedload(models.VM.vm_metadata)])
+        else:
+            vm = session.query(models.VM).options(joinedload(models.VM.vm_metadata)).filter(models.VM.local_ip == ip).first()
+        if vm is None:
+            return None
+        vm = _snapshot(vm)
+        _vm_cache.put(("ip", ip), vm, generation)
+        return vm
     
-    def _handle_metadata_request(self, path: str, vm: models.VM) -> Optional[str]:
+    def _handle_metadata_request(self, path: str, vm: _VMSnapshot) -> Optional[str | bytes]:
         """Handle metadata API requests.
         
         Implements AWS EC2 metadata API endpoints:
@@ -134,80 +317,94 @@ class MetadataRequestHandler(http.server.BaseHTTPRequestHandler):
         - meta-data/network/interfaces/macs/{mac}/local-ipv4
         - meta-data/public-keys/0/openssh-key
         - user-data (base64 encoded)
-        """
-        # Handle root listing
-        if path == 'meta-data/' or path == 'meta-data':
-            return '\n'.join([
-                'instance-id',
-                'local-ipv4',
-                'public-ipv4',
-                'hostname',
-                'network/',
-                'public-keys/',
-            ])
-        
-        if path == 'user-data':
-            metadata = self._get_metadata(vm.id)
-            if metadata and metadata.user_data:
-                # AWS EC2 returns user-data as base64 encoded
-                return base64.b64encode(metadata.user_data.encode('utf-8')).decode('utf-8')
-            return ''
-        
-        # Meta-data endpoints
-        if path == 'meta-data/instance-id':
-            return vm.id
-        
-        if path == 'meta-data/local-ipv4':
-            return vm.local_ip or ''
         
-        if path == 'meta-data/public-ipv4':
-            # For now, same as local IP
-            return vm.local_ip or ''
-        
-        if path == 'meta-data/hostname':
-            metadata = self._get_metadata(vm.id)
-            if metadata and metadata.hostname:
-                return metadata.hostname
-            # Default to VM ID
-            return vm.id
+        Constant listings and user-data are returned as ready-to-send bytes.
+        """
+        handler = _STATIC_PATHS.get(path)
+        if handler is not None:
+            return handler(vm)
         
         # Network interfaces
-        if path.startswith('meta-data/network/interfaces/macs/'):
-            # Extract MAC from path
-            mac_match = re.search(r'/macs/([0-9a-f:]{17})/', path)
-            if mac_match:
-                mac = mac_match.group(1).lower()
-                # Verify this MAC belongs to the VM
-                vm_dir = self.storage_path / "vms" / vm.id
-                mac_file = vm_dir / "mac.txt"
-                if mac_file.exists() and mac_file.read_text().strip().lower() == mac:
-                    remaining = path.split(f'/macs/{mac}/')[-1]
-                    if remaining == 'local-ipv4':
-                        return vm.local_ip or ''
-                    elif remaining == '' or remaining == '/':
-                        return '\n'.join(['local-ipv4', 'mac'])
-                    elif remaining == 'mac':
-                        return mac
-        
-        # Public keys
-        if path == 'meta-data/public-keys/':
-            metadata = self._get_metadata(vm.id)
-            if metadata and metadata.ssh_keys:
-                # Return index for first key
-                return '0=default'
-            return ''
-        
-        if path == 'meta-data/public-keys/0/openssh-key':
-            metadata = self._get_metadata(vm.id)
-            if metadata and metadata.ssh_keys:
-                # Return first SSH key (or all if multiple)
-                keys = metadata.ssh_keys.strip().split('\n')
-                return keys[0] if keys else ''
-            return ''
+        if path.startswith(_MACS_PREFIX):
+            mac_match = _MAC_PATH_RE.search(path)
+            # Only answer for the VM's own MAC
+            if mac_match and vm.mac == mac_match.group(1).lower():
+                remaining = path[mac_match.end():]
+                if remaining == 'local-ipv4':
+                    return vm.local_ip or ''
+                elif remaining == '' or remaining == '/':
+                    return _MAC_LISTING
+                elif remaining == 'mac':
+                    return vm.mac
         
         return None
 
 
+class _PooledTCPServer(socketserver.TCPServer):
+    """TCPServer that handles connections concurrently on a bounded thread pool.
+    
+    Booting VMs fetch metadata in parallel; a plain TCPServer would serve them
+    one request at a time. At most `max_workers + max_pending` accepted
+    connections are in flight; beyond that new ones get an immediate 503
+    instead of piling up in the executor's unbounded queue.
+    
+    No SO_REUSEPORT: the VM lookup cache and the NetworkManager's allocations
+    live in this process, so a second listener on the port must fail with
+    EADDRINUSE rather than silently serve from its own state.
+    """
+    allow_reuse_address = True
+    # listen() backlog (socketserver default is 5); the kernel caps it at somaxconn
+    request_queue_size = 1024
+    _BUSY_RESPONSE = b"HTTP/1.0 503 Service Unavailable\r\nRetry-After: 1\r\nContent-Length: 0\r\n\r\n"
+    
+    def __init__(self, server_address, handler_class, max_workers: int, max_pending: Optional[int] = None,
+                 bind_and_activate: bool = True):
+        self._pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="metadata"
+        )
+        if max_pending is None:
+            max_pending = max_workers * 4
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+        super().__init__(server_address, handler_class, bind_and_activate=bind_and_activate)
+    
+    def process_request(self, request, client_address):
+        if not self._slots.acquire(blocking=False):
+            logger.warning(f"Metadata service busy; rejecting request from {client_address[0]}")
+            try:
+                request.sendall(self._BUSY_RESPONSE)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        try:
+            future = self._pool.submit(self._process_request_worker, request, client_address)
+        except RuntimeError:  # Pool already shut down
+            self._slots.release()
+            self.shutdown_request(request)
+            return
+        future.add_done_callback(functools.partial(self._close_if_cancelled, request))
+    
+    def _close_if_cancelled(self, request, future):
+        # server_close() cancels queued requests before a worker picks them up;
+        # close their sockets so clients see the connection drop instead of hanging
+        if future.cancelled():
+            self.shutdown_request(request)
+            self._slots.release()
+    
+    def _process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+    
+    def server_close(self):
+        super().server_close()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
 class MetadataService:
     """AWS EC2-compatible metadata service for cloud-init."""
     
@@ -217,7 +414,10 @@ class MetadataService:
         storage_path: Path,
         bind_ip: str = "169.254.169.254",
         port: int = 80,
-        bridge_name: str = "br-vman"
+        bridge_name: str = "br-vman",
+        max_workers: int = 16,
+        max_pending: Optional[int] = None,
+        network_manager=None
     ):
         """Initialize metadata service.
         
@@ -227,12 +427,19 @@ class MetadataService:
             bind_ip: IP address to bind metadata service (default: 169.254.169.254)
             port: Port to listen on (default: 80)
             bridge_name: Bridge interface name
+            max_workers: Maximum number of requests served concurrently (default: 16)
+            max_pending: Connections allowed to wait for a worker before new ones
+                get a 503 (default: 4 * max_workers)
+            network_manager: NetworkManager whose IP allocations identify clients without a query
         """
         self.db_session_factory = db_session_factory
         self.storage_path = storage_path
         self.bind_ip = bind_ip
         self.port = port
         self.bridge_name = bridge_name
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.network_manager = network_manager
         self.server: Optional[socketserver.TCPServer] = None
         self.server_thread: Optional[threading.Thread] = None
         self.running = False
@@ -252,6 +459,7 @@ class MetadataService:
             # Create a handler class with bound dependencies
             db_factory = self.db_session_factory
             storage = self.storage_path
+            nm = self.network_manager
             
             class CustomHandler(MetadataRequestHandler):
                 def __init__(self, *args, **kwargs):
@@ -259,29 +467,27 @@ class MetadataService:
                         *args,
                         db_session_factory=db_factory,
                         storage_path=storage,
+                        network_manager=nm,
                         **kwargs
                     )
             
-            # Create server
-            self.server = socketserver.TCPServer(
+            # Create server (binds with SO_REUSEADDR; each request gets a pool thread,
+            # and each handler opens its own DB sessions)
+            self.server = _PooledTCPServer(
                 (self.bind_ip, self.port),
                 CustomHandler,
+                max_workers=self.max_workers,
+                max_pending=self.max_pending,
                 bind_and_activate=False
             )
             
-            # Allow address reuse
-            self.server.allow_reuse_address = True
-            
-            # Set socket options
-            self.server.socket.setsockopt(
-                socketserver.socket.SOL_SOCKET,
-                socketserver.socket.SO_REUSEADDR,
-                1
-            )
-            
             # Bind and activate
-            self.server.server_bind()
-            self.server.server_activate()
+            try:
+                self.server.server_bind()
+                self.server.server_activate()
+            except Exception:
+                self.server.server_close()
+                raise
             
             # Start server in background thread
             self.server_thread = threading.Thread(
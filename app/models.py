@@ -12,10 +12,12 @@ class VMTemplate(Base):
 class VM(Base):
     __tablename__ = "vms"
     id = Column(String, primary_key=True, index=True)
-    template_name = Column(String, ForeignKey("vm_templates.name"))
-    state = Column(String, nullable=False)
+    template_name = Column(String, ForeignKey("vm_templates.name"), index=True)
+    state = Column(String, nullable=False, index=True)
     local_ip = Column(String, nullable=True)
-    metadata = relationship("VMMetadata", back_populates="vm", uselist=False, cascade="all, delete-orphan")
+    mac = Column(String(17), nullable=True, index=True)  # see operator.vm_mac_address
+    template = relationship("VMTemplate")
+    vm_metadata = relationship("VMMetadata", back_populates="vm", uselist=False, cascade="all, delete-orphan")
 
 class Disk(Base):
     __tablename__ = "disks"
@@ -23,7 +25,7 @@ class Disk(Base):
     size = Column(Integer, nullable=False)
     mount_point = Column(String, nullable=True)
     state = Column(String, nullable=False)
-    vm_id = Column(String, ForeignKey("vms.id"), nullable=True)
+    vm_id = Column(String, ForeignKey("vms.id"), nullable=True, index=True)
 
 class VMMetadata(Base):
     __tablename__ = "vm_metadata"
@@ -33,4 +35,4 @@ class VMMetadata(Base):
     ssh_keys = Column(Text, nullable=True)  # newline-separated SSH public keys
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
     updated_at = Column(DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
-    vm = relationship("VM", back_populates="metadata")
+    vm = relationship("VM", back_populates="vm_metadata")
@@ -8,15 +8,21 @@ from __future__ import annotations
 import subprocess
 import ipaddress
 import os
+import socket
 import logging
+import threading
 from pathlib import Path
-from typing import Optional, Set
+from typing import Dict, Optional, Set
 from dataclasses import dataclass
 
 from . import logging_config
 
 logger = logging_config.UnifiedLogger.get_logger(__name__)
 
+# The allocation bitmap holds one byte per subnet address; larger subnets
+# (and IPv6) fall back to scanning subnet.hosts() against allocated_ips
+_BITMAP_MAX_ADDRESSES = 1 << 16
+
 
 @dataclass
 class NetworkConfig:
@@ -62,8 +68,30 @@ class NetworkManager:
             str(self.subnet.broadcast_address),  # Broadcast
         }
         
-        # Track allocated IPs
-        self.allocated_ips: Set[str] = set()
+        # Usable host addresses, as len(list(subnet.hosts())) but without
+        # materializing them (/31 and /32 have no network/broadcast address;
+        # IPv6 only excludes the subnet-router anycast address)
+        if self.subnet.prefixlen >= self.subnet.max_prefixlen - 1:
+            self.total_hosts = self.subnet.num_addresses
+        elif self.subnet.version == 6:
+            self.total_hosts = self.subnet.num_addresses - 1
+        else:
+            self.total_hosts = self.subnet.num_addresses - 2
+        
+        # Track allocated IPs. For IPv4 subnets up to a /16, one byte per
+        # subnet address (offset from the network address) marks it taken, so
+        # allocation is a single bytearray.find() instead of a walk over
+        # subnet.hosts(). The lock makes find-and-set atomic across request threads.
+        self.allocated_ips: Dict[str, str] = {}  # ip -> vm_id
+        self._ip_lock = threading.Lock()
+        self._network_int = int(self.subnet.network_address)
+        self._ip_bitmap: Optional[bytearray] = None
+        if self.subnet.version == 4 and self.subnet.num_addresses <= _BITMAP_MAX_ADDRESSES:
+            self._ip_bitmap = bytearray(self.subnet.num_addresses)
+            for ip in self.reserved_ips:
+                offset = self._ip_offset(ip)
+                if offset is not None:  # a /32 has no room for the gateway
+                    self._ip_bitmap[offset] = 1
         self.dry_run = dry_run
         
         logger.info(
@@ -72,13 +100,19 @@ class NetworkManager:
             f"dry_run={dry_run}"
         )
     
-    def _run_command(self, cmd: list[str], check: bool = True) -> subprocess.CompletedProcess:
-        """Run a system command."""
+    def _run_command(self, cmd: list[str], check: bool = True, input: Optional[str] = None,
+                     capture: bool = True) -> subprocess.CompletedProcess:
+        """Run a system command.
+        
+        With capture=False the output is discarded instead of piped back.
+        """
+        output = subprocess.PIPE if capture else subprocess.DEVNULL
         try:
             result = subprocess.run(
                 cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
+                input=input,
+                stdout=output,
+                stderr=output,
                 text=True,
                 timeout=10
             )
@@ -88,12 +122,21 @@ class NetworkManager:
         except subprocess.TimeoutExpired:
             raise RuntimeError(f"Command timed out: {' '.join(cmd)}")
     
+    def _run_ip_batch(self, commands: list[str], check: bool = True, capture: bool = True) -> subprocess.CompletedProcess:
+        """Run several `ip` commands in a single process (`ip -batch`).
+        
+        With -force the remaining commands still run after a failure; the
+        exit status is non-zero if any of them failed.
+        """
+        return self._run_command(["ip", "-force", "-batch", "-"], check=check, input="\n".join(commands) + "\n",
+                                 capture=capture)
+    
     def _interface_exists(self, interface: str) -> bool:
-        """Check if network interface exists."""
+        """Check if network interface exists (an ioctl, no `ip` process)."""
         try:
-            self._run_command(["ip", "link", "show", interface], check=False)
+            socket.if_nametoindex(interface)
             return True
-        except RuntimeError:
+        except OSError:
             return False
     
     def ensure_bridge(self) -> None:
@@ -107,11 +150,16 @@ class NetworkManager:
         if not bridge_exists:
             # Create bridge
             logger.info(f"Creating bridge {self.bridge_name}")
-            self._run_command(["ip", "link", "add", "name", self.bridge_name, "type", "bridge"])
-            self._run_command(["ip", "link", "set", self.bridge_name, "up"])
+            self._run_ip_batch([
+                f"link add name {self.bridge_name} type bridge",
+                f"link set {self.bridge_name} up",
+            ])
+        
+        # A new bridge has no addresses; otherwise list them once for both checks
+        addresses = self._interface_addresses(self.bridge_name) if bridge_exists else set()
         
         # Configure bridge IP (gateway)
-        if not self._has_ip(self.bridge_name, self.gateway):
+        if self.gateway not in addresses:
             logger.info(f"Configuring bridge IP: {self.gateway}")
             self._run_command([
                 "ip", "addr", "add", f"{self.gateway}/{self.subnet.prefixlen}",
@@ -120,7 +168,7 @@ class NetworkManager:
         
         # Configure metadata service IP (169.254.169.254) on bridge
         metadata_ip = "169.254.169.254"
-        if not self._has_ip(self.bridge_name, metadata_ip):
+        if metadata_ip not in addresses:
             logger.info(f"Configuring metadata service IP: {metadata_ip} on bridge")
             try:
                 self._run_command([
@@ -131,13 +179,22 @@ class NetworkManager:
                 # If IP already exists or other error, log but don't fail
                 logger.warning(f"Could not add metadata IP {metadata_ip} to bridge: {e}")
     
-    def _has_ip(self, interface: str, ip: str) -> bool:
-        """Check if interface has the specified IP."""
+    def _interface_addresses(self, interface: str) -> Set[str]:
+        """Return the IP addresses (without prefix length) configured on an interface."""
         try:
-            result = self._run_command(["ip", "addr", "show", interface])
-            return ip in result.stdout
+            result = self._run_command(["ip", "-o", "addr", "show", "dev", interface])
         except RuntimeError:
-            return False
+            return set()
+        tokens = result.stdout.split()
+        return {
+            tokens[i + 1].split("/")[0]
+            for i, token in enumerate(tokens[:-1])
+            if token in ("inet", "inet6")
+        }
+    
+    def _has_ip(self, interface: str, ip: str) -> bool:
+        """Check if interface has the specified IP."""
+        return ip in self._interface_addresses(interface)
     
     def allocate_ip(self, vm_id: str) -> str:
         """Allocate an IP address for a VM.
@@ -151,15 +208,48 @@ class NetworkManager:
         Raises:
             RuntimeError: If no IPs available
         """
-        # Find first available IP in subnet
-        for host in self.subnet.hosts():
-            ip_str = str(host)
-            if ip_str not in self.reserved_ips and ip_str not in self.allocated_ips:
-                self.allocated_ips.add(ip_str)
-                logger.info(f"Allocated IP {ip_str} for VM {vm_id}")
-                return ip_str
+        with self._ip_lock:
+            # Find first available IP in subnet
+            if self._ip_bitmap is not None:
+                offset = self._ip_bitmap.find(0)
+                if offset == -1:
+                    raise RuntimeError(f"No available IPs in subnet {self.subnet}")
+                self._ip_bitmap[offset] = 1
+                ip_str = str(self.subnet.network_address + offset)
+            else:
+                ip_str = next(
+                    (str(host) for host in self.subnet.hosts()
+                     if str(host) not in self.reserved_ips and str(host) not in self.allocated_ips),
+                    None
+                )
+                if ip_str is None:
+                    raise RuntimeError(f"No available IPs in subnet {self.subnet}")
+            self.allocated_ips[ip_str] = vm_id
+        logger.info(f"Allocated IP {ip_str} for VM {vm_id}")
+        return ip_str
+    
+    def claim_ip(self, ip: str, vm_id: str) -> bool:
+        """Mark a specific IP address as allocated (e.g. to reuse a VM's previous IP).
         
-        raise RuntimeError(f"No available IPs in subnet {self.subnet}")
+        Args:
+            ip: IP address to claim
+            vm_id: VM identifier
+            
+        Returns:
+            True if the IP was free and is now allocated, False otherwise
+        """
+        offset = self._ip_offset(ip)
+        if offset is None or ip in self.reserved_ips:
+            return False
+        with self._ip_lock:
+            if self._ip_bitmap is not None:
+                if self._ip_bitmap[offset]:
+                    return False
+                self._ip_bitmap[offset] = 1
+            elif ip in self.allocated_ips:
+                return False
+            self.allocated_ips[ip] = vm_id
+        return True
     
     def release_ip(self, ip: str) -> None:
         """Release an allocated IP address.
@@ -167,9 +257,27 @@ class NetworkManager:
         Args:
             ip: IP address to release
         """
-        if ip in self.allocated_ips:
-            self.allocated_ips.remove(ip)
-            logger.info(f"Released IP {ip}")
+        with self._ip_lock:
+            if self.allocated_ips.pop(ip, None) is None:
+                return
+            if self._ip_bitmap is not None:
+                self._ip_bitmap[self._ip_offset(ip)] = 0
+        logger.info(f"Released IP {ip}")
+    
+    def get_vm_id(self, ip: str) -> Optional[str]:
+        """Return the ID of the VM an IP address is allocated to, if any."""
+        return self.allocated_ips.get(ip)
+    
+    def _ip_offset(self, ip: str) -> Optional[int]:
+        """Return the offset of `ip` from the network address, or None if it is outside the subnet."""
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        if address.version != self.subnet.version:
+            return None
+        offset = int(address) - self._network_int
+        return offset if 0 <= offset < self.subnet.num_addresses else None
     
     def create_tap_interface(self, vm_id: str) -> str:
         """Create a TAP interface for a VM.
@@ -190,20 +298,16 @@ class NetworkManager:
             logger.debug(f"TAP interface {tap_name} already exists")
             return tap_name
         
-        # Create TAP interface
+        self.ensure_bridge()
+        
+        # Create TAP interface, set it up and add it to the bridge
         logger.info(f"Creating TAP interface {tap_name} for VM {vm_id}")
-        self._run_command([
-            "ip", "tuntap", "add", "name", tap_name,
-            "mode", "tap"
+        self._run_ip_batch([
+            f"tuntap add name {tap_name} mode tap",
+            f"link set {tap_name} up",
+            f"link set {tap_name} master {self.bridge_name}",
         ])
         
-        # Set interface up
-        self._run_command(["ip", "link", "set", tap_name, "up"])
-        
-        # Add to bridge
-        self.ensure_bridge()
-        self._run_command(["ip", "link", "set", tap_name, "master", self.bridge_name])
-        
         return tap_name
     
     def delete_tap_interface(self, tap_name: str) -> None:
@@ -220,15 +324,12 @@ class NetworkManager:
             return
         
         logger.info(f"Deleting TAP interface {tap_name}")
-        # Remove from bridge first
-        try:
-            self._run_command(["ip", "link", "set", tap_name, "nomaster"], check=False)
-        except RuntimeError:
-            pass
-        
-        # Delete interface
+        # Remove from bridge first, then delete interface
         try:
-            self._run_command(["ip", "link", "delete", tap_name], check=False)
+            self._run_ip_batch([
+                f"link set {tap_name} nomaster",
+                f"link delete {tap_name}",
+            ], check=False, capture=False)
         except RuntimeError:
             logger.warning(f"Failed to delete TAP interface {tap_name}")
     
@@ -252,5 +353,5 @@ class NetworkManager:
         Returns:
             Set of allocated IP addresses
         """
-        return self.allocated_ips.copy()
+        return set(self.allocated_ips)
 
@@ -6,25 +6,27 @@ The OBSERVER service runs periodic checks (interval ≤5s) to detect inconsisten
 - Logs mismatches without automatic correction (repair is policy-dependent).
 
 This module provides an ObserverInterface and a LocalObserver implementation
-that uses simple subprocess calls to check QEMU process state and filesystem.
+that checks QEMU PID files and the storage directories.
 """
 from __future__ import annotations
 
-import subprocess
 import threading
 import time
+from collections import deque
+from contextlib import nullcontext
+from itertools import islice
 import os
 from abc import ABC, abstractmethod
 from pathlib import Path
 from typing import List, Optional, Callable
 from dataclasses import dataclass
 
-from . import logging_config
+from . import logging_config, models
 
 logger = logging_config.UnifiedLogger.get_logger(__name__, logging_config.UnifiedLogger.SERVICE_OBSERVER)
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class CoherenceIssue:
     """Represents a detected data coherence problem."""
     issue_type: str  # "vm_state_mismatch", "missing_disk", "orphan_process", etc.
@@ -57,6 +59,9 @@ class LocalObserver(ObserverInterface):
     - Orphan QEMU processes or disk files not in the database.
     """
 
+    # Issues from the latest check kept for status reporting (circular buffer)
+    MAX_TRACKED_ISSUES = 256
+
     def __init__(self, db_session_factory: Optional[Callable] = None, operator=None, 
                  storage_path: Optional[Path] = None, check_interval: float = 5.0):
         """Initialize observer.
@@ -65,33 +70,62 @@ class LocalObserver(ObserverInterface):
             db_session_factory: Callable that returns a DB session (e.g., SessionLocal).
             operator: Reference to OPERATOR for storage path and VM process checks.
             storage_path: Base storage path for VMs and disks (from operator if not provided).
-            check_interval: Time in seconds between checks (will be clamped to ≤5s).
+            check_interval: Time in seconds between checks (clamped to 0.1s-5s).
         """
         self.db_session_factory = db_session_factory
         self.operator = operator
         self.storage_path = Path(storage_path) if storage_path else (
             Path(operator.storage_path) if operator else Path(os.environ.get("VMAN_STORAGE_PATH", "/var/lib/vman"))
         )
-        self.check_interval = min(float(check_interval), 5.0)
+        # A zero or negative interval would make the loop re-check without pausing
+        self.check_interval = max(0.1, min(float(check_interval), 5.0))
         self.running = False
         self.thread: Optional[threading.Thread] = None
-        self.last_issues: List[CoherenceIssue] = []
+        self.last_issues: deque[CoherenceIssue] = deque(maxlen=self.MAX_TRACKED_ISSUES)
+        # Issues found by the last check, including any beyond MAX_TRACKED_ISSUES
+        self.last_issues_count = 0
+        self._lock = threading.Lock()  # guards last_issues and last_issues_count
+        # Wakes the loop early, for stop() or request_check(); bursts of
+        # requests during a check coalesce into a single extra check
+        self._wakeup = threading.Condition()
+        self._check_requested = False
+        # Directory listings by path, as (st_mtime_ns, names); see _list_dir
+        self._dir_cache: dict[str, tuple[int, frozenset[str]]] = {}
 
     def check_coherence(self) -> List[CoherenceIssue]:
         """Run all coherence checks and return issues."""
         issues = []
 
-        # Check VMs: compare DB state with running QEMU processes.
-        issues.extend(self._check_vm_coherence())
+        # Both checks share one session (and pooled connection) per cycle
+        with self.db_session_factory() if self.db_session_factory else nullcontext() as db_session:
+            # Check VMs: compare DB state with running QEMU processes.
+            issues.extend(self._check_vm_coherence(db_session))
 
-        # Check disks: compare DB state with filesystem.
-        issues.extend(self._check_disk_coherence())
+            # Check disks: compare DB state with filesystem.
+            issues.extend(self._check_disk_coherence(db_session))
 
-        self.last_issues = issues
+        with self._lock:
+            self.last_issues.clear()
+            self.last_issues.extend(issues)
+            self.last_issues_count = len(issues)
         return issues
 
-    def _check_vm_coherence(self) -> List[CoherenceIssue]:
-        """Check VM state coherence against QEMU processes."""
+    def get_last_issues(self, limit: Optional[int] = None) -> tuple:
+        """Return a consistent snapshot of the most recent issues.
+
+        Args:
+            limit: If set, only the last `limit` issues are returned.
+        """
+        with self._lock:
+            start = 0 if limit is None else max(len(self.last_issues) - limit, 0)
+            return tuple(islice(self.last_issues, start, None))
+
+    def _check_vm_coherence(self, db_session=None) -> List[CoherenceIssue]:
+        """Check VM state coherence against QEMU processes.
+
+        Args:
+            db_session: Session to query with; a new one is opened if omitted.
+        """
         issues = []
 
         if not self.db_session_factory:
@@ -99,22 +133,17 @@ class LocalObserver(ObserverInterface):
             return issues
 
         try:
-            # Get list of running QEMU processes
-            running_pids = self._get_running_qemu_pids()
-            # Get VM IDs from PID files
+            # Get VM IDs from PID files (each checked for a live process)
             running_vm_ids = self._get_vm_ids_from_pid_files()
         except Exception as e:
             logger.error("Failed to get QEMU processes: %s", e)
             return issues
 
         try:
-            # Import here to avoid circular imports
-            from . import models
-            
             # Query all VMs from DB
-            db_session = self.db_session_factory()
-            try:
-                db_vms = db_session.query(models.VM).all()
+            with nullcontext(db_session) if db_session is not None else self.db_session_factory() as db_session:
+                # Only the columns checked here, as plain rows (no ORM objects)
+                db_vms = db_session.query(models.VM.id, models.VM.state).all()
                 
                 # Check each DB VM
                 for vm in db_vms:
@@ -144,15 +173,17 @@ class LocalObserver(ObserverInterface):
                             resource_id=vm_id,
                             details="QEMU process running but VM not found in database"
                         ))
-            finally:
-                db_session.close()
         except Exception as e:
             logger.error("Failed to query VMs from DB: %s", e)
 
         return issues
 
-    def _check_disk_coherence(self) -> List[CoherenceIssue]:
-        """Check disk state coherence against filesystem."""
+    def _check_disk_coherence(self, db_session=None) -> List[CoherenceIssue]:
+        """Check disk state coherence against filesystem.
+
+        Args:
+            db_session: Session to query with; a new one is opened if omitted.
+        """
         issues = []
 
         if not self.db_session_factory:
@@ -160,24 +191,26 @@ class LocalObserver(ObserverInterface):
             return issues
 
         try:
-            # Import here to avoid circular imports
-            from . import models
-            
             # Query all disks from DB
-            db_session = self.db_session_factory()
-            try:
-                db_disks = db_session.query(models.Disk).all()
+            with nullcontext(db_session) if db_session is not None else self.db_session_factory() as db_session:
+                # Only the columns checked here, as plain rows (no ORM objects)
+                db_disks = db_session.query(models.Disk.id, models.Disk.state, models.Disk.vm_id).all()
+                
+                # One directory listing gives the disk IDs present on disk, so
+                # missing and orphan disks are set lookups instead of a stat each
+                disks_dir = self.storage_path / "disks"
+                fs_disk_ids = {name[:-len(".qcow2")] for name in self._list_dir(disks_dir) if name.endswith(".qcow2")}
                 
                 # Check each DB disk
                 for disk in db_disks:
-                    disk_path = self.storage_path / "disks" / f"{disk.id}.qcow2"
-                    
-                    if not disk_path.exists():
+                    if disk.state == "creating":
+                        continue  # Image creation in progress; the file may not exist yet
+                    if disk.id not in fs_disk_ids:
                         # DB has disk record but file doesn't exist
                         issues.append(CoherenceIssue(
                             issue_type="missing_disk",
                             resource_id=disk.id,
-                            details=f"Disk file not found: {disk_path}"
+                            details=f"Disk file not found: {disks_dir / f'{disk.id}.qcow2'}"
                         ))
                     elif disk.state == "attached" and not disk.vm_id:
                         # Disk marked as attached but no VM ID
@@ -195,19 +228,12 @@ class LocalObserver(ObserverInterface):
                         ))
                 
                 # Check for orphan disk files (exist but not in DB)
-                disks_dir = self.storage_path / "disks"
-                if disks_dir.exists():
-                    db_disk_ids = {disk.id for disk in db_disks}
-                    for disk_file in disks_dir.glob("*.qcow2"):
-                        disk_id = disk_file.stem  # filename without .qcow2
-                        if disk_id not in db_disk_ids:
-                            issues.append(CoherenceIssue(
-                                issue_type="orphan_disk",
-                                resource_id=disk_id,
-                                details=f"Disk file exists but not found in database: {disk_file}"
-                            ))
-            finally:
-                db_session.close()
+                for disk_id in fs_disk_ids - {disk.id for disk in db_disks}:
+                    issues.append(CoherenceIssue(
+                        issue_type="orphan_disk",
+                        resource_id=disk_id,
+                        details=f"Disk file exists but not found in database: {disks_dir / f'{disk_id}.qcow2'}"
+                    ))
         except Exception as e:
             logger.error("Failed to query disks from DB: %s", e)
 
@@ -220,72 +246,51 @@ class LocalObserver(ObserverInterface):
             List of VM IDs that have PID files (indicating they should be running).
         """
         vm_ids = []
-        vms_dir = self.storage_path / "vms"
+        vms_dir = str(self.storage_path / "vms")
         
-        if not vms_dir.exists():
-            return vm_ids
-        
-        for vm_dir in vms_dir.iterdir():
-            if vm_dir.is_dir():
-                pid_file = vm_dir / "qemu.pid"
-                if pid_file.exists():
-                    # Check if process is actually running
-                    try:
-                        pid = int(pid_file.read_text().strip())
-                        os.kill(pid, 0)  # Signal 0 checks if process exists
-                        vm_ids.append(vm_dir.name)
-                    except (ValueError, OSError, ProcessLookupError):
-                        # PID file exists but process is dead - this will be caught by VM coherence check
-                        pass
+        for name in self._list_dir(vms_dir):
+            # Check if process is actually running
+            try:
+                with open(os.path.join(vms_dir, name, "qemu.pid")) as pid_file:
+                    pid = int(pid_file.read().strip())
+                os.kill(pid, 0)  # Signal 0 checks if process exists
+                vm_ids.append(name)
+            except (ValueError, OSError):
+                # Not a VM directory, no PID file, or the process is dead -
+                # the latter is caught by VM coherence check
+                pass
         
         return vm_ids
 
-    def _get_running_qemu_pids(self) -> List[int]:
-        """Get list of running QEMU process IDs using pgrep or ps.
+    def _list_dir(self, directory) -> frozenset[str]:
+        """Return the entry names in a directory, re-listing it only when it changed.
+
+        Creating, deleting or renaming an entry bumps the directory's mtime, so
+        on a steady host each check costs one stat() instead of a full listing.
+        A listing taken within a second of the last change is not reused, as a
+        change in the same timestamp tick would otherwise go unnoticed.
 
         Returns:
-            List of QEMU process IDs, or empty list on error.
+            Entry names, or an empty set if the directory does not exist.
         """
+        directory = os.fspath(directory)
         try:
-            # Try pgrep first (faster and more portable).
-            result = subprocess.run(
-                ["pgrep", "-f", "qemu"],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.DEVNULL,
-                text=True,
-                timeout=2,
-            )
-            if result.returncode == 0:
-                return [int(pid) for pid in result.stdout.strip().split("\n") if pid]
-            return []
+            mtime = os.stat(directory).st_mtime_ns
         except FileNotFoundError:
-            logger.debug("pgrep not available; trying ps")
-        except Exception as e:
-            logger.error("Error running pgrep: %s", e)
-            return []
+            return frozenset()
+
+        cached = self._dir_cache.get(directory)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
 
-        # Fallback: use ps (less efficient but more portable).
         try:
-            result = subprocess.run(
-                ["ps", "aux"],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.DEVNULL,
-                text=True,
-                timeout=2,
-            )
-            pids = []
-            for line in result.stdout.split("\n"):
-                if "qemu" in line.lower():
-                    parts = line.split()
-                    if len(parts) > 1:
-                        try:
-                            pids.append(int(parts[1]))
-                        except ValueError:
-                            pass
-            return pids
-        except Exception as e:
-            logger.error("Error running ps: %s", e)
-            return []
+            with os.scandir(directory) as entries:
+                names = frozenset(entry.name for entry in entries)
+        except FileNotFoundError:
+            return frozenset()
+        if time.time_ns() - mtime > 1_000_000_000:
+            self._dir_cache[directory] = (mtime, names)
+        return names
 
     def _observer_loop(self) -> None:
         """Background thread loop for periodic coherence checks."""
@@ -304,11 +309,19 @@ class LocalObserver(ObserverInterface):
             except Exception as e:
                 logger.error("Error in observer loop: %s", e)
 
-            # Sleep for the check interval, but allow for quick stop.
-            for _ in range(int(self.check_interval * 10)):
-                if not self.running:
-                    break
-                time.sleep(0.1)
+            # Sleep for the check interval, but wake immediately on stop or request.
+            # wait_for keeps a monotonic deadline, so an unrelated wakeup does
+            # not shorten or restart the interval.
+            with self._wakeup:
+                self._wakeup.wait_for(lambda: not self.running or self._check_requested,
+                                      timeout=self.check_interval)
+                self._check_requested = False
+
+    def request_check(self) -> None:
+        """Ask the running observer to check coherence now instead of at the next interval."""
+        with self._wakeup:
+            self._check_requested = True
+            self._wakeup.notify()
 
     def start(self) -> None:
         """Start the observer background thread."""
@@ -317,6 +330,7 @@ class LocalObserver(ObserverInterface):
             return
 
         self.running = True
+        self._check_requested = False
         self.thread = threading.Thread(target=self._observer_loop, daemon=True)
         self.thread.start()
         logger.info("Observer started")
@@ -327,7 +341,9 @@ class LocalObserver(ObserverInterface):
             logger.warning("Observer not running")
             return
 
-        self.running = False
+        with self._wakeup:
+            self.running = False
+            self._wakeup.notify()
         if self.thread:
             self.thread.join(timeout=5.0)
             logger.info("Observer stopped")
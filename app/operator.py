@@ -8,11 +8,17 @@ hot-plugging disks.
 """
 from __future__ import annotations
 
+import fcntl
+import functools
 import subprocess
 import shutil
+import hashlib
 import os
+import re
+import select
 import signal
 import socket
+import threading
 import json
 import time
 from abc import ABC, abstractmethod
@@ -26,6 +32,57 @@ logger = logging_config.UnifiedLogger.get_logger(__name__, logging_config.Unifie
 # Network manager will be imported when needed to avoid circular imports
 
 
+
+@functools.lru_cache(maxsize=32)
+def _which_cached(name: str, path_env: str) -> Optional[str]:
+    """shutil.which, memoized per binary name and PATH value."""
+    return shutil.which(name, path=path_env)
+
+
+def _which(name: str) -> Optional[str]:
+    """Locate a binary on PATH; repeated lookups with an unchanged PATH are free."""
+    return _which_cached(name, os.environ.get("PATH", os.defpath))
+
+
+@functools.lru_cache(maxsize=8)
+def _qemu_img_version(qemu_img: str) -> tuple:
+    """Return the (major, minor) version of a qemu-img binary, or (0, 0) if unknown."""
+    try:
+        result = subprocess.run([qemu_img, "--version"], stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, text=True, timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return (0, 0)
+    match = re.search(r"version (\d+)\.(\d+)", result.stdout)
+    return (int(match.group(1)), int(match.group(2))) if match else (0, 0)
+
+
+# ioctl cloning a whole file as a reflink (linux/fs.h: _IOW(0x94, 9, int))
+_FICLONE = 0x40049409
+
+
+def _copy_file_contents(src_file, dst_file) -> None:
+    """Copy file contents in the kernel with copy_file_range, falling back to read/write."""
+    size = os.fstat(src_file.fileno()).st_size
+    copied = 0
+    try:
+        while copied < size:
+            n = os.copy_file_range(src_file.fileno(), dst_file.fileno(), size - copied)
+            if n == 0:
+                break
+            copied += n
+    except (AttributeError, OSError):
+        if copied:
+            raise
+        # Not supported here (non-Linux, or across filesystems on old kernels)
+        shutil.copyfileobj(src_file, dst_file)
+
+
+def vm_mac_address(vm_id: str) -> str:
+    """Return the MAC address assigned to a VM's NIC, derived from its ID."""
+    mac_hash = hashlib.md5(vm_id.encode()).hexdigest()[:6]
+    return f"52:54:{mac_hash[0:2]}:{mac_hash[2:4]}:{mac_hash[4:6]}:00"
+
+
 class OperatorError(RuntimeError):
     pass
 
@@ -38,9 +95,13 @@ class OperatorInterface(ABC):
     """
 
     @abstractmethod
-    def create_disk_image(self, path: Path, size_gb: int, fmt: str = "qcow2") -> Path:
+    def create_disk_image(self, path: Path, size_gb: Optional[int], fmt: str = "qcow2",
+                          backing: Optional[Path] = None) -> Path:
         """Create a disk image at `path` with size `size_gb` (GB).
 
+        With `backing`, the image is a copy-on-write overlay of that qcow2
+        image; `size_gb` may then be None to inherit the backing image's size.
+
         Returns the path to the created image on success, or raises OperatorError.
         """
 
@@ -69,8 +130,11 @@ class OperatorInterface(ABC):
         """
 
     @abstractmethod
-    def start_vm(self, vm_id: str, qcow2_path: Optional[Path] = None) -> None:
-        """Start a VM identified by vm_id. Optional qcow2_path for root disk."""
+    def start_vm(self, vm_id: str, qcow2_path: Optional[Path] = None) -> Optional[str]:
+        """Start a VM identified by vm_id. Optional qcow2_path for root disk.
+        
+        Returns the IP address assigned to the VM, or None if it has none.
+        """
 
     @abstractmethod
     def stop_vm(self, vm_id: str) -> None:
@@ -88,13 +152,18 @@ class LocalOperator(OperatorInterface):
     Note: VMAN only supports x86_64 architecture. Other architectures are not supported.
     """
 
+    # qemu-img release that introduced extended L2 entries (subcluster allocation)
+    EXTENDED_L2_MIN_VERSION = (5, 2)
+
     def __init__(self, dry_run: bool = False, storage_path: Optional[Path] = None, 
-                 network_manager=None, default_boot_disk: Optional[Path] = None):
-        self.qemu_img = shutil.which("qemu-img")
+                 network_manager=None, default_boot_disk: Optional[Path] = None,
+                 cluster_size: Optional[str] = "128k", extended_l2: bool = True,
+                 boot_disk_overlay: Optional[bool] = None):
+        self.qemu_img = _which("qemu-img")
         
         # VMAN only supports x86_64 architecture
         # Enforce x86_64 QEMU binary selection
-        self.qemu_bin = shutil.which("qemu-system-x86_64") or shutil.which("qemu-kvm")
+        self.qemu_bin = _which("qemu-system-x86_64") or _which("qemu-kvm")
         
         self.dry_run = bool(dry_run or os.environ.get("VMAN_OPERATOR_DRY_RUN") == "1")
         
@@ -104,6 +173,25 @@ class LocalOperator(OperatorInterface):
         self.storage_path = Path(storage_path or os.environ.get("VMAN_STORAGE_PATH", "/var/lib/vman"))
         self.network_manager = network_manager
         
+        # qcow2 layout for new images; None / False keep qemu-img's defaults
+        self.cluster_size = cluster_size
+        self.extended_l2 = extended_l2
+        
+        # Fixed storage roots already created and checked writable by
+        # ensure_storage_dir. Per-VM directories come and go with their VMs, so
+        # they are validated on every call instead of accumulating here.
+        self._storage_roots = frozenset(
+            (self.storage_path, self.storage_path / "vms", self.storage_path / "disks")
+        )
+        self._writable_dirs: set[Path] = set()
+        
+        # Negotiated QMP connections by socket path, as (socket, reader). Each
+        # path has its own lock serializing exchanges on its connection, so
+        # commands to different VMs run concurrently; _qmp_lock guards _qmp_locks
+        self._qmp_conns: dict[str, tuple[socket.socket, object]] = {}
+        self._qmp_locks: dict[str, threading.Lock] = {}
+        self._qmp_lock = threading.Lock()
+        
         # Default boot disk configuration
         default_boot_disk_env = os.environ.get("VMAN_DEFAULT_BOOT_DISK")
         if default_boot_disk is None and default_boot_disk_env:
@@ -114,6 +202,12 @@ class LocalOperator(OperatorInterface):
             logger.warning("Default boot disk specified but not found: %s", self.default_boot_disk)
             self.default_boot_disk = None
         
+        # Root disks as copy-on-write overlays of the default boot disk instead
+        # of full copies; the boot disk must then stay unmodified
+        if boot_disk_overlay is None:
+            boot_disk_overlay = os.environ.get("VMAN_BOOT_DISK_OVERLAY") == "1"
+        self.boot_disk_overlay = boot_disk_overlay
+        
         logger.debug("LocalOperator init: qemu-img=%s qemu-bin=%s storage=%s dry_run=%s network=%s default_boot_disk=%s",
                     self.qemu_img, self.qemu_bin, self.storage_path, self.dry_run,
                     "enabled" if network_manager else "disabled",
@@ -177,10 +271,12 @@ class LocalOperator(OperatorInterface):
     def _is_vm_running(self, vm_id: str) -> bool:
         """Check if VM is running by verifying PID file and process."""
         pid_file = self._get_vm_pid_file(vm_id)
-        if not pid_file.exists():
+        try:
+            pid_text = pid_file.read_text()
+        except FileNotFoundError:
             return False
         try:
-            pid = int(pid_file.read_text().strip())
+            pid = int(pid_text.strip())
             # Signal 0 doesn't kill, just checks existence
             os.kill(pid, 0)
             return True
@@ -189,78 +285,206 @@ class LocalOperator(OperatorInterface):
             pid_file.unlink(missing_ok=True)
             return False
     
-    def _qmp_command(self, qmp_sock: Path, command: dict, timeout: float = 5.0) -> dict:
-        """Send a QMP command to QEMU monitor socket."""
-        if not qmp_sock.exists():
-            raise OperatorError(f"QMP socket not found: {qmp_sock}")
-        
+    @staticmethod
+    def _qmp_read(reader) -> dict:
+        """Read the next QMP reply line, skipping asynchronous event notifications."""
+        while True:
+            message = json.loads(reader.readline())
+            if "event" not in message:
+                return message
+
+    @staticmethod
+    def _wait_for_exit(pid: int, timeout: float) -> bool:
+        """Wait until process `pid` exits or `timeout` seconds pass.
+
+        Uses a pidfd, which becomes readable when the process terminates, so
+        the wait ends as soon as QEMU exits. Falls back to polling where
+        pidfd_open is unavailable (non-Linux or kernels older than 5.3).
+
+        Returns:
+            True if the process exited within the timeout.
+        """
+        try:
+            pidfd = os.pidfd_open(pid)
+        except ProcessLookupError:
+            return True
+        except (AttributeError, OSError):
+            deadline = time.monotonic() + timeout
+            while True:
+                try:
+                    os.kill(pid, 0)
+                except ProcessLookupError:
+                    return True
+                except OSError:
+                    pass
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                time.sleep(min(0.1, remaining))
+        try:
+            readable, _, _ = select.select([pidfd], [], [], timeout)
+            return bool(readable)
+        finally:
+            os.close(pidfd)
+
+    def _qmp_connect(self, qmp_sock: Path, timeout: float) -> tuple:
+        """Open a QMP connection and complete the capabilities handshake.
+
+        Returns:
+            The connected socket and a buffered reader over it.
+        """
         sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        reader = None
         try:
             sock.settimeout(timeout)
             sock.connect(str(qmp_sock))
+            # QMP is line-delimited JSON: one buffered reader serves every reply
+            reader = sock.makefile("rb")
             
             # QMP handshake
-            greeting_data = b""
-            while b"\n" not in greeting_data:
-                greeting_data += sock.recv(1024)
-            greeting = json.loads(greeting_data.decode())
+            greeting = json.loads(reader.readline())
             if "QMP" not in greeting:
                 raise OperatorError("Invalid QMP greeting")
             
             # Enable QMP
-            sock.send(json.dumps({"execute": "qmp_capabilities"}).encode() + b"\n")
-            response_data = b""
-            while b"\n" not in response_data:
-                response_data += sock.recv(1024)
-            response = json.loads(response_data.decode())
+            sock.sendall(json.dumps({"execute": "qmp_capabilities"}).encode() + b"\n")
+            response = self._qmp_read(reader)
             if "error" in response:
                 raise OperatorError(f"QMP capabilities failed: {response['error']}")
-            
-            # Send command
-            sock.send(json.dumps(command).encode() + b"\n")
-            response_data = b""
-            while b"\n" not in response_data:
-                chunk = sock.recv(4096)
-                if not chunk:
-                    break
-                response_data += chunk
-            response = json.loads(response_data.decode())
-            
-            if "error" in response:
-                raise OperatorError(f"QMP command failed: {response['error']}")
-            
-            return response
-            
-        except socket.timeout:
-            raise OperatorError("QMP command timed out")
-        except json.JSONDecodeError as e:
-            raise OperatorError(f"Invalid QMP response: {e}")
-        except Exception as e:
-            raise OperatorError(f"QMP communication failed: {e}")
-        finally:
+            return sock, reader
+        except BaseException:
+            if reader is not None:
+                reader.close()
+            sock.close()
+            raise
+
+    def _qmp_path_lock(self, key: str) -> threading.Lock:
+        """Return the lock serializing QMP exchanges on one socket path."""
+        with self._qmp_lock:
+            return self._qmp_locks.setdefault(key, threading.Lock())
+
+    def _qmp_close(self, qmp_sock: Path) -> None:
+        """Close the cached QMP connection for a socket, if any."""
+        key = str(qmp_sock)
+        with self._qmp_path_lock(key):
+            self._qmp_drop(key)
+
+    def _qmp_drop(self, key: str) -> None:
+        """Close and forget a cached connection; caller holds the path's lock."""
+        conn = self._qmp_conns.pop(key, None)
+        if conn is not None:
+            sock, reader = conn
+            reader.close()
             sock.close()
 
-    def create_disk_image(self, path: Path, size_gb: int, fmt: str = "qcow2") -> Path:
+    def _qmp_exchange(self, qmp_sock: Path, command: dict, timeout: float) -> dict:
+        """Send one command on the cached connection and read its reply.
+
+        Must be called with the socket path's lock held.
+        """
+        key = str(qmp_sock)
+        payload = json.dumps(command).encode() + b"\n"
+        try:
+            conn = self._qmp_conns.get(key)
+            if conn is not None:
+                sock, reader = conn
+                sock.settimeout(timeout)
+                try:
+                    sock.sendall(payload)
+                    return self._qmp_read(reader)
+                except (BrokenPipeError, ConnectionResetError):
+                    # QEMU closed the connection since its last use and the
+                    # command was not delivered: reconnect and resend once
+                    self._qmp_drop(key)
+            
+            sock, reader = self._qmp_conns[key] = self._qmp_connect(qmp_sock, timeout)
+            sock.sendall(payload)
+            return self._qmp_read(reader)
+        except BaseException:
+            self._qmp_drop(key)  # The reply stream may be out of step
+            raise
+
+    def _qmp_command(self, qmp_sock: Path, command: dict, timeout: float = 5.0) -> dict:
+        """Send a QMP command to QEMU monitor socket.
+
+        The negotiated connection is kept and reused by later commands to the
+        same VM, so the greeting and capabilities handshake happen once.
+        """
+        if not qmp_sock.exists():
+            raise OperatorError(f"QMP socket not found: {qmp_sock}")
+        
+        with self._qmp_path_lock(str(qmp_sock)):
+            try:
+                response = self._qmp_exchange(qmp_sock, command, timeout)
+            except socket.timeout:
+                raise OperatorError("QMP command timed out")
+            except json.JSONDecodeError as e:
+                raise OperatorError(f"Invalid QMP response: {e}")
+            except Exception as e:
+                raise OperatorError(f"QMP communication failed: {e}")
+        
+        if "error" in response:
+            raise OperatorError(f"QMP command failed: {response['error']}")
+        
+        return response
+
+    def _qemu_img_create_cmd(self, path: Path, size_gb: Optional[int], fmt: str = "qcow2",
+                             backing: Optional[Path] = None) -> list:
+        """Build the qemu-img command creating an image of `size_gb` GB.
+
+        qcow2 images use larger clusters with extended L2 entries (subcluster
+        allocation) when qemu-img supports them, which cuts metadata
+        allocations on first write and keeps sparse images small. With
+        `backing`, the image is an overlay of that qcow2 image and `size_gb`
+        may be None to inherit its size.
+        """
+        cmd = [self.qemu_img, "create", "-f", fmt]
+        if backing is not None:
+            cmd.extend(["-F", "qcow2", "-b", str(backing)])
+        if fmt == "qcow2":
+            options = []
+            if self.extended_l2 and _qemu_img_version(self.qemu_img) >= self.EXTENDED_L2_MIN_VERSION:
+                options.append("extended_l2=on")
+            if self.cluster_size:
+                options.append(f"cluster_size={self.cluster_size}")
+            if options:
+                cmd.extend(["-o", ",".join(options)])
+        cmd.append(str(path))
+        if size_gb is not None:
+            cmd.append(f"{size_gb}G")
+        return cmd
+
+    def create_disk_image(self, path: Path, size_gb: Optional[int], fmt: str = "qcow2",
+                          backing: Optional[Path] = None) -> Path:
         path = Path(path)
-        # Validate size (even in dry-run mode)
-        if size_gb <= 0:
+        # Validate size (even in dry-run mode); overlays may inherit theirs
+        if size_gb is None:
+            if backing is None:
+                raise ValueError("Disk size is required unless a backing image is given")
+        elif size_gb <= 0:
             raise ValueError(f"Invalid disk size: {size_gb}GB (must be > 0)")
+        if backing is not None:
+            if fmt != "qcow2":
+                raise ValueError(f"Backing images require qcow2 format, not {fmt}")
+            backing = Path(backing).resolve()
+            if not backing.exists():
+                raise OperatorError(f"Backing image not found: {backing}")
         
         self.ensure_storage_dir(path)
         if path.exists():
             raise OperatorError(f"Disk image already exists: {path}")
 
         if self.dry_run:
-            logger.info("dry-run: would create disk %s size=%dG fmt=%s", path, size_gb, fmt)
+            logger.info("dry-run: would create disk %s size=%sG fmt=%s backing=%s", path, size_gb, fmt, backing)
             return path
 
         if not self.qemu_img:
             raise OperatorError("qemu-img not found in PATH; cannot create disk image")
 
-        cmd = [self.qemu_img, "create", "-f", fmt, str(path), f"{size_gb}G"]
+        cmd = self._qemu_img_create_cmd(path, size_gb, fmt, backing)
         logger.debug("Running: %s", " ".join(cmd))
         try:
-            subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
         except subprocess.CalledProcessError as e:
             logger.error("qemu-img failed: %s", e.stderr.decode(errors="ignore"))
             raise OperatorError(f"qemu-img failed: {e}")
@@ -284,14 +508,60 @@ class LocalOperator(OperatorInterface):
         except Exception as e:
             raise OperatorError(f"Failed to delete disk image {path}: {e}")
 
+    def clone_disk_image(self, src: Path, dst: Path) -> Path:
+        """Copy a disk image file to `dst`, sharing blocks with `src` where possible.
+
+        Tries a reflink first (instant copy-on-write clone on Btrfs/XFS), then
+        an in-kernel copy_file_range, so the data never passes through user
+        space. Prefer this over `qemu-img convert` for same-format copies.
+
+        Returns the path to the clone, or raises OperatorError.
+        """
+        src, dst = Path(src), Path(dst)
+        if not src.exists():
+            raise OperatorError(f"Disk image not found: {src}")
+        
+        self.ensure_storage_dir(dst)
+        if dst.exists():
+            raise OperatorError(f"Disk image already exists: {dst}")
+        
+        if self.dry_run:
+            logger.info("dry-run: would clone disk %s to %s", src, dst)
+            return dst
+        
+        created = False
+        try:
+            with open(src, "rb") as src_file, open(dst, "xb") as dst_file:
+                # Exclusive create: from here on dst is ours to clean up
+                created = True
+                try:
+                    fcntl.ioctl(dst_file.fileno(), _FICLONE, src_file.fileno())
+                except OSError:
+                    # Filesystem without reflinks, or src and dst on different ones
+                    _copy_file_contents(src_file, dst_file)
+            shutil.copystat(src, dst)
+        except FileExistsError:
+            # Created concurrently by someone else; not ours to remove
+            raise OperatorError(f"Disk image already exists: {dst}")
+        except OSError as e:
+            if created:
+                dst.unlink(missing_ok=True)
+            raise OperatorError(f"Failed to clone disk image {src}: {e}")
+        return dst
+
     def ensure_storage_dir(self, path: Path) -> Path:
         d = path.parent
+        # The storage roots are stable within a process: validate each once
+        if d in self._writable_dirs:
+            return d
         try:
             d.mkdir(parents=True, exist_ok=True)
         except Exception as e:
             raise OperatorError(f"Failed to create storage directory {d}: {e}")
         if not os.access(d, os.W_OK):
             raise OperatorError(f"Storage directory not writable: {d}")
+        if d in self._storage_roots:
+            self._writable_dirs.add(d)  # Racing threads at worst validate twice
         return d
 
     def _limit_console_file(self, console_file: Path, max_size: int = 50 * 1024) -> None:
@@ -334,11 +604,15 @@ class LocalOperator(OperatorInterface):
             self._limit_console_file(console_file)
 
     def start_vm(self, vm_id: str, qcow2_path: Optional[Path] = None,
-                 cpu_count: int = 1, ram_gb: int = 1) -> None:
-        """Start a VM with specified resources."""
+                 cpu_count: int = 1, ram_gb: int = 1) -> Optional[str]:
+        """Start a VM with specified resources.
+        
+        Returns:
+            The bridge IP allocated to the VM, or None (dry-run or user-mode networking).
+        """
         if self.dry_run:
             logger.info("dry-run: would start VM %s cpu=%d ram=%dG", vm_id, cpu_count, ram_gb)
-            return
+            return None
         
         if self._is_vm_running(vm_id):
             raise OperatorError(f"VM {vm_id} is already running")
@@ -355,6 +629,7 @@ class LocalOperator(OperatorInterface):
         
         # QMP socket path
         qmp_sock = self._get_vm_qmp_socket(vm_id)
+        self._qmp_close(qmp_sock)  # Connection to a previous QEMU instance
         if qmp_sock.exists():
             qmp_sock.unlink()  # Clean up stale socket
         
@@ -365,16 +640,21 @@ class LocalOperator(OperatorInterface):
                 # Use default boot disk if configured, otherwise create empty disk
                 if self.default_boot_disk and self.default_boot_disk.exists():
                     logger.info("Using default boot disk %s for VM %s", self.default_boot_disk, vm_id)
-                    # Copy default boot disk to VM directory (each VM gets its own copy)
-                    shutil.copy2(self.default_boot_disk, qcow2_path)
-                    logger.debug("Copied default boot disk to %s", qcow2_path)
+                    if self.boot_disk_overlay and self.qemu_img:
+                        # Thin overlay: only the VM's own writes take space
+                        self.create_disk_image(qcow2_path, None, backing=self.default_boot_disk)
+                        logger.debug("Created overlay %s on default boot disk", qcow2_path)
+                    else:
+                        # Copy default boot disk to VM directory (each VM gets its own copy)
+                        self.clone_disk_image(self.default_boot_disk, qcow2_path)
+                        logger.debug("Copied default boot disk to %s", qcow2_path)
                 else:
                     # Create minimal root disk (10GB default) if no default boot disk
                     if not self.qemu_img:
                         raise OperatorError("qemu-img not found; cannot create root disk")
                     logger.info("Creating empty root disk for VM %s", vm_id)
-                    cmd = [self.qemu_img, "create", "-f", "qcow2", str(qcow2_path), "10G"]
-                    subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                    cmd = self._qemu_img_create_cmd(qcow2_path, 10)
+                    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
         
         if not qcow2_path.exists():
             raise OperatorError(f"Root disk not found: {qcow2_path}")
@@ -399,9 +679,8 @@ class LocalOperator(OperatorInterface):
                 tap_name = self.network_manager.create_tap_interface(vm_id)
                 
                 # Allocate IP address (reuse previous if available and not allocated)
-                if previous_ip and previous_ip not in self.network_manager.get_allocated_ips():
+                if previous_ip and self.network_manager.claim_ip(previous_ip, vm_id):
                     vm_ip = previous_ip
-                    self.network_manager.allocated_ips.add(vm_ip)
                     logger.info(f"Reusing previous IP {vm_ip} for VM {vm_id}")
                 else:
                     vm_ip = self.network_manager.allocate_ip(vm_id)
@@ -435,9 +714,7 @@ class LocalOperator(OperatorInterface):
         # Add network configuration
         if tap_name:
             # Generate unique MAC address based on VM ID
-            import hashlib
-            mac_hash = hashlib.md5(vm_id.encode()).hexdigest()[:6]
-            mac = f"52:54:{mac_hash[0:2]}:{mac_hash[2:4]}:{mac_hash[4:6]}:00"
+            mac = vm_mac_address(vm_id)
             
             # Store MAC address for metadata service lookup
             (vm_dir / "mac.txt").write_text(mac)
@@ -477,6 +754,7 @@ class LocalOperator(OperatorInterface):
             logger.info(f"Started VM {vm_id} (PID: {pid_file.read_text().strip()})")
             if vm_ip:
                 logger.info(f"VM {vm_id} assigned IP: {vm_ip}")
+            return vm_ip
             
         except subprocess.TimeoutExpired:
             # Cleanup network resources on failure
@@ -517,23 +795,24 @@ class LocalOperator(OperatorInterface):
             # Try graceful shutdown via QMP
             try:
                 self._qmp_command(qmp_sock, {"execute": "system_powerdown"})
+                self._qmp_close(qmp_sock)  # No further commands for this instance
                 # Wait up to 30 seconds for graceful shutdown
-                for _ in range(30):
-                    time.sleep(1)
-                    if not self._is_vm_running(vm_id):
-                        logger.info(f"VM {vm_id} stopped gracefully")
-                        return
+                self._wait_for_exit(pid, 30.0)
+                if not self._is_vm_running(vm_id):
+                    logger.info(f"VM {vm_id} stopped gracefully")
+                    return
             except Exception as e:
                 logger.warning(f"QMP shutdown failed: {e}, trying SIGTERM")
         
+        self._qmp_close(qmp_sock)
+        
         # Send SIGTERM
         try:
             os.kill(pid, signal.SIGTERM)
-            for _ in range(10):
-                time.sleep(1)
-                if not self._is_vm_running(vm_id):
-                    logger.info(f"VM {vm_id} stopped via SIGTERM")
-                    return
+            self._wait_for_exit(pid, 10.0)
+            if not self._is_vm_running(vm_id):
+                logger.info(f"VM {vm_id} stopped via SIGTERM")
+                return
         except ProcessLookupError:
             logger.info(f"VM {vm_id} already stopped")
             return
@@ -542,7 +821,7 @@ class LocalOperator(OperatorInterface):
         if force or self._is_vm_running(vm_id):
             try:
                 os.kill(pid, signal.SIGKILL)
-                time.sleep(1)
+                self._wait_for_exit(pid, 1.0)
                 logger.info(f"VM {vm_id} force-killed")
             except ProcessLookupError:
                 pass
@@ -605,7 +884,6 @@ class LocalOperator(OperatorInterface):
                 }
             }
         }
-        self._qmp_command(qmp_sock, blockdev_cmd)
         
         # Step 2: Add device via device_add
         device_cmd = {
@@ -617,7 +895,15 @@ class LocalOperator(OperatorInterface):
                 "bus": "pcie.0"
             }
         }
-        self._qmp_command(qmp_sock, device_cmd)
+        # device_add only once the node exists: sent after a failed
+        # blockdev-add, it could pick up a stale node of the same name
+        self._qmp_command(qmp_sock, blockdev_cmd)
+        try:
+            self._qmp_command(qmp_sock, device_cmd)
+        except OperatorError:
+            # Roll back the node so a later attach can reuse its name
+            self._blockdev_del(qmp_sock, drive_id)
+            raise
         
         logger.info(f"Attached disk {disk_path} to VM {vm_id} as {device}")
 
@@ -638,10 +924,12 @@ class LocalOperator(OperatorInterface):
         
         # Find the device using this disk path
         device_id = None
+        node_name = None
         for device in block_info.get("return", []):
             inserted = device.get("inserted", {})
             if inserted and inserted.get("file") == str(disk_path):
                 device_id = device.get("device")
+                node_name = inserted.get("node-name")
                 break
         
         if not device_id:
@@ -663,4 +951,15 @@ class LocalOperator(OperatorInterface):
             if not any(d.get("device") == device_id for d in block_info.get("return", [])):
                 break
         
+        # Step 3: Remove the block node, freeing its name for the next attach
+        if node_name:
+            self._blockdev_del(qmp_sock, node_name)
+        
         logger.info(f"Detached disk {disk_path} from VM {vm_id}")
+
+    def _blockdev_del(self, qmp_sock: Path, node_name: str) -> None:
+        """Remove a block node added by attach_disk, logging instead of raising on failure."""
+        try:
+            self._qmp_command(qmp_sock, {"execute": "blockdev-del", "arguments": {"node-name": node_name}})
+        except OperatorError as e:
+            logger.warning("Failed to remove block node %s: %s", node_name, e)
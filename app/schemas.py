@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, ConfigDict
-from typing import Optional
+from typing import Any, Optional
 
 class VMTemplateCreate(BaseModel):
     name: str = Field(..., min_length=1)
@@ -58,3 +58,20 @@ class VMMetadata(BaseModel):
     ssh_keys: Optional[str]
     created_at: Optional[str] = None
     updated_at: Optional[str] = None
+
+class BatchRequestItem(BaseModel):
+    id: str
+    method: str = Field(..., pattern="^(GET|POST|PUT|PATCH|DELETE)$")
+    url: str = Field(..., pattern="^/")
+    body: Optional[Any] = None
+
+class BatchRequest(BaseModel):
+    requests: list[BatchRequestItem] = Field(..., min_length=1, max_length=20)
+
+class BatchResponseItem(BaseModel):
+    id: str
+    status: int
+    body: Optional[Any] = None
+
+class BatchResponse(BaseModel):
+    responses: list[BatchResponseItem]
@@ -9,9 +9,22 @@ from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
+# Point app.db at a throwaway database before the app is imported, so test runs
+# never create or modify ./states.db
+_TEST_DB_DIR = tempfile.mkdtemp(prefix="vman-test-db-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_TEST_DB_DIR}/states.db"
+
 from app import db, models, operator, observer, network_manager, main
 
 
+@pytest.fixture(scope="session", autouse=True)
+def _remove_test_database():
+    """Delete the session's database once all tests have run."""
+    yield
+    db.engine.dispose()
+    shutil.rmtree(_TEST_DB_DIR, ignore_errors=True)
+
+
 @pytest.fixture(scope="session")
 def qemu_available() -> Optional[Dict[str, str]]:
     """Check if QEMU is available for integration tests.
@@ -4,7 +4,7 @@ import os
 from unittest.mock import patch, MagicMock
 from fastapi.testclient import TestClient
 from app.main import app
-from app import db, models
+from app import db, main, models
 
 client = TestClient(app)
 
@@ -40,6 +40,7 @@ def test_health_and_openapi():
 def setup_db():
     """Setup and teardown database for each test."""
     models.Base.metadata.create_all(bind=db.engine)
+    main._health_cache.clear()
     yield
     models.Base.metadata.drop_all(bind=db.engine)
 
@@ -140,7 +141,8 @@ def test_observer_status_running():
     with patch('app.main._observer') as mock_obs:
         mock_obs.running = True
         mock_obs.check_interval = 5.0
-        mock_obs.last_issues = []
+        mock_obs.get_last_issues.return_value = ()
+        mock_obs.last_issues_count = 0
         
         response = client.get("/observer/status")
         assert response.status_code == 200
@@ -154,7 +156,8 @@ def test_observer_status_stopped():
     with patch('app.main._observer') as mock_obs:
         mock_obs.running = False
         mock_obs.check_interval = 5.0
-        mock_obs.last_issues = []
+        mock_obs.get_last_issues.return_value = ()
+        mock_obs.last_issues_count = 0
         
         response = client.get("/observer/status")
         assert response.status_code == 200
@@ -178,9 +181,10 @@ def test_observer_status_with_issues():
     with patch('app.main._observer') as mock_obs:
         mock_obs.running = True
         mock_obs.check_interval = 5.0
-        mock_obs.last_issues = [
-            CoherenceIssue("vm_state_mismatch", "vm-1", "VM running but DB says stopped")
-        ]
+        mock_obs.get_last_issues.return_value = (
+            CoherenceIssue("vm_state_mismatch", "vm-1", "VM running but DB says stopped"),
+        )
+        mock_obs.last_issues_count = 1
         
         response = client.get("/observer/status")
         assert response.status_code == 200
@@ -232,3 +236,165 @@ def test_openapi_yaml():
     assert response.status_code in [200, 404]
     if response.status_code == 200:
         assert "openapi:" in response.text.lower() or "yaml" in response.headers.get("content-type", "").lower()
+
+
+def test_openapi_yaml_served_from_repo():
+    """Test the bundled OpenAPI spec is served as YAML."""
+    response = client.get("/openapi.yaml")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-yaml")
+    assert response.headers["cache-control"] == "public, max-age=3600"
+    assert int(response.headers["content-length"]) == len(response.content)
+    assert "openapi:" in response.text.lower()
+    
+    # A client holding the current ETag gets a bodyless 304
+    etag = response.headers["etag"]
+    cached = client.get("/openapi.yaml", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.content == b""
+
+
+def test_ensure_schema_sets_user_version(tmp_path):
+    """Test schema setup stamps the DB version and skips work once stamped."""
+    from sqlalchemy import create_engine, inspect
+    from app import main
+    
+    engine = create_engine(f"sqlite:///{tmp_path / 'schema.db'}")
+    with patch('app.db.engine', engine), patch('app.main._schema_engine', None):
+        main._ensure_schema()
+        assert "vms" in inspect(engine).get_table_names()
+        with engine.connect() as conn:
+            assert conn.exec_driver_sql("PRAGMA user_version").scalar() == main.SCHEMA_VERSION
+        
+        # Already stamped: create_all must not run again
+        main._schema_engine = None
+        with patch.object(models.Base.metadata, 'create_all') as mock_create_all:
+            main._ensure_schema()
+            mock_create_all.assert_not_called()
+    engine.dispose()
+
+
+def test_ensure_schema_backfills_vm_mac(tmp_path):
+    """Test upgrading a version-1 DB adds vms.mac and fills it from the VM ID."""
+    from sqlalchemy import create_engine
+    from app import main, operator
+    
+    engine = create_engine(f"sqlite:///{tmp_path / 'v1.db'}")
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "CREATE TABLE vms (id VARCHAR PRIMARY KEY, template_name VARCHAR, "
+            "state VARCHAR NOT NULL, local_ip VARCHAR)"
+        )
+        conn.exec_driver_sql("INSERT INTO vms (id, template_name, state) VALUES ('old-vm', 't', 'stopped')")
+        conn.exec_driver_sql("PRAGMA user_version = 1")
+    
+    with patch('app.db.engine', engine), patch('app.main._schema_engine', None):
+        main._ensure_schema()
+    with engine.connect() as conn:
+        mac = conn.exec_driver_sql("SELECT mac FROM vms WHERE id = 'old-vm'").scalar()
+    engine.dispose()
+    assert mac == operator.vm_mac_address("old-vm")
+
+
+def test_get_operator_created_lazily():
+    """Test the operator is built on first use and then reused."""
+    from app import main
+    
+    with patch('app.main._operator', None), \
+         patch('app.operator.LocalOperator') as mock_cls:
+        first = main.get_operator()
+        assert main.get_operator() is first
+        mock_cls.assert_called_once()
+
+
+def test_get_operator_dependency_override():
+    """Test endpoints receive the operator through Depends(get_operator)."""
+    from app import main
+    
+    mock_op = MagicMock()
+    mock_op.storage_path = "/tmp/test"
+    app.dependency_overrides[main.get_operator] = lambda: mock_op
+    try:
+        with patch('app.main._operator', None):
+            response = client.get("/health")
+        assert response.json()["checks"]["qemu"] == "available"
+    finally:
+        app.dependency_overrides.pop(main.get_operator, None)
+
+
+def test_db_engine_pragmas():
+    """Test the application engine enables WAL and relaxed fsync on connect."""
+    with db.engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        assert conn.exec_driver_sql("PRAGMA synchronous").scalar() == 1  # NORMAL
+
+
+def test_lifespan_runs_startup_and_shutdown():
+    """Test the lifespan handler runs service startup and shutdown."""
+    with patch('app.main.startup_event') as mock_startup, \
+         patch('app.main.shutdown_event') as mock_shutdown:
+        with TestClient(app):
+            mock_startup.assert_called_once()
+            mock_shutdown.assert_not_called()
+        mock_shutdown.assert_called_once()
+
+
+def test_health_probes_cached():
+    """Test repeated health checks reuse the cached DB and storage probes."""
+    with patch('app.main._operator') as mock_op, \
+         patch('app.main._observer') as mock_obs:
+        mock_op.storage_path = "/tmp/test"
+        mock_obs.running = True
+        
+        with patch('pathlib.Path.exists', return_value=True) as mock_exists, \
+             patch('os.access', return_value=True), \
+             patch('app.db.SessionLocal') as mock_db:
+            client.get("/health")
+            client.get("/health")
+            assert mock_db.call_count == 1
+            assert mock_exists.call_count == 1
+            
+            # An expired entry is probed again
+            main._health_cache["database"] = (float("-inf"), "ok")
+            client.get("/health")
+            assert mock_db.call_count == 2
+
+
+def test_startup_prewarms_openapi_schema():
+    """Test startup builds the OpenAPI schema ahead of the first request."""
+    from app import main
+    
+    app.openapi_schema = None
+    with patch.dict(os.environ, {"VMAN_METADATA_ENABLED": "0"}), \
+         patch('app.main._ensure_schema'), \
+         patch('app.main._operator'), \
+         patch('app.main._observer'), \
+         patch('app.observer.LocalObserver'):
+        main.startup_event()
+    assert app.openapi_schema is not None
+    assert "/vms" in app.openapi_schema["paths"]
+
+
+def test_request_logging_skips_polled_paths():
+    """Test the request log middleware skips /health but logs API calls."""
+    with patch('app.main._log_request') as mock_log:
+        with patch('app.db.SessionLocal'):
+            client.get("/health")
+        mock_log.assert_not_called()
+        
+        client.get("/templates")
+        mock_log.assert_called_once()
+        assert mock_log.call_args[0][1:4] == ("GET", "/templates", 200)
+
+
+def test_startup_skips_schema_when_disabled():
+    """Test VMAN_AUTO_CREATE_TABLES=0 skips schema creation on startup."""
+    from app import main
+    
+    with patch.dict(os.environ, {"VMAN_METADATA_ENABLED": "0", "VMAN_AUTO_CREATE_TABLES": "0"}), \
+         patch('app.main._ensure_schema') as mock_schema, \
+         patch('app.main._operator'), \
+         patch('app.main._observer'), \
+         patch('app.observer.LocalObserver'):
+        main.startup_event()
+    mock_schema.assert_not_called()
@@ -3,6 +3,7 @@ import pytest
 import os
 import tempfile
 import logging
+import logging.handlers
 from pathlib import Path
 from unittest.mock import patch, MagicMock
 from app import logging_config
@@ -113,6 +114,35 @@ class TestUnifiedLogger:
         # Should not add duplicate handlers
         assert first_handlers == second_handlers
     
+    def test_configure_uses_queue_listener(self):
+        """Test that records are queued and written by the listener thread."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            log_file = Path(tmpdir) / "queued.log"
+            logging_config.UnifiedLogger.configure(log_file=log_file)
+            root_logger = logging.getLogger()
+            assert all(isinstance(h, logging.handlers.QueueHandler) for h in root_logger.handlers)
+            assert logging_config.UnifiedLogger._listener is not None
+            
+            logging.getLogger("queued").info("queued message")
+            logging_config.UnifiedLogger.shutdown()
+            assert logging_config.UnifiedLogger._listener is None
+            assert "queued message" in log_file.read_text()
+    
+    def test_configure_buffers_file_output(self):
+        """Test that file output is buffered and flushed on ERROR."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            log_file = Path(tmpdir) / "buffered.log"
+            with patch.object(logging_config.UnifiedLogger, "FLUSH_INTERVAL", 60.0):
+                logging_config.UnifiedLogger.configure(log_file=log_file)
+            mem_handler = logging_config.UnifiedLogger._mem_handler
+            assert isinstance(mem_handler, logging.handlers.MemoryHandler)
+            
+            logging.getLogger("buffered").error("flushed immediately")
+            logging_config.UnifiedLogger._listener.stop()
+            logging_config.UnifiedLogger._listener.start()
+            assert "flushed immediately" in log_file.read_text()
+            logging_config.UnifiedLogger.shutdown()
+    
     def test_get_logger_with_service(self):
         """Test getting logger with explicit service."""
         logging_config.UnifiedLogger.configure()
@@ -154,7 +184,8 @@ class TestUnifiedLogger:
                 logger, "GET", "/test", 200, 123.45
             )
             mock_info.assert_called_once()
-            assert "123.45ms" in mock_info.call_args[0][0]
+            fmt, *args = mock_info.call_args[0]
+            assert "123.45ms" in fmt % tuple(args)
     
     def test_log_request_without_duration(self):
         """Test log_request without duration."""
@@ -165,7 +196,8 @@ class TestUnifiedLogger:
                 logger, "POST", "/test", 201
             )
             mock_info.assert_called_once()
-            assert "ms" not in mock_info.call_args[0][0]
+            fmt, *args = mock_info.call_args[0]
+            assert "ms" not in fmt % tuple(args)
     
     def test_log_error_with_context(self):
         """Test log_error with context."""
@@ -200,8 +232,22 @@ class TestUnifiedLogger:
                 logger, "vm_state_mismatch", "vm-123", "VM is running but DB says stopped"
             )
             mock_warning.assert_called_once()
-            assert "vm_state_mismatch" in mock_warning.call_args[0][0]
-            assert "vm-123" in mock_warning.call_args[0][0]
+            fmt, *args = mock_warning.call_args[0]
+            message = fmt % tuple(args)
+            assert "vm_state_mismatch" in message
+            assert "vm-123" in message
+    
+    def test_log_helpers_skip_disabled_levels(self):
+        """Test that helpers do not emit when the level is disabled."""
+        logging_config.UnifiedLogger.configure()
+        logger = logging_config.UnifiedLogger.get_logger("test")
+        with patch.object(logger, 'isEnabledFor', return_value=False), \
+                patch.object(logger, 'info') as mock_info, \
+                patch.object(logger, 'warning') as mock_warning:
+            logging_config.UnifiedLogger.log_request(logger, "GET", "/test", 200, 1.0)
+            logging_config.UnifiedLogger.log_coherence_issue(logger, "t", "r", "d")
+            mock_info.assert_not_called()
+            mock_warning.assert_not_called()
     
     def test_configure_invalid_log_level(self):
         """Test configuration with invalid log level defaults to INFO."""
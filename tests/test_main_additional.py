@@ -4,6 +4,7 @@ from unittest.mock import patch, MagicMock, Mock
 from fastapi.testclient import TestClient
 from app.main import app
 from app import db, models
+from sqlalchemy import select
 
 client = TestClient(app)
 
@@ -28,6 +29,52 @@ def test_create_disk_operator_error(mock_operator):
     assert "failed" in response.json()["detail"].lower()
 
 
+@patch('app.main._operator')
+def test_create_disk_operator_error_leaves_no_row(mock_operator):
+    """Test that a failed image creation does not leave a disk record behind."""
+    mock_operator.storage_path = "/tmp/test"
+    from app import operator
+    mock_operator.create_disk_image.side_effect = operator.OperatorError("Disk creation failed")
+    
+    client.post("/disks", json={"size": 10})
+    
+    db_session = db.SessionLocal()
+    try:
+        assert db_session.query(models.Disk).count() == 0
+    finally:
+        db_session.close()
+
+
+@patch('app.main._operator')
+def test_create_disk_commits_before_image_creation(mock_operator):
+    """Test the disk row is committed before qemu-img runs, so no write lock is held meanwhile."""
+    mock_operator.storage_path = "/tmp/test"
+    seen = []
+    
+    def create_disk_image(path, size):
+        with db.SessionLocal() as other_session:
+            seen.extend(other_session.scalars(select(models.Disk.state)).all())
+    
+    mock_operator.create_disk_image.side_effect = create_disk_image
+    response = client.post("/disks", json={"size": 10})
+    assert response.status_code == 201
+    assert seen == ["creating"]
+    assert response.json()["state"] == "available"
+    assert client.get(f"/disks/{response.json()['id']}").json()["state"] == "available"
+
+
+@patch('app.main._operator')
+def test_create_disk_unexpected_error_leaves_no_row(mock_operator):
+    """Test any failure during image creation releases the reservation."""
+    mock_operator.storage_path = "/tmp/test"
+    mock_operator.create_disk_image.side_effect = RuntimeError("qemu-img crashed")
+    
+    with pytest.raises(RuntimeError):
+        client.post("/disks", json={"size": 10})
+    with db.SessionLocal() as db_session:
+        assert db_session.query(models.Disk).count() == 0
+
+
 @patch('app.main._operator')
 def test_delete_disk_operator_error(mock_operator):
     """Test disk deletion with operator error."""
@@ -197,29 +244,17 @@ def test_restart_vm_operator_error(mock_operator):
 @patch('app.main._operator')
 @patch('app.main._network_manager')
 def test_start_vm_with_network_ip(mock_network, mock_operator):
-    """Test VM start with network IP assignment."""
-    from pathlib import Path
-    import tempfile
-    
+    """Test VM start records the IP assigned by the operator."""
     mock_operator.storage_path = "/tmp/test"
-    mock_operator.start_vm = MagicMock()
+    mock_operator.start_vm = MagicMock(return_value="192.168.100.10")
     
-    # Configure network manager mock
-    mock_network.get_allocated_ips.return_value = set()
+    client.post("/templates", json={"name": "test", "cpu_count": 2, "ram_amount": 4})
+    vm_response = client.post("/vms", json={"template_name": "test", "name": "test-vm"})
+    vm_id = vm_response.json()["id"]
     
-    with tempfile.TemporaryDirectory() as tmpdir:
-        vm_dir = Path(tmpdir) / "vms" / "test-vm"
-        vm_dir.mkdir(parents=True)
-        ip_file = vm_dir / "ip.txt"
-        ip_file.write_text("192.168.100.10")
-        
-        client.post("/templates", json={"name": "test", "cpu_count": 2, "ram_amount": 4})
-        vm_response = client.post("/vms", json={"template_name": "test", "name": "test-vm"})
-        vm_id = vm_response.json()["id"]
-        
-        response = client.post(f"/vms/{vm_id}/actions/start")
-        # Should handle gracefully
-        assert response.status_code in [202, 400]
+    response = client.post(f"/vms/{vm_id}/actions/start")
+    assert response.status_code == 202
+    assert client.get(f"/vms/{vm_id}").json()["local_ip"] == "192.168.100.10"
 
 
 @patch('app.main._operator')
@@ -321,3 +356,72 @@ def test_create_disk_uuid_collision():
             # Should succeed with retry
             assert response.status_code == 201
 
+
+def test_create_disk_repeated_uuid_collision():
+    """Test disk creation fails cleanly if the retried ID collides too."""
+    with patch('app.main._operator') as mock_operator:
+        mock_operator.storage_path = "/tmp/test"
+        mock_operator.create_disk_image = MagicMock()
+        
+        db_session = db.SessionLocal()
+        try:
+            db_session.add(models.Disk(id="collision-id", size=10, state="available"))
+            db_session.commit()
+        finally:
+            db_session.close()
+        
+        collision = Mock()
+        collision.__str__ = lambda self: "collision-id"
+        with patch('app.main.uuid.uuid4', return_value=collision):
+            response = client.post("/disks", json={"size": 10})
+        assert response.status_code == 500
+        mock_operator.create_disk_image.assert_not_called()
+
+
+def test_batch_requests():
+    """Test /batch runs each entry and returns responses in request order."""
+    response = client.post("/batch", json={"requests": [
+        {"id": "1", "method": "POST", "url": "/templates", "body": {"name": "small", "cpu_count": 1, "ram_amount": 1}},
+        {"id": "2", "method": "GET", "url": "/vms?state=running"},
+        {"id": "3", "method": "GET", "url": "/disks/missing"},
+        {"id": "4", "method": "POST", "url": "/batch", "body": {"requests": []}},
+    ]})
+    assert response.status_code == 200
+    results = response.json()["responses"]
+    assert [r["id"] for r in results] == ["1", "2", "3", "4"]
+    assert results[0]["status"] == 201
+    assert results[0]["body"]["name"] == "small"
+    assert results[1] == {"id": "2", "status": 200, "body": []}
+    assert results[2]["status"] == 404
+    assert results[3]["status"] == 400
+    
+    assert [t["name"] for t in client.get("/templates").json()] == ["small"]
+
+
+def test_batch_isolates_failing_entry():
+    """Test an entry that raises yields a 500 for itself only."""
+    client.post("/templates", json={"name": "base", "cpu_count": 1, "ram_amount": 1})
+    client.post("/vms", json={"template_name": "base", "name": "broken-vm"})
+    with patch('app.main._vm_response', side_effect=RuntimeError("boom")):
+        response = client.post("/batch", json={"requests": [
+            {"id": "1", "method": "POST", "url": "/templates", "body": {"name": "kept", "cpu_count": 1, "ram_amount": 1}},
+            {"id": "2", "method": "GET", "url": "/vms/broken-vm"},
+        ]})
+    assert response.status_code == 200
+    results = response.json()["responses"]
+    assert results[0]["status"] == 201
+    assert results[1]["status"] == 500
+
+
+def test_batch_decodes_path():
+    """Test percent-encoded paths are decoded before routing."""
+    client.post("/templates", json={"name": "my tpl", "cpu_count": 1, "ram_amount": 1})
+    response = client.post("/batch", json={"requests": [
+        {"id": "1", "method": "DELETE", "url": "/templates/my%20tpl"},
+    ]})
+    assert response.json()["responses"][0]["status"] == 204
+
+def test_batch_rejects_empty():
+    """Test /batch validates the request list."""
+    response = client.post("/batch", json={"requests": []})
+    assert response.status_code == 422
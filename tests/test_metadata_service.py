@@ -40,12 +40,12 @@ def test_get_vm_by_ip(test_db, temp_storage, test_template):
             self.storage_path = temp_storage
     
     handler = TestHandler()
-    found_vm = handler._get_vm_by_ip("192.168.100.10")
+    found_vm = handler._get_vm_by_ip(test_db, "192.168.100.10")
     assert found_vm is not None
     assert found_vm.id == "test-vm-1"
     
     # Test with non-existent IP
-    found_vm = handler._get_vm_by_ip("192.168.100.99")
+    found_vm = handler._get_vm_by_ip(test_db, "192.168.100.99")
     assert found_vm is None
 
 
@@ -55,38 +55,35 @@ def test_get_vm_by_mac(test_db, temp_storage, test_template):
     vm = models.VM(
         id="test-vm-1",
         template_name=test_template.name,
-        state="running"
+        state="running",
+        mac="52:54:00:12:34:56"
     )
     test_db.add(vm)
     test_db.commit()
     
-    # Store MAC address
-    vm_dir = temp_storage / "vms" / "test-vm-1"
-    vm_dir.mkdir(parents=True)
-    (vm_dir / "mac.txt").write_text("52:54:00:12:34:56")
-    
     class TestHandler(metadata_service.MetadataRequestHandler):
         def __init__(self):
             self.db_session_factory = test_db
             self.storage_path = temp_storage
     
     handler = TestHandler()
-    found_vm = handler._get_vm_by_mac("52:54:00:12:34:56")
+    found_vm = handler._get_vm_by_mac(test_db, "52:54:00:12:34:56")
     assert found_vm is not None
     assert found_vm.id == "test-vm-1"
     
     # Test with non-existent MAC
-    found_vm = handler._get_vm_by_mac("52:54:00:99:99:99")
+    found_vm = handler._get_vm_by_mac(test_db, "52:54:00:99:99:99")
     assert found_vm is None
 
 
-def test_get_metadata(test_db, temp_storage, test_template):
-    """Test getting metadata from database."""
+def test_get_vm_loads_metadata(test_db, temp_storage, test_template):
+    """Test the VM lookup loads its metadata in the same query."""
     # Create VM
     vm = models.VM(
         id="test-vm-1",
         template_name=test_template.name,
-        state="running"
+        state="running",
+        local_ip="192.168.100.20"
     )
     test_db.add(vm)
     test_db.commit()
@@ -107,7 +104,11 @@ def test_get_metadata(test_db, temp_storage, test_template):
             self.storage_path = temp_storage
     
     handler = TestHandler()
-    found_metadata = handler._get_metadata("test-vm-1")
+    metadata_service.invalidate_vm_cache()
+    found_vm = handler._get_vm_by_ip(test_db, "192.168.100.20")
+    metadata_service.invalidate_vm_cache()
+    assert isinstance(found_vm, metadata_service._VMSnapshot)  # detached copy, no session needed
+    found_metadata = found_vm.vm_metadata
     assert found_metadata is not None
     assert found_metadata.hostname == "test-hostname"
     assert found_metadata.user_data == "#!/bin/bash\necho 'test'"
@@ -271,7 +272,7 @@ def test_handle_metadata_request_ssh_keys(test_db, temp_storage, test_template):
     handler = TestHandler()
     # Test public-keys listing
     result = handler._handle_metadata_request("meta-data/public-keys/", vm)
-    assert "0=default" in result
+    assert result == b"0=default"
     
     # Test getting SSH key
     result = handler._handle_metadata_request("meta-data/public-keys/0/openssh-key", vm)
@@ -311,3 +312,323 @@ def test_metadata_service_initialization(temp_storage, test_db):
     assert service.bridge_name == "test-br"
     assert not service.is_running()
 
+
+
+def test_metadata_service_serves_requests_concurrently(temp_storage):
+    """Test requests are handled in parallel rather than one at a time."""
+    import threading
+    from unittest.mock import patch
+    
+    barrier = threading.Barrier(2, timeout=5)
+    
+    def wait_for_peer(self, session, ip):
+        barrier.wait()  # Only passes if both requests are in flight at once
+        return None
+    
+    service = metadata_service.MetadataService(
+        db_session_factory=db.SessionLocal,
+        storage_path=temp_storage,
+        bind_ip="127.0.0.1",
+        port=0,
+        max_workers=4
+    )
+    with patch.object(metadata_service.MetadataRequestHandler, '_get_vm_by_ip', wait_for_peer):
+        service.start()
+        try:
+            port = service.server.server_address[1]
+            statuses = []
+            
+            def fetch():
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+                conn.request("GET", "/latest/meta-data/instance-id")
+                statuses.append(conn.getresponse().status)
+                conn.close()
+            
+            clients = [threading.Thread(target=fetch) for _ in range(2)]
+            for t in clients:
+                t.start()
+            for t in clients:
+                t.join()
+        finally:
+            service.stop()
+    
+    # 404: no VM for the client IP; a serialized server would break the barrier (500)
+    assert statuses == [404, 404]
+
+
+def test_metadata_service_rejects_when_saturated(temp_storage):
+    """Test connections beyond the workers and pending slots get an immediate 503."""
+    import threading
+    from unittest.mock import patch
+    
+    release = threading.Event()
+    entered = threading.Event()
+    
+    def block(self, session, ip):
+        entered.set()
+        release.wait(5)
+        return None
+    
+    service = metadata_service.MetadataService(
+        db_session_factory=db.SessionLocal,
+        storage_path=temp_storage,
+        bind_ip="127.0.0.1",
+        port=0,
+        max_workers=1,
+        max_pending=0
+    )
+    with patch.object(metadata_service.MetadataRequestHandler, '_get_vm_by_ip', block):
+        service.start()
+        try:
+            port = service.server.server_address[1]
+            busy = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+            busy.request("GET", "/latest/meta-data/instance-id")
+            assert entered.wait(5)
+            
+            rejected = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+            rejected.request("GET", "/latest/meta-data/instance-id")
+            assert rejected.getresponse().status == 503
+            rejected.close()
+            
+            release.set()
+            assert busy.getresponse().status == 404
+            busy.close()
+        finally:
+            release.set()
+            service.stop()
+
+def test_metadata_service_stop_closes_queued_connections(temp_storage):
+    """Test stopping the service closes connections still waiting for a worker."""
+    import threading
+    import time
+    from unittest.mock import patch
+    
+    release = threading.Event()
+    entered = threading.Event()
+    
+    def block(self, session, ip):
+        entered.set()
+        release.wait(5)
+        return None
+    
+    service = metadata_service.MetadataService(
+        db_session_factory=db.SessionLocal,
+        storage_path=temp_storage,
+        bind_ip="127.0.0.1",
+        port=0,
+        max_workers=1
+    )
+    with patch.object(metadata_service.MetadataRequestHandler, '_get_vm_by_ip', block):
+        service.start()
+        try:
+            port = service.server.server_address[1]
+            busy = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+            busy.request("GET", "/latest/meta-data/instance-id")
+            assert entered.wait(5)
+            
+            queued = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            queued.request("GET", "/latest/meta-data/instance-id")
+            deadline = time.monotonic() + 5
+            while service.server._pool._work_queue.qsize() == 0 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            
+            with patch.object(service.server, 'shutdown_request',
+                              wraps=service.server.shutdown_request) as mock_shutdown_request:
+                service.stop()
+                # The queued socket is closed explicitly, not left to the garbage collector
+                assert mock_shutdown_request.call_count == 1
+            with pytest.raises(ConnectionError):
+                queued.getresponse()
+            queued.close()
+            busy.close()
+        finally:
+            release.set()
+            service.stop()
+
+def test_get_vm_by_ip_is_cached(test_db):
+    """Test repeated IP lookups are served from the cache until invalidated."""
+    from unittest.mock import patch
+    
+    test_db.add(models.VM(id="cached-vm", template_name="test", state="running", local_ip="10.0.0.9"))
+    test_db.commit()
+    
+    class TestHandler(metadata_service.MetadataRequestHandler):
+        def __init__(self):
+            pass
+    
+    metadata_service.invalidate_vm_cache()
+    handler = TestHandler()
+    try:
+        with patch.object(test_db, 'query', wraps=test_db.query) as mock_query:
+            assert handler._get_vm_by_ip(test_db, "10.0.0.9").id == "cached-vm"
+            assert handler._get_vm_by_ip(test_db, "10.0.0.9").id == "cached-vm"
+            assert mock_query.call_count == 1
+            
+            metadata_service.invalidate_vm_cache("cached-vm")
+            assert handler._get_vm_by_ip(test_db, "10.0.0.9").id == "cached-vm"
+            assert mock_query.call_count == 2
+            
+            # Misses are not cached
+            assert handler._get_vm_by_ip(test_db, "10.0.0.10") is None
+            assert handler._get_vm_by_ip(test_db, "10.0.0.10") is None
+            assert mock_query.call_count == 4
+    finally:
+        metadata_service.invalidate_vm_cache()
+
+
+def test_vm_cache_drops_lookups_raced_by_invalidation():
+    """Test a lookup that started before an invalidation is not cached."""
+    cache = metadata_service._VMLookupCache()
+    vm = metadata_service._VMSnapshot("race-vm", None, "10.0.0.7", None)
+    generation = cache.generation
+    cache.invalidate("race-vm")
+    cache.put(("ip", "10.0.0.7"), vm, generation)
+    assert cache.get(("ip", "10.0.0.7")) is None
+    
+    cache.put(("ip", "10.0.0.7"), vm, cache.generation)
+    assert cache.get(("ip", "10.0.0.7")) == vm
+
+
+def test_derived_cache_is_bounded():
+    """Test derived values are evicted oldest-VM-first past the size limit."""
+    from unittest.mock import patch
+    
+    metadata_service.invalidate_vm_cache()
+    try:
+        with patch.object(metadata_service, '_DERIVED_MAXSIZE', 2):
+            for vm_id in ("vm-a", "vm-b", "vm-c"):
+                md = metadata_service._MetadataSnapshot(vm_id, None, None, "ssh-rsa KEY", 1)
+                metadata_service._first_ssh_key(md)
+            assert list(metadata_service._derived_cache) == ["vm-b", "vm-c"]
+    finally:
+        metadata_service.invalidate_vm_cache()
+
+def test_request_uses_a_single_session(test_db, temp_storage):
+    """Test a request resolving VM and metadata opens only one session."""
+    from unittest.mock import MagicMock
+    
+    test_db.add(models.VM(id="local-vm", template_name="test", state="running", local_ip="127.0.0.1"))
+    test_db.add(models.VMMetadata(vm_id="local-vm", hostname="local-host"))
+    test_db.commit()
+    
+    session_factory = MagicMock(side_effect=db.SessionLocal)
+    service = metadata_service.MetadataService(
+        db_session_factory=session_factory,
+        storage_path=temp_storage,
+        bind_ip="127.0.0.1",
+        port=0
+    )
+    metadata_service.invalidate_vm_cache()
+    service.start()
+    try:
+        conn = http.client.HTTPConnection("127.0.0.1", service.server.server_address[1], timeout=10)
+        conn.request("GET", "/latest/meta-data/hostname")
+        response = conn.getresponse()
+        assert response.status == 200
+        assert response.read() == b"local-host"
+        conn.close()
+    finally:
+        service.stop()
+        metadata_service.invalidate_vm_cache()
+    
+    assert session_factory.call_count == 1
+
+
+def test_derived_metadata_is_cached():
+    """Test user-data encoding and SSH key parsing run once per metadata revision."""
+    from datetime import datetime
+    from unittest.mock import patch
+    
+    metadata = models.VMMetadata(vm_id="ud-vm", user_data="#cloud-config\n", updated_at=datetime(2024, 1, 1))
+    first, second = base64.b64encode(b"#cloud-config\n"), base64.b64encode(b"#!/bin/sh\n")
+    metadata_service.invalidate_vm_cache()
+    try:
+        with patch.object(metadata_service.base64, 'b64encode', wraps=base64.b64encode) as mock_encode:
+            assert metadata_service._encoded_user_data(metadata) == first
+            metadata_service._encoded_user_data(metadata)
+            assert mock_encode.call_count == 1
+            
+            metadata.user_data = "#!/bin/sh\n"
+            metadata.updated_at = datetime(2024, 1, 2)
+            assert metadata_service._encoded_user_data(metadata) == second
+            assert mock_encode.call_count == 2
+        
+        metadata.ssh_keys = "ssh-ed25519 AAAA first\nssh-rsa BBBB second\n"
+        assert metadata_service._first_ssh_key(metadata) == "ssh-ed25519 AAAA first"
+        metadata.ssh_keys = "ssh-rsa CCCC other"  # Same revision: cached value is kept
+        assert metadata_service._first_ssh_key(metadata) == "ssh-ed25519 AAAA first"
+    finally:
+        metadata_service.invalidate_vm_cache()
+
+
+def test_handle_metadata_request_dispatch():
+    """Test static paths and per-MAC network paths resolve without a DB."""
+    class TestHandler(metadata_service.MetadataRequestHandler):
+        def __init__(self):
+            pass
+    
+    handler = TestHandler()
+    vm = models.VM(id="dispatch-vm", local_ip="10.0.0.5", mac="52:54:aa:bb:cc:00")
+    vm.vm_metadata = None
+    
+    assert handler._handle_metadata_request("meta-data/", vm).startswith(b"instance-id\n")
+    assert handler._handle_metadata_request("meta-data/instance-id", vm) == "dispatch-vm"
+    assert handler._handle_metadata_request("meta-data/hostname", vm) == "dispatch-vm"
+    assert handler._handle_metadata_request("user-data", vm) == ""
+    assert handler._handle_metadata_request("meta-data/public-keys/", vm) == b""
+    
+    prefix = "meta-data/network/interfaces/macs/"
+    assert handler._handle_metadata_request(prefix + "52:54:aa:bb:cc:00/local-ipv4", vm) == "10.0.0.5"
+    assert handler._handle_metadata_request(prefix + "52:54:aa:bb:cc:00/mac", vm) == "52:54:aa:bb:cc:00"
+    assert handler._handle_metadata_request(prefix + "52:54:aa:bb:cc:00/", vm) == b"local-ipv4\nmac"
+    # Another VM's MAC and unknown paths are not served
+    assert handler._handle_metadata_request(prefix + "52:54:00:00:00:00/mac", vm) is None
+    assert handler._handle_metadata_request("meta-data/unknown", vm) is None
+
+
+def test_metadata_service_socket_options(temp_storage):
+    """Test the listener has a large accept backlog and owns its port exclusively."""
+    import errno
+    
+    service = metadata_service.MetadataService(
+        db_session_factory=db.SessionLocal,
+        storage_path=temp_storage,
+        bind_ip="127.0.0.1",
+        port=0
+    )
+    service.start()
+    try:
+        assert service.server.request_queue_size >= 1024
+        # Lookup caches are per process: a second instance must not share the port
+        second = metadata_service.MetadataService(
+            db_session_factory=db.SessionLocal,
+            storage_path=temp_storage,
+            bind_ip="127.0.0.1",
+            port=service.server.server_address[1]
+        )
+        with pytest.raises(OSError) as excinfo:
+            second.start()
+        assert excinfo.value.errno == errno.EADDRINUSE
+    finally:
+        service.stop()
+
+
+def test_get_vm_by_ip_uses_network_manager(test_db):
+    """Test IPs allocated by the network manager resolve by VM ID."""
+    from app import network_manager
+    
+    nm = network_manager.NetworkManager(dry_run=True)
+    ip = nm.allocate_ip("nm-vm")
+    # local_ip not persisted yet: only the allocation identifies the VM
+    test_db.add(models.VM(id="nm-vm", template_name="test", state="running"))
+    test_db.commit()
+    
+    class TestHandler(metadata_service.MetadataRequestHandler):
+        def __init__(self):
+            self.network_manager = nm
+    
+    metadata_service.invalidate_vm_cache()
+    try:
+        assert TestHandler()._get_vm_by_ip(test_db, ip).id == "nm-vm"
+    finally:
+        metadata_service.invalidate_vm_cache()
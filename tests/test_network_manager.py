@@ -35,6 +35,12 @@ class TestNetworkManager:
         assert nm.gateway == "10.0.0.1"
         assert nm.dns == ["1.1.1.1"]
     
+    @pytest.mark.parametrize("subnet", ["192.168.100.0/24", "10.0.0.0/16", "10.0.0.0/30", "10.0.0.0/31", "10.0.0.1/32", "fd00::/120"])
+    def test_total_hosts_matches_subnet_hosts(self, subnet):
+        """Test total_hosts is computed without iterating the subnet."""
+        nm = network_manager.NetworkManager(subnet=subnet)
+        assert nm.total_hosts == len(list(nm.subnet.hosts()))
+    
     def test_init_custom_gateway(self):
         """Test NetworkManager with custom gateway."""
         nm = network_manager.NetworkManager(
@@ -48,15 +54,23 @@ class TestNetworkManager:
         nm = network_manager.NetworkManager(dry_run=True)
         assert nm.dry_run is True
     
+    @patch('app.network_manager.socket.if_nametoindex', return_value=7)
     @patch('app.network_manager.subprocess.run')
-    def test_ensure_bridge_exists(self, mock_run):
-        """Test ensure_bridge when bridge already exists."""
-        mock_run.return_value = Mock(returncode=0)
+    def test_ensure_bridge_exists(self, mock_run, mock_if_nametoindex):
+        """Test ensure_bridge when bridge already exists and is configured."""
+        mock_run.return_value = Mock(
+            returncode=0,
+            stdout=(
+                "7: br-vman    inet 192.168.100.1/24 scope global br-vman\n"
+                "7: br-vman    inet 169.254.169.254/32 scope global br-vman\n"
+            ),
+        )
         nm = network_manager.NetworkManager(dry_run=False)
-        nm._interface_exists = Mock(return_value=True)
         nm.ensure_bridge()
-        # Should not create bridge if it exists
-        assert mock_run.call_count == 0
+        mock_if_nametoindex.assert_called_once_with("br-vman")
+        # Only the address listing runs: no bridge creation, no address added
+        assert mock_run.call_count == 1
+        assert mock_run.call_args[0][0] == ["ip", "-o", "addr", "show", "dev", "br-vman"]
     
     @patch('app.network_manager.subprocess.run')
     def test_ensure_bridge_create(self, mock_run):
@@ -102,6 +116,28 @@ class TestNetworkManager:
         with pytest.raises(RuntimeError, match="No available IPs"):
             nm.allocate_ip("vm-2")
     
+    def test_allocate_ip_concurrent(self):
+        """Test concurrent allocations never hand out the same IP."""
+        from concurrent.futures import ThreadPoolExecutor
+        nm = network_manager.NetworkManager(subnet="10.0.0.0/22")
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            ips = list(pool.map(nm.allocate_ip, [f"vm-{i}" for i in range(500)]))
+        assert len(set(ips)) == 500
+        assert len(nm.allocated_ips) == 500
+    
+    @pytest.mark.parametrize("subnet,first_ip", [("fd00::/64", "fd00::2"), ("10.0.0.0/8", "10.0.0.2")])
+    def test_large_and_ipv6_subnets_allocate_without_bitmap(self, subnet, first_ip):
+        """Test subnets too large for the bitmap still allocate, claim and release."""
+        nm = network_manager.NetworkManager(subnet=subnet)
+        assert nm._ip_bitmap is None
+        ip = nm.allocate_ip("vm-1")
+        assert ip == first_ip
+        assert not nm.claim_ip(ip, "vm-2")
+        assert not nm.claim_ip(nm.gateway, "vm-2")
+        nm.release_ip(ip)
+        assert nm.claim_ip(ip, "vm-2")
+        assert nm.get_vm_id(ip) == "vm-2"
+    
     def test_release_ip(self):
         """Test IP release."""
         nm = network_manager.NetworkManager()
@@ -110,6 +146,32 @@ class TestNetworkManager:
         nm.release_ip(ip)
         assert ip not in nm.allocated_ips
     
+    def test_get_vm_id(self):
+        """Test allocated IPs map back to their VM until released."""
+        nm = network_manager.NetworkManager()
+        ip = nm.allocate_ip("vm-1")
+        assert nm.get_vm_id(ip) == "vm-1"
+        nm.release_ip(ip)
+        assert nm.get_vm_id(ip) is None
+    
+    def test_released_ip_is_reallocated_first(self):
+        """Test allocation hands out the lowest free address."""
+        nm = network_manager.NetworkManager(subnet="192.168.100.0/24")
+        ips = [nm.allocate_ip(f"vm-{i}") for i in range(3)]
+        assert ips == ["192.168.100.2", "192.168.100.3", "192.168.100.4"]
+        nm.release_ip("192.168.100.3")
+        assert nm.allocate_ip("vm-3") == "192.168.100.3"
+    
+    def test_claim_ip(self):
+        """Test claiming a specific IP only succeeds while it is free."""
+        nm = network_manager.NetworkManager(subnet="192.168.100.0/24")
+        assert nm.claim_ip("192.168.100.2", "vm-0")
+        assert nm.get_vm_id("192.168.100.2") == "vm-0"
+        assert not nm.claim_ip("192.168.100.2", "vm-1")
+        assert not nm.claim_ip("192.168.100.1", "vm-1")  # Gateway is reserved
+        assert not nm.claim_ip("10.0.0.5", "vm-1")  # Outside the subnet
+        assert nm.allocate_ip("vm-1") == "192.168.100.3"
+    
     def test_release_ip_not_allocated(self):
         """Test releasing IP that wasn't allocated."""
         nm = network_manager.NetworkManager()
@@ -127,6 +189,14 @@ class TestNetworkManager:
         tap_name = nm.create_tap_interface("vm-12345")
         assert tap_name.startswith("tap-")
         assert "12345" in tap_name or "vm-12" in tap_name
+        # One `ip -batch` process instead of one per command
+        mock_run.assert_called_once()
+        assert mock_run.call_args.args[0] == ["ip", "-force", "-batch", "-"]
+        assert mock_run.call_args.kwargs["input"].splitlines() == [
+            f"tuntap add name {tap_name} mode tap",
+            f"link set {tap_name} up",
+            f"link set {tap_name} master br-vman",
+        ]
     
     def test_create_tap_interface_dry_run(self):
         """Test TAP interface creation in dry-run mode."""
@@ -152,6 +222,8 @@ class TestNetworkManager:
         nm.delete_tap_interface("tap-vm1")
         # Should delete interface
         assert mock_run.call_count >= 1
+        # Output of the best-effort cleanup is not read, so it is not piped
+        assert mock_run.call_args.kwargs["stdout"] is subprocess.DEVNULL
     
     def test_delete_tap_interface_dry_run(self):
         """Test TAP interface deletion in dry-run mode."""
@@ -234,14 +306,13 @@ class TestNetworkManager:
     @patch('app.network_manager.subprocess.run')
     def test_interface_exists(self, mock_run):
         """Test _interface_exists."""
-        mock_run.return_value = Mock(returncode=0)
         nm = network_manager.NetworkManager()
-        assert nm._interface_exists("eth0") is True
+        assert nm._interface_exists("lo") is True
+        # Looked up via if_nametoindex, without spawning `ip`
+        mock_run.assert_not_called()
     
-    @patch('app.network_manager.subprocess.run')
-    def test_interface_not_exists(self, mock_run):
+    def test_interface_not_exists(self):
         """Test _interface_exists when interface doesn't exist."""
-        mock_run.side_effect = RuntimeError("not found")
         nm = network_manager.NetworkManager()
         assert nm._interface_exists("nonexistent") is False
     
@@ -258,4 +329,15 @@ class TestNetworkManager:
         mock_run.return_value = Mock(returncode=0, stdout="inet 192.168.1.2")
         nm = network_manager.NetworkManager()
         assert nm._has_ip("eth0", "192.168.1.1") is False
+    
+    @patch('app.network_manager.subprocess.run')
+    def test_has_ip_matches_whole_address(self, mock_run):
+        """Test _has_ip does not match an address that merely starts with the IP."""
+        mock_run.return_value = Mock(
+            returncode=0,
+            stdout="5: br-vman    inet 192.168.1.10/24 brd 192.168.1.255 scope global br-vman\n"
+        )
+        nm = network_manager.NetworkManager()
+        assert nm._has_ip("br-vman", "192.168.1.10") is True
+        assert nm._has_ip("br-vman", "192.168.1.1") is False
 
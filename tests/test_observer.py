@@ -50,6 +50,42 @@ def test_observer_start_stop(test_observer):
     assert test_observer.running is False
 
 
+def test_observer_check_interval_clamped(test_operator):
+    """Test the check interval is kept between 0.1s and 5s."""
+    assert observer.LocalObserver(operator=test_operator, check_interval=0).check_interval == 0.1
+    assert observer.LocalObserver(operator=test_operator, check_interval=-3).check_interval == 0.1
+    assert observer.LocalObserver(operator=test_operator, check_interval=60).check_interval == 5.0
+
+
+def test_observer_request_check_wakes_loop(test_operator):
+    """Test request_check() runs a check without waiting out the interval."""
+    import threading
+    from unittest.mock import patch
+    
+    obs = observer.LocalObserver(operator=test_operator, check_interval=5.0)
+    checked = threading.Semaphore(0)
+    with patch.object(obs, 'check_coherence', side_effect=lambda: checked.release() or []):
+        obs.start()
+        try:
+            assert checked.acquire(timeout=1.0)  # Initial check
+            obs.request_check()
+            assert checked.acquire(timeout=1.0)  # Requested check, well before 5s
+        finally:
+            obs.stop()
+
+
+def test_observer_stop_interrupts_wait(test_operator):
+    """Test stop() wakes the loop instead of waiting out the interval."""
+    obs = observer.LocalObserver(operator=test_operator, check_interval=5.0)
+    obs.start()
+    time.sleep(0.1)  # Let the first check finish and the wait begin
+    
+    started = time.monotonic()
+    obs.stop()
+    assert time.monotonic() - started < 1.0
+    assert not obs.thread.is_alive()
+
+
 def test_observer_double_start(test_observer):
     """Test starting observer twice."""
     test_observer.start()
@@ -170,6 +170,30 @@ def test_check_coherence_with_issues(temp_storage, test_observer):
     assert len(issues) > 0
 
 
+def test_get_last_issues_snapshot(test_observer):
+    """Test that get_last_issues returns a bounded snapshot of the last check."""
+    test_observer.last_issues.extend(
+        observer.CoherenceIssue("missing_disk", f"disk-{i}", "missing") for i in range(5)
+    )
+    snapshot = test_observer.get_last_issues(limit=2)
+    assert isinstance(snapshot, tuple)
+    assert [issue.resource_id for issue in snapshot] == ["disk-3", "disk-4"]
+    assert len(test_observer.get_last_issues()) == 5
+
+
+def test_last_issues_bounded(test_observer):
+    """Test that last_issues keeps at most MAX_TRACKED_ISSUES entries."""
+    issues = [
+        observer.CoherenceIssue("orphan_disk", f"disk-{i}", "orphan")
+        for i in range(test_observer.MAX_TRACKED_ISSUES + 10)
+    ]
+    with patch.object(test_observer, '_check_vm_coherence', return_value=issues), \
+         patch.object(test_observer, '_check_disk_coherence', return_value=[]):
+        assert len(test_observer.check_coherence()) == len(issues)
+    assert len(test_observer.last_issues) == test_observer.MAX_TRACKED_ISSUES
+    assert test_observer.last_issues[-1].resource_id == issues[-1].resource_id
+
+
 def test_observer_stop_when_not_running(test_observer):
     """Test stopping observer when not running."""
     # Observer not started
@@ -194,3 +218,66 @@ def test_check_vm_coherence_stopped_matches(temp_storage, test_observer):
     # Should have no issues
     assert len(issues) == 0
 
+
+
+def test_check_disk_coherence_missing_and_orphan(temp_storage, test_observer):
+    """Test one directory listing yields both missing and orphan disks."""
+    db_session = db.SessionLocal()
+    try:
+        db_session.add(models.Disk(id="present", size=10, state="available"))
+        db_session.add(models.Disk(id="gone", size=10, state="available"))
+        db_session.commit()
+    finally:
+        db_session.close()
+    
+    disks_dir = temp_storage / "disks"
+    (disks_dir / "present.qcow2").touch()
+    (disks_dir / "stray.qcow2").touch()
+    (disks_dir / "notes.txt").touch()
+    
+    issues = {(i.issue_type, i.resource_id) for i in test_observer._check_disk_coherence()}
+    assert issues == {("missing_disk", "gone"), ("orphan_disk", "stray")}
+
+
+def test_check_disk_coherence_skips_disks_being_created(temp_storage, test_observer):
+    """Test a disk whose image is still being created is not reported missing."""
+    db_session = db.SessionLocal()
+    try:
+        db_session.add(models.Disk(id="new", size=10, state="creating"))
+        db_session.commit()
+    finally:
+        db_session.close()
+    
+    assert test_observer._check_disk_coherence() == []
+
+def test_last_issues_count_is_not_capped(test_observer):
+    """Test the issue count covers every issue even when only the newest are kept."""
+    issues = [observer.CoherenceIssue("missing_disk", f"d{i}", "") for i in range(test_observer.MAX_TRACKED_ISSUES + 10)]
+    with patch.object(test_observer, '_check_vm_coherence', return_value=issues), \
+         patch.object(test_observer, '_check_disk_coherence', return_value=[]):
+        test_observer.check_coherence()
+    assert test_observer.last_issues_count == test_observer.MAX_TRACKED_ISSUES + 10
+    assert len(test_observer.get_last_issues()) == test_observer.MAX_TRACKED_ISSUES
+
+def test_check_coherence_uses_one_session(test_observer):
+    """Test a coherence cycle opens a single session for both checks."""
+    factory = MagicMock(side_effect=db.SessionLocal)
+    test_observer.db_session_factory = factory
+    test_observer.check_coherence()
+    assert factory.call_count == 1
+
+
+def test_list_dir_reuses_listing_until_directory_changes(temp_storage, test_observer):
+    """Test an unchanged directory is not listed again on the next check."""
+    import os
+    disks_dir = temp_storage / "disks"
+    (disks_dir / "a.qcow2").touch()
+    os.utime(disks_dir, ns=(0, 10**9))  # settled well in the past
+    
+    assert test_observer._list_dir(disks_dir) == {"a.qcow2"}
+    with patch('app.observer.os.scandir') as mock_scandir:
+        assert test_observer._list_dir(disks_dir) == {"a.qcow2"}
+    mock_scandir.assert_not_called()
+    
+    (disks_dir / "b.qcow2").touch()
+    assert test_observer._list_dir(disks_dir) == {"a.qcow2", "b.qcow2"}
@@ -76,10 +76,32 @@ def test_ensure_storage_dir_permissions(test_operator, temp_storage):
     assert result == disk_path.parent
 
 
+def test_ensure_storage_dir_validates_once(test_operator, temp_storage):
+    """Test a directory already validated is not created or checked again."""
+    from unittest.mock import patch
+    disk_path = temp_storage / "disks" / "a.qcow2"
+    test_operator.ensure_storage_dir(disk_path)
+    with patch('app.operator.os.access') as mock_access:
+        result = test_operator.ensure_storage_dir(disk_path.with_name("b.qcow2"))
+    assert result == disk_path.parent
+    mock_access.assert_not_called()
+
+
+def test_ensure_storage_dir_revalidates_vm_dirs(test_operator, temp_storage):
+    """Test per-VM directories are not cached, so a deleted one is recreated."""
+    import shutil
+    vm_disk = temp_storage / "vms" / "vm-1" / "root.qcow2"
+    test_operator.ensure_storage_dir(vm_disk)
+    shutil.rmtree(vm_disk.parent)
+    test_operator.ensure_storage_dir(vm_disk)
+    assert vm_disk.parent.is_dir()
+    assert vm_disk.parent not in test_operator._writable_dirs
+
+
 def test_start_vm_dry_run(test_operator):
     """Test starting VM in dry-run mode."""
-    # Should not raise error in dry-run
-    test_operator.start_vm("test-vm", cpu_count=2, ram_gb=4)
+    # Should not raise error in dry-run, and no IP is assigned
+    assert test_operator.start_vm("test-vm", cpu_count=2, ram_gb=4) is None
 
 
 def test_start_vm_already_running(test_operator, temp_storage):
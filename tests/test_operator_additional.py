@@ -1,4 +1,6 @@
 """Additional unit tests for operator.py to improve coverage."""
+import os
+import json
 import pytest
 from unittest.mock import patch, MagicMock, Mock, mock_open
 from pathlib import Path
@@ -122,6 +124,7 @@ def test_stop_vm_force_kill(mock_run, temp_storage):
     with patch.object(test_operator, '_qmp_command') as mock_qmp, \
          patch('os.kill') as mock_kill, \
          patch('time.sleep'), \
+         patch.object(test_operator, '_wait_for_exit', return_value=False), \
          patch.object(test_operator, '_is_vm_running', side_effect=[True] + [True] * 10 + [True]):
         mock_qmp.side_effect = operator.OperatorError("QMP failed")
         mock_kill.return_value = None
@@ -131,6 +134,154 @@ def test_stop_vm_force_kill(mock_run, temp_storage):
         assert mock_kill.call_count >= 2
 
 
+def test_wait_for_exit_returns_when_process_exits(test_operator):
+    """Test _wait_for_exit returns as soon as the process exits, not at the timeout."""
+    import subprocess
+    import time
+    proc = subprocess.Popen(["sleep", "0.2"])
+    try:
+        started = time.monotonic()
+        assert test_operator._wait_for_exit(proc.pid, 5.0) is True
+        assert time.monotonic() - started < 2.0
+    finally:
+        proc.wait()
+
+
+def test_wait_for_exit_times_out(test_operator):
+    """Test _wait_for_exit reports a process still running after the timeout."""
+    import subprocess
+    proc = subprocess.Popen(["sleep", "30"])
+    try:
+        assert test_operator._wait_for_exit(proc.pid, 0.1) is False
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+def test_binary_lookup_cached_across_operators(temp_storage):
+    """Test PATH is searched once per binary, not on every operator construction."""
+    operator._which_cached.cache_clear()
+    with patch('app.operator.shutil.which', return_value=None) as mock_which:
+        operator.LocalOperator(dry_run=True, storage_path=temp_storage)
+        calls = mock_which.call_count
+        operator.LocalOperator(dry_run=True, storage_path=temp_storage)
+        assert mock_which.call_count == calls
+    operator._which_cached.cache_clear()
+
+
+def test_qemu_img_create_cmd_qcow2_layout(temp_storage, test_operator):
+    """Test new qcow2 images get 128k clusters, with extended L2 on qemu-img >= 5.2."""
+    test_operator.qemu_img = "/usr/bin/qemu-img"
+    path = temp_storage / "disks" / "d.qcow2"
+    with patch('app.operator._qemu_img_version', return_value=(8, 2)):
+        assert test_operator._qemu_img_create_cmd(path, 10) == [
+            "/usr/bin/qemu-img", "create", "-f", "qcow2",
+            "-o", "extended_l2=on,cluster_size=128k", str(path), "10G",
+        ]
+    with patch('app.operator._qemu_img_version', return_value=(5, 1)):
+        cmd = test_operator._qemu_img_create_cmd(path, 10)
+        assert cmd[cmd.index("-o") + 1] == "cluster_size=128k"
+    assert test_operator._qemu_img_create_cmd(path, 10, fmt="raw") == [
+        "/usr/bin/qemu-img", "create", "-f", "raw", str(path), "10G",
+    ]
+
+
+def test_qemu_img_create_cmd_defaults_can_be_disabled(temp_storage):
+    """Test the qcow2 layout options can be turned off."""
+    op = operator.LocalOperator(dry_run=True, storage_path=temp_storage,
+                                cluster_size=None, extended_l2=False)
+    op.qemu_img = "/usr/bin/qemu-img"
+    assert "-o" not in op._qemu_img_create_cmd(temp_storage / "d.qcow2", 1)
+
+
+def test_qemu_img_create_cmd_overlay(temp_storage, test_operator):
+    """Test overlays reference their backing image and inherit its size."""
+    test_operator.qemu_img = "/usr/bin/qemu-img"
+    base = temp_storage / "base.qcow2"
+    with patch('app.operator._qemu_img_version', return_value=(8, 2)):
+        cmd = test_operator._qemu_img_create_cmd(temp_storage / "vm.qcow2", None, backing=base)
+    assert cmd[4:8] == ["-F", "qcow2", "-b", str(base)]
+    assert cmd[-1] == str(temp_storage / "vm.qcow2")
+
+
+@patch('app.operator.subprocess.run')
+@patch.dict('os.environ', {'VMAN_OPERATOR_DRY_RUN': '0'}, clear=False)
+def test_create_disk_image_with_backing(mock_run, temp_storage):
+    """Test create_disk_image creates a copy-on-write overlay of a backing image."""
+    op = operator.LocalOperator(dry_run=False, storage_path=temp_storage)
+    op.qemu_img = "/usr/bin/qemu-img"
+    base = temp_storage / "base.qcow2"
+    base.touch()
+    
+    with patch('app.operator._qemu_img_version', return_value=(8, 2)):
+        op.create_disk_image(temp_storage / "disks" / "vm.qcow2", None, backing=base)
+    cmd = mock_run.call_args[0][0]
+    assert ["-b", str(base.resolve())] == cmd[cmd.index("-b"):cmd.index("-b") + 2]
+    
+    with pytest.raises(ValueError):
+        op.create_disk_image(temp_storage / "disks" / "other.qcow2", None)
+    with pytest.raises(operator.OperatorError, match="Backing image not found"):
+        op.create_disk_image(temp_storage / "disks" / "other.qcow2", None,
+                             backing=temp_storage / "missing.qcow2")
+
+
+@patch.dict('os.environ', {'VMAN_OPERATOR_DRY_RUN': '0'}, clear=False)
+def test_clone_disk_image(temp_storage):
+    """Test clone_disk_image copies the image and refuses to overwrite."""
+    op = operator.LocalOperator(dry_run=False, storage_path=temp_storage)
+    src = temp_storage / "base.qcow2"
+    src.write_bytes(b"QFI\xfb" + bytes(range(256)) * 4096)
+    dst = temp_storage / "vms" / "vm-1" / "root.qcow2"
+    
+    assert op.clone_disk_image(src, dst) == dst
+    assert dst.read_bytes() == src.read_bytes()
+    with pytest.raises(operator.OperatorError, match="already exists"):
+        op.clone_disk_image(src, dst)
+
+
+@patch.dict('os.environ', {'VMAN_OPERATOR_DRY_RUN': '0'}, clear=False)
+def test_clone_disk_image_without_reflink(temp_storage):
+    """Test clone_disk_image falls back to an in-kernel copy without reflink support."""
+    op = operator.LocalOperator(dry_run=False, storage_path=temp_storage)
+    src = temp_storage / "base.qcow2"
+    src.write_bytes(b"disk-data" * 1000)
+    dst = temp_storage / "clone.qcow2"
+    
+    with patch('app.operator.fcntl.ioctl', side_effect=OSError(95, "Operation not supported")):
+        op.clone_disk_image(src, dst)
+    assert dst.read_bytes() == src.read_bytes()
+
+
+@patch.dict('os.environ', {'VMAN_OPERATOR_DRY_RUN': '0'}, clear=False)
+def test_clone_disk_image_copies_metadata(temp_storage):
+    """Test clone_disk_image carries over the source's mode and timestamps."""
+    op = operator.LocalOperator(dry_run=False, storage_path=temp_storage)
+    src = temp_storage / "base.qcow2"
+    src.write_bytes(b"disk-data")
+    src.chmod(0o640)
+    os.utime(src, (1_000_000, 1_000_000))
+    dst = temp_storage / "clone.qcow2"
+    
+    op.clone_disk_image(src, dst)
+    assert dst.stat().st_mtime == 1_000_000
+    assert dst.stat().st_mode & 0o777 == 0o640
+
+
+@patch.dict('os.environ', {'VMAN_OPERATOR_DRY_RUN': '0'}, clear=False)
+def test_clone_disk_image_keeps_concurrently_created_dst(temp_storage):
+    """Test a dst created after the existence check is reported, not deleted."""
+    op = operator.LocalOperator(dry_run=False, storage_path=temp_storage)
+    src = temp_storage / "base.qcow2"
+    src.write_bytes(b"disk-data")
+    dst = temp_storage / "clone.qcow2"
+    dst.write_bytes(b"theirs")
+    
+    real_exists = Path.exists
+    with patch.object(Path, 'exists', lambda self: False if self == dst else real_exists(self)):
+        with pytest.raises(operator.OperatorError, match="already exists"):
+            op.clone_disk_image(src, dst)
+    assert dst.read_bytes() == b"theirs"
+
 def test_get_vm_dir(temp_storage, test_operator):
     """Test _get_vm_dir helper."""
     vm_dir = test_operator._get_vm_dir("test-vm")
@@ -188,86 +339,235 @@ def test_is_vm_running_with_invalid_pid(temp_storage, test_operator):
     assert test_operator._is_vm_running(vm_id) is False
 
 
-@patch('app.operator.socket.socket')
-def test_qmp_command_success(mock_socket, temp_storage, test_operator):
-    """Test _qmp_command with successful response."""
-    vm_id = "test-vm"
+def _serve_qmp(path, greeting, replies, gate=None):
+    """Serve one QMP connection on a Unix socket at `path`.
+
+    Sends `greeting`, then answers each received line with the next of `replies`.
+    If `gate` (an Event) is given, replies after the capabilities one wait for it.
+    Returns the listening thread and the list of lines received.
+    """
+    import socket
+    import threading
+    
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(str(path))
+    server.listen(1)
+    received = []
+    
+    def serve():
+        conn, _ = server.accept()
+        with conn, conn.makefile("rb") as reader:
+            conn.sendall(greeting)
+            for reply in replies:
+                line = reader.readline()
+                if not line:
+                    break
+                received.append(line)
+                if gate is not None and len(received) > 1:
+                    gate.wait(timeout=5)
+                conn.sendall(reply)
+        server.close()
+    
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    return thread, received
+
+
+def _qmp_socket_path(temp_storage, vm_id="test-vm"):
     vm_dir = temp_storage / "vms" / vm_id
     vm_dir.mkdir(parents=True)
-    qmp_sock = vm_dir / "qmp.sock"
-    qmp_sock.touch()
+    return vm_dir / "qmp.sock"
+
+
+def test_qmp_command_success(temp_storage, test_operator):
+    """Test _qmp_command with successful response."""
+    qmp_sock = _qmp_socket_path(temp_storage)
+    thread, received = _serve_qmp(qmp_sock, b'{"QMP": {"version": {}}}\n', [
+        b'{"return": {}}\n',  # Capabilities response
+        b'{"return": {"result": "success"}}\n',  # Command response
+    ])
     
-    # Mock socket - QMP reads until newline, so responses need newlines
-    mock_sock = MagicMock()
-    mock_socket.return_value = mock_sock
-    mock_sock.recv.side_effect = [
-        b'{"QMP": {"version": {}}}\n',  # Greeting with newline
-        b'{"return": {}}\n',  # Capabilities response with newline
-        b'{"return": {"result": "success"}}\n'  # Command response with newline
-    ]
+    result = test_operator._qmp_command(qmp_sock, {"execute": "test"})
+    thread.join(timeout=2)
+    assert result == {"return": {"result": "success"}}
+    assert [json.loads(line)["execute"] for line in received] == ["qmp_capabilities", "test"]
+
+
+def test_qmp_command_skips_events(temp_storage, test_operator):
+    """Test asynchronous QMP events are not mistaken for the command reply."""
+    qmp_sock = _qmp_socket_path(temp_storage)
+    thread, _ = _serve_qmp(qmp_sock, b'{"QMP": {"version": {}}}\n', [
+        b'{"return": {}}\n',
+        b'{"event": "DEVICE_DELETED", "data": {}}\n{"return": {"result": "success"}}\n',
+    ])
     
     result = test_operator._qmp_command(qmp_sock, {"execute": "test"})
-    assert "return" in result or "result" in str(result)
+    thread.join(timeout=2)
+    assert result == {"return": {"result": "success"}}
+
+
+def test_qmp_command_reuses_connection(temp_storage, test_operator):
+    """Test consecutive commands share one connection and one handshake."""
+    qmp_sock = _qmp_socket_path(temp_storage)
+    thread, received = _serve_qmp(qmp_sock, b'{"QMP": {"version": {}}}\n', [
+        b'{"return": {}}\n',
+        b'{"return": "first"}\n',
+        b'{"return": "second"}\n',
+    ])
+    
+    assert test_operator._qmp_command(qmp_sock, {"execute": "a"}) == {"return": "first"}
+    assert test_operator._qmp_command(qmp_sock, {"execute": "b"}) == {"return": "second"}
+    thread.join(timeout=2)
+    assert [json.loads(line)["execute"] for line in received] == ["qmp_capabilities", "a", "b"]
+
+
+def test_qmp_command_reconnects_after_qemu_closes(temp_storage, test_operator):
+    """Test a cached connection closed by QEMU is replaced transparently."""
+    qmp_sock = _qmp_socket_path(temp_storage)
+    greeting = b'{"QMP": {"version": {}}}\n'
+    thread, _ = _serve_qmp(qmp_sock, greeting, [b'{"return": {}}\n', b'{"return": "first"}\n'])
+    assert test_operator._qmp_command(qmp_sock, {"execute": "a"}) == {"return": "first"}
+    thread.join(timeout=2)  # Server side closed
+    
+    qmp_sock.unlink()
+    thread, received = _serve_qmp(qmp_sock, greeting, [b'{"return": {}}\n', b'{"return": "second"}\n'])
+    assert test_operator._qmp_command(qmp_sock, {"execute": "b"}) == {"return": "second"}
+    thread.join(timeout=2)
+    assert [json.loads(line)["execute"] for line in received] == ["qmp_capabilities", "b"]
+
+
+def test_qmp_commands_to_different_vms_run_concurrently(temp_storage, test_operator):
+    """Test a slow QMP reply from one VM does not block commands to another."""
+    import threading
+    import time
+    gate = threading.Event()
+    greeting = b'{"QMP": {"version": {}}}\n'
+    slow_sock = _qmp_socket_path(temp_storage, "slow-vm")
+    fast_sock = _qmp_socket_path(temp_storage, "fast-vm")
+    slow_thread, slow_received = _serve_qmp(slow_sock, greeting, [b'{"return": {}}\n', b'{"return": "slow"}\n'], gate)
+    fast_thread, _ = _serve_qmp(fast_sock, greeting, [b'{"return": {}}\n', b'{"return": "fast"}\n'])
+    
+    results = []
+    slow = threading.Thread(target=lambda: results.append(
+        test_operator._qmp_command(slow_sock, {"execute": "a"})))
+    slow.start()
+    try:
+        for _ in range(100):  # Until the slow command is in flight
+            if len(slow_received) == 2:
+                break
+            time.sleep(0.01)
+        assert test_operator._qmp_command(fast_sock, {"execute": "b"}, timeout=2) == {"return": "fast"}
+        assert not results  # The slow VM's reply is still held back
+    finally:
+        gate.set()
+        slow.join(timeout=5)
+    assert results == [{"return": "slow"}]
+    slow_thread.join(timeout=2)
+    fast_thread.join(timeout=2)
+
+
+def _attach_operator(temp_storage):
+    op = operator.LocalOperator(dry_run=False, storage_path=temp_storage)
+    disk_path = temp_storage / "disks" / "d.qcow2"
+    disk_path.touch()
+    return op, disk_path
 
 
-@patch('app.operator.socket.socket')
-def test_qmp_command_error_response(mock_socket, temp_storage, test_operator):
-    """Test _qmp_command with error response."""
-    vm_id = "test-vm"
-    vm_dir = temp_storage / "vms" / vm_id
-    vm_dir.mkdir(parents=True)
-    qmp_sock = vm_dir / "qmp.sock"
-    qmp_sock.touch()
+def _qmp_reply(replies):
+    """side_effect for _qmp_command answering by command name; a reply that is an exception is raised."""
+    def reply(qmp_sock, command, *args, **kwargs):
+        result = replies.get(command["execute"], {"return": {}})
+        if isinstance(result, Exception):
+            raise result
+        return result
+    return reply
+
+
+@patch.dict('os.environ', {'VMAN_OPERATOR_DRY_RUN': '0'}, clear=False)
+def test_attach_disk_skips_device_add_when_blockdev_add_fails(temp_storage):
+    """Test device_add is not sent when the block node could not be added."""
+    op, disk_path = _attach_operator(temp_storage)
+    error = operator.OperatorError("Duplicate nodes with node-name='drive1'")
+    with patch.object(op, '_is_vm_running', return_value=True), \
+         patch.object(op, '_qmp_command', side_effect=_qmp_reply({"blockdev-add": error})) as mock_qmp:
+        with pytest.raises(operator.OperatorError, match="Duplicate"):
+            op.attach_disk("vm-1", disk_path, device="/dev/xvdb")
     
-    # Mock socket with error - responses need newlines
-    mock_sock = MagicMock()
-    mock_socket.return_value = mock_sock
-    mock_sock.recv.side_effect = [
-        b'{"QMP": {"version": {}}}\n',  # Greeting with newline
-        b'{"return": {}}\n',  # Capabilities response with newline
-        b'{"error": {"class": "GenericError", "desc": "Test error"}}\n'  # Error response with newline
-    ]
+    assert [c[0][1]["execute"] for c in mock_qmp.call_args_list] == ["blockdev-add"]
+
+
+@patch.dict('os.environ', {'VMAN_OPERATOR_DRY_RUN': '0'}, clear=False)
+def test_attach_disk_rolls_back_node_when_device_add_fails(temp_storage):
+    """Test the block node is removed again when device_add fails."""
+    op, disk_path = _attach_operator(temp_storage)
+    error = operator.OperatorError("Bus 'pcie.0' does not support hotplugging")
+    with patch.object(op, '_is_vm_running', return_value=True), \
+         patch.object(op, '_qmp_command', side_effect=_qmp_reply({"device_add": error})) as mock_qmp:
+        with pytest.raises(operator.OperatorError, match="hotplugging"):
+            op.attach_disk("vm-1", disk_path, device="/dev/xvdb")
     
-    with pytest.raises(operator.OperatorError, match="error"):
-        test_operator._qmp_command(qmp_sock, {"execute": "test"})
+    calls = [c[0][1] for c in mock_qmp.call_args_list]
+    assert [c["execute"] for c in calls] == ["blockdev-add", "device_add", "blockdev-del"]
+    assert calls[-1]["arguments"] == {"node-name": "drive1"}
 
 
-@patch('app.operator.socket.socket')
-def test_qmp_command_timeout(mock_socket, temp_storage, test_operator):
-    """Test _qmp_command with timeout."""
-    vm_id = "test-vm"
-    vm_dir = temp_storage / "vms" / vm_id
-    vm_dir.mkdir(parents=True)
-    qmp_sock = vm_dir / "qmp.sock"
-    qmp_sock.touch()
+@patch.dict('os.environ', {'VMAN_OPERATOR_DRY_RUN': '0'}, clear=False)
+def test_detach_disk_removes_block_node(temp_storage):
+    """Test detach_disk deletes the block node after the device is gone."""
+    op, disk_path = _attach_operator(temp_storage)
+    attached = {"return": [{"device": "virtio-drive1",
+                            "inserted": {"file": str(disk_path), "node-name": "drive1"}}]}
+    replies = iter([attached, {"return": []}])
     
-    # Mock socket timeout - raise timeout on first recv
-    mock_sock = MagicMock()
-    mock_socket.return_value = mock_sock
-    import socket
-    mock_sock.recv.side_effect = socket.timeout("Connection timed out")
+    def reply(qmp_sock, command, *args, **kwargs):
+        return next(replies) if command["execute"] == "query-block" else {"return": {}}
+    
+    with patch.object(op, '_is_vm_running', return_value=True), \
+         patch.object(op, '_qmp_command', side_effect=reply) as mock_qmp, \
+         patch('app.operator.time.sleep'):
+        op.detach_disk("vm-1", disk_path)
+    
+    calls = [c[0][1] for c in mock_qmp.call_args_list]
+    assert [c["execute"] for c in calls] == ["query-block", "device_del", "query-block", "blockdev-del"]
+    assert calls[-1]["arguments"] == {"node-name": "drive1"}
+
+
+def test_qmp_command_error_response(temp_storage, test_operator):
+    """Test _qmp_command with error response."""
+    qmp_sock = _qmp_socket_path(temp_storage)
+    thread, _ = _serve_qmp(qmp_sock, b'{"QMP": {"version": {}}}\n', [
+        b'{"return": {}}\n',
+        b'{"error": {"class": "GenericError", "desc": "Test error"}}\n',
+    ])
     
-    # The error message is "QMP command timed out" or "timed out"
-    with pytest.raises(operator.OperatorError, match="timed out"):
+    with pytest.raises(operator.OperatorError, match="error"):
         test_operator._qmp_command(qmp_sock, {"execute": "test"})
+    thread.join(timeout=2)
 
 
-@patch('app.operator.socket.socket')
-def test_qmp_command_invalid_greeting(mock_socket, temp_storage, test_operator):
+def test_qmp_command_timeout(temp_storage, test_operator):
+    """Test _qmp_command with timeout."""
+    import socket
+    qmp_sock = _qmp_socket_path(temp_storage)
+    # Accepts the connection (backlog) but never sends a greeting
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(str(qmp_sock))
+    server.listen(1)
+    try:
+        with pytest.raises(operator.OperatorError, match="timed out"):
+            test_operator._qmp_command(qmp_sock, {"execute": "test"}, timeout=0.2)
+    finally:
+        server.close()
+
+
+def test_qmp_command_invalid_greeting(temp_storage, test_operator):
     """Test _qmp_command with invalid QMP greeting."""
-    vm_id = "test-vm"
-    vm_dir = temp_storage / "vms" / vm_id
-    vm_dir.mkdir(parents=True)
-    qmp_sock = vm_dir / "qmp.sock"
-    qmp_sock.touch()
-    
-    # Mock socket with invalid greeting - needs newline for recv loop
-    mock_sock = MagicMock()
-    mock_socket.return_value = mock_sock
-    mock_sock.recv.return_value = b'{"invalid": "greeting"}\n'
+    qmp_sock = _qmp_socket_path(temp_storage)
+    thread, _ = _serve_qmp(qmp_sock, b'{"invalid": "greeting"}\n', [])
     
     with pytest.raises(operator.OperatorError, match="Invalid QMP"):
         test_operator._qmp_command(qmp_sock, {"execute": "test"})
+    thread.join(timeout=2)
 
 
 def test_operator_with_network_manager(temp_storage):
@@ -328,6 +628,7 @@ def test_stop_vm_cleanup_network_resources(temp_storage):
          patch.object(op, '_is_vm_running', side_effect=[True] + [True] * 10 + [True]), \
          patch('os.kill') as mock_kill, \
          patch('time.sleep'), \
+         patch.object(op, '_wait_for_exit', return_value=False), \
          patch.object(op, '_qmp_command', side_effect=operator.OperatorError("QMP failed")):
         # VM is running, force=True skips QMP, sends SIGTERM, waits 10s (still running), 
         # then sends SIGKILL, then cleanup
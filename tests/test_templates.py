@@ -93,6 +93,19 @@ def test_delete_template_success():
     assert response.status_code == 204
 
 
+def test_recreated_template_not_served_from_cache():
+    """Test that deleting and recreating a template invalidates the cached copy."""
+    client.post("/templates", json={"name": "cached", "cpu_count": 1, "ram_amount": 1})
+    client.post("/vms", json={"template_name": "cached", "name": "cached-vm-1"})
+    client.delete("/vms/cached-vm-1")
+    client.delete("/templates/cached")
+    
+    client.post("/templates", json={"name": "cached", "cpu_count": 4, "ram_amount": 8})
+    response = client.post("/vms", json={"template_name": "cached", "name": "cached-vm-2"})
+    assert response.status_code == 201
+    assert response.json()["vm_template"]["cpu_count"] == 4
+
+
 def test_delete_template_not_found():
     """Test deleting non-existent template."""
     response = client.delete("/templates/nonexistent")
@@ -109,6 +122,7 @@ def test_delete_template_in_use():
     response = client.delete("/templates/used")
     assert response.status_code == 400
     assert "in use" in response.json()["detail"].lower()
+    assert "1 VM(s)" in response.json()["detail"]
 
 
 def test_template_security_sql_injection():
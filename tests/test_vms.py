@@ -47,6 +47,10 @@ def test_create_vm_with_name(template):
         response = client.post("/vms", json={"template_name": "test", "name": "my-vm"})
         assert response.status_code == 201
         assert response.json()["id"] == "my-vm"
+    
+    # The NIC's MAC is recorded so the metadata service can look it up
+    with db.SessionLocal() as session:
+        assert session.get(models.VM, "my-vm").mac == operator.vm_mac_address("my-vm")
 
 
 def test_create_vm_template_not_found():
@@ -56,6 +60,22 @@ def test_create_vm_template_not_found():
     assert "not found" in response.json()["detail"].lower()
 
 
+def test_create_vm_rechecks_cached_template(template):
+    """Test a template deleted behind the cache's back is rejected at insert time."""
+    from app import main
+    session = db.SessionLocal()
+    try:
+        assert main._get_template(session, "test") is not None  # now cached
+        session.query(models.VMTemplate).filter(models.VMTemplate.name == "test").delete()
+        session.commit()
+    finally:
+        session.close()
+    
+    response = client.post("/vms", json={"template_name": "test", "name": "orphan-vm"})
+    assert response.status_code == 400
+    assert "Template not found" in response.json()["detail"]
+    assert client.get("/vms/orphan-vm").status_code == 404
+
 def test_create_vm_duplicate_id(template):
     """Test creating VM with duplicate ID."""
     client.post("/vms", json={"template_name": "test", "name": "duplicate"})
@@ -81,6 +101,40 @@ def test_list_vms_filter_by_state(template):
     assert all(vm["state"] == "stopped" for vm in data)
 
 
+def test_list_vms_includes_templates(template):
+    """Test listing VMs returns template details for every VM."""
+    client.post("/templates", json={"name": "large", "cpu_count": 8, "ram_amount": 16})
+    client.post("/vms", json={"template_name": "test", "name": "vm-small"})
+    client.post("/vms", json={"template_name": "large", "name": "vm-large"})
+    
+    response = client.get("/vms")
+    assert response.status_code == 200
+    templates = {vm["id"]: vm["vm_template"] for vm in response.json()}
+    assert templates["vm-small"] == {"name": "test", "cpu_count": 2, "ram_amount": 4}
+    assert templates["vm-large"] == {"name": "large", "cpu_count": 8, "ram_amount": 16}
+
+
+def test_list_vms_single_query(template):
+    """Test listing VMs does not issue a template query per VM."""
+    from sqlalchemy import event
+    
+    for i in range(3):
+        client.post("/vms", json={"template_name": "test", "name": f"vm-{i}"})
+    
+    statements = []
+    
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+    
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        response = client.get("/vms")
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+    assert len(response.json()) == 3
+    assert sum(s.lstrip().upper().startswith("SELECT") for s in statements) == 1
+
+
 def test_get_vm_success(template):
     """Test getting VM details."""
     create_response = client.post("/vms", json={"template_name": "test"})
@@ -110,6 +164,30 @@ def test_delete_vm_success(template):
         assert response.status_code == 204
 
 
+def test_delete_vm_detaches_disks(template):
+    """Test that deleting a VM releases all of its attached disks."""
+    client.post("/vms", json={"template_name": "test", "name": "vm-with-disks"})
+    db_session = db.SessionLocal()
+    try:
+        for disk_id in ("disk-a", "disk-b"):
+            db_session.add(models.Disk(id=disk_id, size=1, state="attached",
+                                       vm_id="vm-with-disks", mount_point="/dev/xvdb"))
+        db_session.commit()
+    finally:
+        db_session.close()
+    
+    response = client.delete("/vms/vm-with-disks")
+    assert response.status_code == 204
+    
+    db_session = db.SessionLocal()
+    try:
+        disks = db_session.query(models.Disk).all()
+        assert len(disks) == 2
+        assert all(d.vm_id is None and d.state == "available" and d.mount_point is None for d in disks)
+    finally:
+        db_session.close()
+
+
 def test_delete_vm_not_found():
     """Test deleting non-existent VM."""
     response = client.delete("/vms/nonexistent")
@@ -121,7 +199,7 @@ def test_start_vm_success(template):
     with patch('app.main._operator') as mock_operator, \
          patch('app.main._network_manager', None):
         mock_operator.storage_path = "/tmp/test"
-        mock_operator.start_vm = MagicMock()
+        mock_operator.start_vm = MagicMock(return_value=None)
         
         create_response = client.post("/vms", json={"template_name": "test"})
         vm_id = create_response.json()["id"]
@@ -131,6 +209,38 @@ def test_start_vm_success(template):
         assert response.status_code in [202, 400]  # 400 if QEMU not available, 202 if dry-run works
 
 
+def test_start_vm_runs_operator_in_pool(template):
+    """Test that the operator call runs on the operator thread pool."""
+    import threading
+    threads = []
+    with patch('app.main._operator') as mock_operator, \
+         patch('app.main._network_manager', None):
+        mock_operator.storage_path = "/tmp/test"
+        mock_operator.start_vm = MagicMock(
+            side_effect=lambda **kwargs: threads.append(threading.current_thread().name)
+        )
+        
+        client.post("/vms", json={"template_name": "test", "name": "pooled-vm"})
+        response = client.post("/vms/pooled-vm/actions/start")
+        assert response.status_code == 202
+        assert threads and threads[0].startswith("operator")
+
+
+def test_start_vm_requests_observer_check(template):
+    """Test that starting a VM wakes the observer for an immediate coherence check."""
+    with patch('app.main._operator') as mock_operator, \
+         patch('app.main._network_manager', None), \
+         patch('app.main._observer') as mock_observer:
+        mock_operator.storage_path = "/tmp/test"
+        mock_operator.start_vm = MagicMock(return_value=None)
+        
+        client.post("/vms", json={"template_name": "test", "name": "observed-vm"})
+        mock_observer.request_check.reset_mock()
+        response = client.post("/vms/observed-vm/actions/start")
+        assert response.status_code == 202
+        mock_observer.request_check.assert_called_once_with()
+
+
 def test_start_vm_already_running(template):
     """Test starting an already running VM."""
     with patch('app.main._operator') as mock_operator:
@@ -172,7 +282,7 @@ def test_restart_vm_success(template):
          patch('app.main._network_manager', None):
         mock_operator.storage_path = "/tmp/test"
         mock_operator.stop_vm = MagicMock()
-        mock_operator.start_vm = MagicMock()
+        mock_operator.start_vm = MagicMock(return_value=None)
         
         create_response = client.post("/vms", json={"template_name": "test"})
         vm_id = create_response.json()["id"]